@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+
+
+"""
+Adjustments of the predictions before they are written, which replace the
+post-processing of the output file by score_hack2.py. The first transaction
+of an account scores 100 (band 1), and the second one has its final score
+discounted by 25% and its band moved to 2 + band / 5, rounded to one decimal.
+A transaction repeated with the same `unixtime` and `sessionid` is written
+once, with the predictions of its last repetition, and the transactions are
+ranked without the repetitions dropped: by `num_transactions`, so that the
+accounts continued from a state store keep their history, less the
+repetitions of the account dropped before, which are counted in the account
+states (as `repeated_transactions`) when given.
+"""
+
+
+SECOND_TRANSACTION_DISCOUNT = 0.75
+
+
+def _keys(ret):
+    return pd.MultiIndex.from_arrays([ret['unixtime'].values,
+                                      ret['sessionid'].values])
+
+
+def _count_repeated(states, accounts, uniques, repeated):
+    # Adds the repeated transactions dropped to the states of their accounts
+    counts = np.bincount(accounts[repeated & (accounts >= 0)],
+                         minlength=len(uniques))
+    for i in np.flatnonzero(counts):
+        account_states = states.setdefault(uniques[i], {})
+        account_states['repeated_transactions'] = \
+            account_states.get('repeated_transactions', 0) + int(counts[i])
+
+
+@profiling.profiled
+def adjust_scores(ret, times, states=None):
+    """
+    Adjusts the final scores and final bands of the predictions given the
+    times of their transactions, which are kept in the `unixtime` column,
+    and drops the repeated transactions. The states of the accounts, if
+    given, are updated with the number of their repetitions dropped.
+    """
+    ret['unixtime'] = times
+    repeated = _keys(ret).duplicated(keep='last')
+
+    # The repetitions of an account dropped before each of its transactions
+    # (those of the frame ranked before it, and those of the states)
+    num_transactions = ret['num_transactions'].values
+    accounts, uniques = pd.factorize(ret['accountid'].values)
+    order = np.lexsort((num_transactions, accounts))
+    earlier = np.empty(len(ret), dtype=np.int64)
+    earlier[order] = pd.Series(repeated[order]).groupby(
+        accounts[order]).cumsum().values - repeated[order]
+    if states is not None:
+        previous = np.array([states[a].get('repeated_transactions', 0)
+                             if a in states else 0 for a in uniques] + [0],
+                            dtype=np.int64)
+        earlier += previous[accounts]
+        _count_repeated(states, accounts, uniques, repeated)
+    num_transactions = num_transactions - earlier
+
+    finalscore = ret['finalscore'].values.copy()
+    finalband = ret['finalband'].values.copy()
+
+    first = num_transactions == 1
+    finalscore[first] = 100.
+    finalband[first] = 1.
+
+    second = num_transactions == 2
+    finalscore[second] *= SECOND_TRANSACTION_DISCOUNT
+    finalband[second] = np.round(2. + finalband[second] / 5., 1)
+
+    ret['finalscore'] = finalscore
+    ret['finalband'] = finalband
+
+    return ret[~repeated].reset_index(drop=True)
+
+
+def drop_repeated(ret, later, states=None):
+    """
+    Drops the transactions of the adjusted predictions `ret` repeated in the
+    transactions `later` (e.g. the next chunk of the input), which are then
+    adjusted with the states of the accounts, updated with the number of
+    their repetitions dropped.
+    """
+    repeated = _keys(ret).isin(_keys(later))
+    if states is not None:
+        accounts, uniques = pd.factorize(ret['accountid'].values)
+        _count_repeated(states, accounts, uniques, repeated)
+    return ret[~repeated].reset_index(drop=True)
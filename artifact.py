@@ -0,0 +1,250 @@
+import numpy as np
+import json
+
+from hashing import STR, BOOL, INT, FLOAT, NONE, tag_text, value_hash
+from sketch import CountMinSketch
+
+
+"""
+Binary artifact with the fitted state of the models, so that the scoring
+runs can skip the fit. The artifact is a NumPy .npz archive without pickled
+objects: a JSON header with the format version and the scalar parameters,
+the frequency tables of the endpoint model stored as array-backed
+dictionary encodings (a values dictionary and an array of frequencies aligned
+with it), and the arrays of the compiled fraud list index (see fraudlist.py).
+Each frequency table is also stored sorted by the 64-bit hashes of its values
+(see hashing.py), so that the fast-start runtime (see runtime.py) looks up
+the values it scores without decoding the whole tables. The approximate
+tables (see utils.ApproximateFrequencyTable) store their heavy hitters as the
+exact tables do, along with the counts of their count-min sketch and its
+total. The history policies of the endpoint and shipping models (see
+engine.py) are parameters of the header, so that every scoring path bounds
+the account histories alike. Only the artifacts of the current version can
+be loaded.
+"""
+
+
+FORMAT = 'risk-reputation-model'
+VERSION = 5
+
+def encode_values(values):
+    """
+    Encodes a sequence of str, bool, int, float and None values into a type
+    tag array, an offsets array and a UTF-8 blob.
+    """
+    tags = np.empty(len(values), dtype=np.uint8)
+    texts = []
+    for i, value in enumerate(values):
+        tags[i], text = tag_text(value)
+        texts.append(text.encode('utf-8'))
+
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(t) for t in texts])
+    blob = np.frombuffer(b''.join(texts), dtype=np.uint8)
+
+    return tags, offsets, blob
+
+
+def decode_values(tags, offsets, blob):
+    """ Decodes the values encoded by `encode_values`. """
+    decoders = {STR: lambda t: t,
+                BOOL: lambda t: t == '1',
+                INT: int,
+                FLOAT: float,
+                NONE: lambda t: None}
+    blob = blob.tobytes()
+    return [decoders[tag](blob[start: end].decode('utf-8'))
+            for tag, start, end in zip(tags.tolist(), offsets[:-1].tolist(),
+                                       offsets[1:].tolist())]
+
+
+class FrequencyLookup(object):
+    """
+    Frequencies of the values of a table, looked up by the hashes of the
+    values (see hashing.value_hash). A hash collision (one in about 10^13
+    lookups with a million values) finds the frequency of another value. The
+    values of an approximate table that are not found are estimated with its
+    sketch, given the total count of the table.
+    """
+    def __init__(self, hashes, frequencies, sketch=None, total=None):
+        self.hashes = hashes
+        self.frequencies = frequencies
+        self.sketch = sketch
+        self.total = total
+
+    def get(self, value, default=None):
+        try:
+            h = np.uint64(value_hash(value))
+        except TypeError:
+            return default
+        i = np.searchsorted(self.hashes, h)
+        if i < len(self.hashes) and self.hashes[i] == h:
+            return float(self.frequencies[i])
+        if self.sketch is not None:
+            count = self.sketch.estimate_one(int(h))
+            if count:
+                return count / self.total
+        return default
+
+
+def _put_values(arrays, name, values):
+    tags, offsets, blob = encode_values(values)
+    arrays[name + '/tags'] = tags
+    arrays[name + '/offsets'] = offsets
+    arrays[name + '/blob'] = blob
+
+
+def _get_values(archive, name):
+    return decode_values(archive[name + '/tags'], archive[name + '/offsets'],
+                         archive[name + '/blob'])
+
+
+def save_model(filename, fraud, endpoint=None, shipping=None):
+    """
+    Saves the fitted state of a FraudTransformer and, optionally, of a
+    fitted EndpointScorer and the parameters of a ShippingScorer.
+    """
+    header = {'format': FORMAT, 'version': VERSION}
+    arrays = {}
+
+    for name, values in fraud.fraud_index.arrays().items():
+        arrays['fraud/' + name] = np.asarray(values)
+
+    if endpoint is not None:
+        features = list(endpoint.global_frequencies)
+        header['endpoint'] = {
+            'universe_prior': endpoint.universe_prior,
+            'features': features,
+            'relevance': [float(endpoint.ft_relevance[f]) for f in features],
+            'window': endpoint.window,
+            'half_life': endpoint.half_life
+            }
+        for i, f in enumerate(features):
+            table = endpoint.global_frequencies[f]
+            _put_values(arrays, 'endpoint/%d/values' % i, list(table))
+            arrays['endpoint/%d/frequencies' % i] = table.frequencies
+
+            hashes = np.fromiter((value_hash(v) for v in table),
+                                 dtype=np.uint64, count=len(table))
+            order = np.argsort(hashes, kind='stable')
+            arrays['endpoint/%d/hashes' % i] = hashes[order]
+            arrays['endpoint/%d/hash_frequencies' % i] = \
+                table.frequencies[order]
+
+            if getattr(table, 'sketch', None) is not None:
+                arrays['endpoint/%d/sketch' % i] = table.sketch.counts
+                arrays['endpoint/%d/total' % i] = np.int64(table.total)
+
+    if shipping is not None:
+        header['shipping'] = {'window': shipping.window,
+                              'half_life': shipping.half_life}
+
+    arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'),
+                                     dtype=np.uint8)
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def _read_header(archive, filename):
+    header = json.loads(archive['header'].tobytes().decode('utf-8'))
+    if header.get('format') != FORMAT:
+        raise ValueError('%s is not a model artifact' % filename)
+    if header.get('version') != VERSION:
+        raise ValueError('Unsupported model artifact version %s of %s, only '
+                         'version %d can be loaded: save the model again' %
+                         (header.get('version'), filename, VERSION))
+    return header
+
+
+def _read_fraud_index(archive):
+    from fraudlist import FraudIndex, ARRAYS
+
+    return FraudIndex(**{name: archive['fraud/' + name] for name in ARRAYS})
+
+
+def load_model(filename):
+    """
+    Loads an artifact saved by `save_model`. Returns a dictionary with the
+    FraudTransformer ('fraud'), the EndpointScorer ('endpoint') and the
+    ShippingScorer ('shipping'), None if they were not saved.
+    """
+    # Imported here to keep the artifact readable without the models
+    from preprocessing import FraudTransformer
+    from models import EndpointScorer, ShippingScorer
+    from utils import FrequencyTable, ApproximateFrequencyTable
+
+    with np.load(filename, allow_pickle=False) as archive:
+        header = _read_header(archive, filename)
+
+        fraud = FraudTransformer(fraud_filename=None)
+        fraud.fraud_index = _read_fraud_index(archive)
+
+        endpoint = None
+        if 'endpoint' in header:
+            params = header['endpoint']
+            endpoint = EndpointScorer(universe_prior=params['universe_prior'],
+                                      window=params['window'],
+                                      half_life=params['half_life'])
+            endpoint.global_frequencies = {}
+            for i, f in enumerate(params['features']):
+                values = _get_values(archive, 'endpoint/%d/values' % i)
+                frequencies = archive['endpoint/%d/frequencies' % i]
+                if 'endpoint/%d/sketch' % i in archive:
+                    endpoint.global_frequencies[f] = \
+                        ApproximateFrequencyTable(
+                            values, frequencies,
+                            CountMinSketch(
+                                counts=archive['endpoint/%d/sketch' % i]),
+                            int(archive['endpoint/%d/total' % i]))
+                else:
+                    endpoint.global_frequencies[f] = FrequencyTable(
+                        values, frequencies)
+            endpoint.ft_relevance = dict(zip(params['features'],
+                                             params['relevance']))
+
+        shipping = None
+        if 'shipping' in header:
+            shipping = ShippingScorer(**header['shipping'])
+
+    return {'fraud': fraud, 'endpoint': endpoint, 'shipping': shipping}
+
+
+def load_tables(filename):
+    """
+    Loads an artifact saved by `save_model` without the models (nor pandas).
+    Returns a dictionary with the FraudIndex ('fraud_index') and the
+    parameters of the endpoint model ('endpoint', None if it was not saved):
+    'universe_prior', 'ft_relevance', 'global_frequencies', the frequency
+    lookups of the features, 'window' and 'half_life'. The history policy of
+    the shipping model ('shipping', with 'window' and 'half_life') is None if
+    it was not saved.
+    """
+    with np.load(filename, allow_pickle=False) as archive:
+        header = _read_header(archive, filename)
+        fraud_index = _read_fraud_index(archive)
+
+        endpoint = None
+        if 'endpoint' in header:
+            params = header['endpoint']
+            frequencies = {}
+            for i, f in enumerate(params['features']):
+                if 'endpoint/%d/sketch' % i in archive:
+                    frequencies[f] = FrequencyLookup(
+                        archive['endpoint/%d/hashes' % i],
+                        archive['endpoint/%d/hash_frequencies' % i],
+                        CountMinSketch(
+                            counts=archive['endpoint/%d/sketch' % i]),
+                        int(archive['endpoint/%d/total' % i]))
+                else:
+                    frequencies[f] = FrequencyLookup(
+                        archive['endpoint/%d/hashes' % i],
+                        archive['endpoint/%d/hash_frequencies' % i])
+            endpoint = {'universe_prior': params['universe_prior'],
+                        'ft_relevance': dict(zip(params['features'],
+                                                 params['relevance'])),
+                        'global_frequencies': frequencies,
+                        'window': params['window'],
+                        'half_life': params['half_life']}
+
+    return {'fraud_index': fraud_index, 'endpoint': endpoint,
+            'shipping': header.get('shipping')}
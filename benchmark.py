@@ -0,0 +1,109 @@
+import argparse
+import time
+import json
+
+import utils
+from profiling import peak_rss_mb
+from preprocessing import FraudTransformer
+from fraudlist import FraudIndex
+from pipeline import build_model
+from signals import apply_signals
+from synthetic import generate
+
+
+"""
+Benchmarks of the scoring stages on synthetic transactions (see
+synthetic.py). For each input size, every stage is timed on its own: the
+fraud features, the feature transformer, fit and scoring of each submodel,
+the full ModelMerger and the signal penalties. The rows per second of each
+stage make regressions of the per-account paths visible as the inputs grow.
+
+The memory reported is the peak resident size of the process after each
+stage, and how much the stage raised it.
+"""
+
+
+def measure(results, stage, rows, func, *args, **kwargs):
+    """ Runs func as a stage, appending its metrics to results. """
+    peak = peak_rss_mb()
+    start = time.perf_counter()
+    ret = func(*args, **kwargs)
+    wall = time.perf_counter() - start
+
+    results.append({'stage': stage,
+                    'rows': rows,
+                    'wall_s': wall,
+                    'rows_per_s': rows / wall if wall > 0 else float('inf'),
+                    'peak_rss_mb': peak_rss_mb(),
+                    'peak_rss_growth_mb': peak_rss_mb() - peak})
+    return ret
+
+
+def benchmark(n_rows, seed=0):
+    """ Returns the metrics of the stages for `n_rows` transactions. """
+    results = []
+    df, fraud_list = measure(results, 'generate', n_rows, generate, n_rows,
+                             seed=seed)
+    df['_artificial_index_'] = range(len(df))
+
+    fraud = FraudTransformer(fraud_filename=None)
+    fraud.fraud_index = FraudIndex.from_values(
+        fraud_list['customer_email'].values, fraud_list['ip'].values)
+    model = build_model(fraud)
+    merger = model.named_steps['models']
+
+    X = measure(results, 'fraud', n_rows, fraud.fit_transform, df)
+    groups = measure(results, 'groups', n_rows,
+                     utils.AccountGroups.from_frame, X)
+
+    for name, estimator, _ in merger.estimators:
+        features, scorer = estimator[:-1], estimator[-1]
+        Xt = measure(results, name + '/features', n_rows,
+                     features.fit_transform, X)
+        measure(results, name + '/fit', n_rows, scorer.fit, Xt)
+        measure(results, name + '/score', n_rows, scorer.predict_grouped, Xt,
+                groups)
+
+    ret = measure(results, 'merger', n_rows, merger.predict, X)
+    measure(results, 'signals', n_rows, apply_signals, ret,
+            df['eventtriggeredsignals'].values)
+
+    return results
+
+
+def print_results(results):
+    print('%-28s %10s %10s %14s %12s %12s' %
+          ('stage', 'rows', 'wall (s)', 'rows/s', 'peak (MB)', '+peak (MB)'))
+    for r in results:
+        print('%-28s %10d %10.3f %14.0f %12.1f %12.1f' %
+              (r['stage'], r['rows'], r['wall_s'], r['rows_per_s'],
+               r['peak_rss_mb'], r['peak_rss_growth_mb']))
+    print('')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+                        description="Scoring benchmarks",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', metavar="R", nargs='+', type=int,
+                        default=[10000, 1000000, 10000000],
+                        help='Input sizes to benchmark')
+    parser.add_argument('--seed', metavar="SE", nargs='?', type=int,
+                        default=0, help='Random seed of the inputs')
+    parser.add_argument('--output', metavar="O", nargs='?', default=None,
+                        help='Path of a JSON file with the results')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+
+    results = []
+    for n_rows in args.rows:
+        results_ = benchmark(n_rows, args.seed)
+        print_results(results_)
+        results.extend(results_)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
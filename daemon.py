@@ -0,0 +1,261 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+import threading
+import argparse
+import signal
+import json
+import os
+
+from artifact import load_model
+from pipeline import build_model
+from preprocessing import FraudTransformer
+from signals import apply_record_signals
+from store import AccountStore, plain_states
+
+
+"""
+Resident scoring process for real-time decisions. The fitted model, the fraud
+list and the account states are loaded once, and the transactions (in the
+input schema of run.py, as JSON objects) are scored one at a time with the
+online engines, updating the account states in place.
+
+Two transports are available, both local only:
+    - a Unix socket (--socket) taking one JSON transaction, or a JSON list
+      of transactions (a micro-batch), per line and answering one JSON line;
+    - an HTTP endpoint on localhost (--port) taking the same JSON as the
+      body of a POST to /score.
+
+The transactions of an account must be sent in time order. The transactions
+of a micro-batch are all checked before any account state changes, so that
+a rejected micro-batch can be sent again. With a state store, the states of
+the accounts are read from it the first time they are seen and written back
+periodically and on shutdown, without holding up the scoring while they are
+written. With a fraud list file (instead of the fraud list of the model), the
+changes of the file are picked up periodically.
+"""
+
+
+OUTPUT_FIELDS = ['sessionid', 'accountid', 'endpointscore', 'purchasescore',
+                 'shippingscore', 'finalscore', 'finalband', 'fraudlistentry',
+                 'signalstriggered']
+
+
+class ScoringService(object):
+    def __init__(self, model_filename, state_store=None, fraud_list=None,
+                 endpoint=True, shipping=True, purchase=True):
+        fitted = load_model(model_filename)
+        if endpoint and fitted['endpoint'] is None:
+            raise ValueError('The model %s has no endpoint model' %
+                             model_filename)
+
+        fraud = fitted['fraud']
+        if fraud_list is not None:
+            fraud = FraudTransformer(fraud_filename=fraud_list)
+        model = build_model(fraud, fitted['endpoint'],
+                            endpoint=endpoint, shipping=shipping,
+                            purchase=purchase,
+                            shipping_scorer=fitted['shipping'])
+        self.fraud = model.named_steps['fraud']
+        self.merger = model.named_steps['models']
+
+        self.store = None
+        if state_store is not None:
+            self.store = AccountStore(state_store)
+        self.states = {}
+        self.updated = set([])
+        self.lock = threading.Lock()
+        # The flushes write their snapshots of the states in order
+        self.flush_lock = threading.Lock()
+
+    def score(self, records):
+        """
+        Scores a transaction, or a list of transactions, given as
+        dictionaries. A list is scored only if all its transactions can be
+        scored, and an error is raised otherwise.
+        """
+        if isinstance(records, dict):
+            return self.score([records])[0]
+
+        with self.lock:
+            checked = [self._check(record) for record in records]
+            accounts = set([record['accountid'] for record in records])
+            new = [a for a in accounts if a not in self.states]
+
+        # The states of the new accounts are read without the lock, while a
+        # flush may be writing to the store
+        loaded = {}
+        if self.store is not None and new:
+            loaded = self.store.load(new)
+
+        with self.lock:
+            for account, account_states in loaded.items():
+                self.states.setdefault(account, account_states)
+
+            ret = [self._score(*c) for c in checked]
+            self.updated.update(accounts)
+            return ret
+
+    def _check(self, record):
+        # Features of a transaction, values of the features of the
+        # submodels and signals, raising an error if it can not be scored
+        if not isinstance(record, dict):
+            raise TypeError('A transaction must be a JSON object')
+        if 'accountid' not in record:
+            raise KeyError('accountid')
+        signals = record.get('eventtriggeredsignals') or '[]'
+        if not isinstance(signals, str):
+            raise TypeError('The eventtriggeredsignals must be a string')
+
+        features = self.fraud.transform_record(record)
+        return features, self.merger.record_features(features), signals
+
+    def _score(self, features, values, signals):
+        ret = self.merger.predict_record(features, self.states, values)
+        ret = apply_record_signals(ret, signals)
+
+        return {f: ret[f] for f in OUTPUT_FIELDS if f in ret}
+
+    def flush(self):
+        """ Writes the updated account states to the store. """
+        if self.store is None:
+            return
+
+        with self.flush_lock:
+            # The states are copied, and written without the lock
+            with self.lock:
+                snapshot = {a: plain_states(self.states[a])
+                            for a in self.updated if a in self.states}
+                self.updated = set([])
+
+            try:
+                self.store.save(snapshot)
+            except Exception:
+                # Written by the next flush
+                with self.lock:
+                    self.updated.update(snapshot)
+                raise
+
+    def reload_fraud_list(self):
+        """ Switches to the new fraud list if the file changed. """
+        # The index is replaced at once, so the scoring is not interrupted
+        return self.fraud.reload()
+
+    def close(self):
+        self.flush()
+        if self.store is not None:
+            self.store.close()
+
+
+def _answer(service, request):
+    try:
+        return service.score(json.loads(request))
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return {'error': '%s: %s' % (type(e).__name__, e)}
+
+
+class SocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            answer = _answer(self.server.service, line)
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        answer = _answer(self.server.service, self.rfile.read(length))
+        body = json.dumps(answer).encode('utf-8')
+
+        self.send_response(400 if 'error' in answer else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+                        description="Fraud detection scoring daemon",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', metavar="M", required=True,
+                        help='Path of the fitted model (see run.py '
+                             '--save-model)')
+    parser.add_argument('--state-store', metavar="SS", nargs='?',
+                        default=None, help='Path of the account state store')
+    parser.add_argument('--fraud-list', metavar="F", nargs='?', default=None,
+                        help='Path of the fraud file, reloaded when it '
+                             'changes (the fraud list of the model if not '
+                             'given)')
+    parser.add_argument('--socket', metavar="SO", nargs='?', default=None,
+                        help='Path of the Unix socket to listen on')
+    parser.add_argument('--port', metavar="PO", nargs='?', type=int,
+                        default=None,
+                        help='Port to listen on for HTTP, on localhost')
+    parser.add_argument('--flush-interval', metavar="FI", nargs='?',
+                        type=float, default=10.,
+                        help='Seconds between writes of the account states '
+                             'to the store, and checks of the fraud list')
+    parser.add_argument('--endpoint-model', metavar="E", nargs='?', type=int,
+                        default=1, help='Use Endpoint model (1-0)')
+    parser.add_argument('--shipping-model', metavar="S", nargs='?', type=int,
+                        default=1, help='Use Shipping model (1-0)')
+    parser.add_argument('--purchase-model', metavar="P", nargs='?', type=int,
+                        default=1, help='Use Purchase model (1-0)')
+    args = parser.parse_args()
+    if (args.socket is None) == (args.port is None):
+        parser.error('exactly one of --socket and --port is required')
+    return args
+
+
+def main():
+    args = get_args()
+    service = ScoringService(args.model, args.state_store, args.fraud_list,
+                             endpoint=args.endpoint_model != 0,
+                             shipping=args.shipping_model != 0,
+                             purchase=args.purchase_model != 0)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = socketserver.ThreadingUnixStreamServer(args.socket,
+                                                        SocketHandler)
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', args.port), HTTPHandler)
+    server.daemon_threads = True
+    server.service = service
+
+    # Write the account states and reload the fraud list periodically
+    stopped = threading.Event()
+
+    def maintain():
+        while not stopped.wait(args.flush_interval):
+            service.flush()
+            service.reload_fraud_list()
+    threading.Thread(target=maintain, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(
+        target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        service.close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,649 @@
+from collections import deque
+import numpy as np
+
+
+"""
+Online scoring engines. Each engine keeps the running state of a single
+account (value counts and the current maximum count for every feature, or the
+cart types of the last transactions) and scores a new transaction in O(1) per
+feature, instead of rescanning the whole account history for every
+transaction, with exactly the same scores.
+
+The value counts of the endpoint and shipping engines can be bounded by a
+history policy: counting only the last `window` transactions of the account,
+or decaying the counts by half every `half_life` seconds of `unixtime` (see
+WindowState and DecayedState). The frequencies of the values are then
+relative to the transactions counted, while the discount of the first
+transactions of an account still depends on all of them.
+
+The account states can be converted to and from plain dictionaries (see
+`state_from_dict`), so that they can be persisted between runs.
+
+Single transactions, given as dictionaries, are scored by `score_record`
+with the engines of the submodels, the record path of both the models (see
+ModelMerger.predict_record) and the fast-start runtime.
+
+The module only depends on NumPy, so that it can be used by the fast-start
+runtime (see runtime.py) as well as by the scorers.
+"""
+
+
+# Weights of the submodel scores in the final score
+WEIGHTS = {'endpointscore': 0.25,
+           'shippingscore': 0.50,
+           'purchasescore': 0.25}
+
+# Discount of the final score of the transactions from the IPs of the fraud
+# list
+FRAUD_IP_DISCOUNT = 0.0
+
+# Frequency of the values unknown to the endpoint model
+EPSILON = 1e-10
+
+# Relevance of the features of the shipping model
+SHIPPING_RELEVANCE = {
+    'shippingcountry': 2,
+    'shippingzipcode': 2,
+    'shippingstreet': 1,
+    'shippingstate': 2.5,
+    'shippingphonenumber': 0.5,
+    'shippingnamefirst': 0.5,
+    'shippingnamelast': 0.5,
+    'billingzipcode': 1
+    }
+
+# Number of previous carts compared by the purchase model
+PURCHASE_WINDOW = 10
+
+# Half-lives between the moves of the reference time of a decayed state, and
+# decayed counts dropped when it moves
+REBASE_HALF_LIVES = 32
+MIN_DECAYED_COUNT = 1e-6
+
+
+def _is_missing(value):
+    return type(value) is float and value != value
+
+
+class _Missing(object):
+    """
+    Key of the missing values. All the missing values of a feature share a
+    single count, as np.nan does when counting the values of an object
+    column.
+    """
+    def __reduce__(self):
+        # Unpickled as the same singleton
+        return 'MISSING'
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def _plain(value):
+    # NumPy scalars (e.g. the values of a boolean column) as Python values
+    if value is MISSING:
+        return float('nan')
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _key(value):
+    # None (e.g. a field missing from a payload) is a missing value as well
+    return MISSING if value is None or _is_missing(value) else value
+
+
+def pair_value(a, b):
+    """
+    Value of a pair of features with values `a` and `b`, missing if any of
+    them is missing.
+    """
+    if a is None or b is None or a != a or b != b:
+        return np.nan
+    return a + '|||' + b
+
+
+def pairwise_sum(values):
+    """
+    Sum of a list of floats, added in the order of the pairwise summation of
+    np.sum (one by one below 8 values, in 8 partial sums up to 128 values,
+    by halves above), so that it is the same without the overhead of NumPy
+    on a few values.
+    """
+    n = len(values)
+    if n < 8:
+        ret = 0.
+        for v in values:
+            ret += v
+        return ret
+    if n > 128:
+        half = n // 2
+        half -= half % 8
+        return pairwise_sum(values[:half]) + pairwise_sum(values[half:])
+
+    end = n - n % 8
+    sums = list(values[:8])
+    for i in range(8, end, 8):
+        sums = [a + b for a, b in zip(sums, values[i: i + 8])]
+    ret = ((sums[0] + sums[1]) + (sums[2] + sums[3])) + \
+        ((sums[4] + sums[5]) + (sums[6] + sums[7]))
+    for v in values[end:]:
+        ret += v
+    return ret
+
+
+def weighted_mean(values, weights):
+    """ Same as np.average(values, weights=weights) on lists of floats. """
+    return pairwise_sum([v * w for v, w in zip(values, weights)]) / \
+        pairwise_sum(weights)
+
+
+def merge_scores(scores, weights, fraud_discount=1.):
+    """
+    Final score and final band of a transaction given the scores of the
+    submodels and their weights.
+    """
+    finalscore = 0.
+    for score, weight in zip(scores, weights):
+        finalscore += score * weight * fraud_discount
+    finalscore = finalscore / pairwise_sum(weights)
+
+    return finalscore, 1 + 4. * (1. - finalscore / 100.)
+
+
+class CountsState(object):
+    """
+    Number of transactions of an account, and the count of each value and
+    the maximum count of every feature.
+    """
+    __slots__ = ('n', 'counts', 'max_counts')
+    kind = 'counts'
+
+    def __init__(self):
+        self.n = 0
+        self.counts = {}
+        self.max_counts = {}
+
+    @property
+    def size(self):
+        """ Number (or weight) of the transactions counted. """
+        return self.n
+
+    def observe(self, features, keys, time=None):
+        """
+        Counts the values of a new transaction, one per feature, and returns
+        their counts.
+        """
+        self.n += 1
+        return [self.add(f, key) for f, key in zip(features, keys)]
+
+    def add(self, feature, value, weight=1):
+        """ Counts a value and returns its count. """
+        counts = self.counts.get(feature)
+        if counts is None:
+            counts = self.counts[feature] = {}
+            self.max_counts[feature] = 0
+        count = counts.get(value, 0) + weight
+        counts[value] = count
+        if count > self.max_counts[feature]:
+            self.max_counts[feature] = count
+        return count
+
+    def to_dict(self):
+        return {'kind': self.kind, 'n': self.n,
+                'counts': {f: [[_plain(v), c] for v, c in counts.items()]
+                           for f, counts in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, d):
+        ret = cls()
+        ret.n = d['n']
+        for f, counts in d['counts'].items():
+            ret.counts[f] = {_key(v): c for v, c in counts}
+            ret.max_counts[f] = max([c for _, c in counts] + [0])
+        return ret
+
+
+
+class WindowState(CountsState):
+    """
+    Number of transactions of an account, and the counts of the values of
+    its last `window` transactions.
+    """
+    __slots__ = ('window', 'recent')
+    kind = 'window'
+
+    def __init__(self, window):
+        super(WindowState, self).__init__()
+        self.window = window
+        self.recent = deque()
+
+    @property
+    def size(self):
+        return len(self.recent)
+
+    def observe(self, features, keys, time=None):
+        self.n += 1
+        self._push(features, keys)
+        return [self.counts[f][key] for f, key in zip(features, keys)]
+
+    def _push(self, features, keys):
+        for f, key in zip(features, keys):
+            self.add(f, key)
+        self.recent.append(tuple(keys))
+        if len(self.recent) > self.window:
+            for f, key in zip(features, self.recent.popleft()):
+                self.remove(f, key)
+
+    def remove(self, feature, value):
+        """ Uncounts a value. """
+        counts = self.counts[feature]
+        count = counts[value] - 1
+        if count:
+            counts[value] = count
+        else:
+            del counts[value]
+        if count + 1 == self.max_counts[feature]:
+            self.max_counts[feature] = max(list(counts.values()) + [0])
+
+    def to_dict(self):
+        return {'kind': self.kind, 'n': self.n, 'window': self.window,
+                'features': list(self.counts),
+                'recent': [[_plain(v) for v in keys]
+                           for keys in self.recent]}
+
+    @classmethod
+    def from_dict(cls, d):
+        ret = cls(d['window'])
+        for keys in d['recent']:
+            ret._push(d['features'], [_key(v) for v in keys])
+        ret.n = d['n']
+        return ret
+
+
+class DecayedState(CountsState):
+    """
+    Number of transactions of an account, and the counts of its values
+    decayed by half every `half_life` seconds. The counts are weighted
+    relative to a reference time, which moves forward every
+    REBASE_HALF_LIVES half-lives, dropping the counts of the values not seen
+    for about as long.
+    """
+    __slots__ = ('half_life', 'reference', 'time', 'total')
+    kind = 'decayed'
+
+    def __init__(self, half_life):
+        super(DecayedState, self).__init__()
+        self.half_life = half_life
+        self.reference = None
+        self.time = None
+        self.total = 0.
+
+    @property
+    def size(self):
+        return self.total
+
+    def observe(self, features, keys, time=None):
+        # A missing time is the time of the previous transaction
+        if time is None or time != time:
+            time = self.time if self.time is not None else 0.
+        time = float(time)
+
+        if self.reference is None:
+            self.reference = time
+        elif (time - self.reference) / self.half_life > REBASE_HALF_LIVES:
+            self._rebase(time)
+        self.time = time
+
+        weight = 2. ** ((time - self.reference) / self.half_life)
+        self.n += 1
+        self.total += weight
+        return [self.add(f, key, weight) for f, key in zip(features, keys)]
+
+    def _rebase(self, time):
+        scale = 2. ** ((self.reference - time) / self.half_life)
+        self.total *= scale
+        for f, counts in self.counts.items():
+            for value in list(counts):
+                count = counts[value] * scale
+                if count < MIN_DECAYED_COUNT:
+                    del counts[value]
+                else:
+                    counts[value] = count
+            self.max_counts[f] = max(list(counts.values()) + [0])
+        self.reference = time
+
+    def to_dict(self):
+        ret = super(DecayedState, self).to_dict()
+        ret.update({'half_life': self.half_life, 'reference': self.reference,
+                    'time': self.time, 'total': self.total})
+        return ret
+
+    @classmethod
+    def from_dict(cls, d):
+        ret = cls(d['half_life'])
+        ret.n = d['n']
+        ret.reference = d['reference']
+        ret.time = d['time']
+        ret.total = d['total']
+        for f, counts in d['counts'].items():
+            ret.counts[f] = {_key(v): c for v, c in counts}
+            ret.max_counts[f] = max([c for _, c in counts] + [0])
+        return ret
+
+
+def check_history(window=None, half_life=None):
+    """ Checks the parameters of a history policy. """
+    if window is not None and half_life is not None:
+        raise ValueError('The history is either a window or decayed, not '
+                         'both')
+    if window is not None and window < 1:
+        raise ValueError('The history window must be positive')
+    if half_life is not None and not half_life > 0:
+        raise ValueError('The half-life of the history must be positive')
+
+
+def counts_state(window=None, half_life=None):
+    """
+    New account state counting the values of the last `window`
+    transactions, or decayed by half every `half_life` seconds, or of all
+    the transactions if both are None.
+    """
+    if window is not None:
+        return WindowState(window)
+    if half_life is not None:
+        return DecayedState(half_life)
+    return CountsState()
+
+class EndpointEngine(object):
+    def __init__(self, features, global_frequencies, ft_relevance,
+                 universe_prior, epsilon=EPSILON, window=None,
+                 half_life=None):
+        # The frequencies of each feature are looked up with `get`
+        check_history(window, half_life)
+        self.features = list(features)
+        self.gfreqs = [global_frequencies[f] for f in self.features]
+        self.relevances = [ft_relevance[f] for f in self.features]
+        self.universe_prior = universe_prior
+        self.epsilon = epsilon
+        self.window = window
+        self.half_life = half_life
+
+    def new_state(self):
+        return counts_state(self.window, self.half_life)
+
+    def update(self, state, values, time=None):
+        """
+        Adds the transaction described by `values` (one value per feature),
+        at the given `unixtime`, to the account state and returns its score.
+        """
+        keys = [_key(value) for value in values]
+        counts = state.observe(self.features, keys, time)
+
+        if state.n <= 1:
+            return 1.
+
+        size = state.size
+
+        matches = []
+        weights = []
+        for i, value in enumerate(keys):
+            if value is MISSING:
+                continue
+
+            ufreq = float(counts[i]) / size
+            max_ufreq = float(state.max_counts[self.features[i]]) / size
+            gfreq = self.gfreqs[i].get(value, self.epsilon)
+            matches.append((ufreq / max_ufreq) *
+                           ((1 - self.universe_prior) +
+                            self.universe_prior * (1 - gfreq)))
+            weights.append(self.relevances[i])
+
+        ret = weighted_mean(matches, weights)
+
+        if state.n == 2:
+            ret = ret * 0.75
+
+        return ret
+
+
+class ShippingEngine(object):
+    def __init__(self, relevance, window=None, half_life=None):
+        check_history(window, half_life)
+        self.features = list(relevance)
+        self.weights = [float(w) for w in relevance.values()]
+        self.window = window
+        self.half_life = half_life
+
+    def new_state(self):
+        return counts_state(self.window, self.half_life)
+
+    def update(self, state, values, time=None):
+        """
+        Adds the transaction described by `values` (one value per feature),
+        at the given `unixtime`, to the account state and returns its score.
+        """
+        counts = state.observe(self.features,
+                               [_key(value) for value in values], time)
+        size = float(state.size)
+        probs = [(count / size) / (state.max_counts[f] / size)
+                 for f, count in zip(self.features, counts)]
+
+        if state.n <= 1:
+            return 1.
+
+        ret = weighted_mean(probs, self.weights)
+
+        if state.n == 2:
+            ret = ret * 0.75
+
+        return ret
+
+
+class PurchaseState(object):
+    __slots__ = ('n', 'category_counts', 'max_category_count', 'window',
+                 'type_counts')
+    kind = 'purchase'
+
+    def __init__(self):
+        self.n = 0
+        self.category_counts = {}
+        self.max_category_count = 0
+        # Ring buffer with the cart types of the last transactions, and the
+        # number of carts of the buffer containing each type
+        self.window = deque()
+        self.type_counts = {}
+
+    def to_dict(self):
+        return {'kind': self.kind, 'n': self.n,
+                'category_counts': list(self.category_counts.items()),
+                'window': [sorted(types) for types in self.window]}
+
+    @classmethod
+    def from_dict(cls, d):
+        ret = cls()
+        ret.n = d['n']
+        ret.category_counts = {v: c for v, c in d['category_counts']}
+        ret.max_category_count = max(list(ret.category_counts.values()) +
+                                     [0])
+        for types in d['window']:
+            ret.window.append(set(types))
+            for t in types:
+                ret.type_counts[t] = ret.type_counts.get(t, 0) + 1
+        return ret
+
+
+class PurchaseEngine(object):
+    features = ['cart-categorical-amount', 'cart-types']
+
+    def __init__(self, window=PURCHASE_WINDOW):
+        self.window = window
+
+    def new_state(self):
+        return PurchaseState()
+
+    def update(self, state, values, time=None):
+        """
+        Adds a transaction with the given cart amount category and
+        comma-separated cart types to the account state and returns its
+        score.
+        """
+        categorical_amount, types = values
+        state.n += 1
+        count = state.category_counts.get(categorical_amount, 0) + 1
+        state.category_counts[categorical_amount] = count
+        if count > state.max_category_count:
+            state.max_category_count = count
+
+        last_types = set(types.split(','))
+        ret = 1.
+        if state.n > 1:
+            ret = self._score(state, count, last_types)
+
+        # Slide the window of cart types
+        if self.window > 0:
+            state.window.append(last_types)
+            for t in last_types:
+                state.type_counts[t] = state.type_counts.get(t, 0) + 1
+
+            while len(state.window) > self.window:
+                for t in state.window.popleft():
+                    if state.type_counts[t] == 1:
+                        del state.type_counts[t]
+                    else:
+                        state.type_counts[t] -= 1
+
+        return ret
+
+    def _score(self, state, count, last_types):
+        ret = 0.
+
+        cat_rel_freq = float(count) / float(state.max_category_count)
+        ret += 2. * cat_rel_freq
+
+        if state.window:
+            common = sum(1 for t in last_types if t in state.type_counts)
+        else:
+            # An empty window joins into the single type ''
+            common = int('' in last_types)
+        types_intersect = float(common) / len(last_types)
+
+        ret += 1.5 * types_intersect
+
+        ret = ret / 4.5
+
+        if min(state.n, self.window + 1) == 2:
+            ret = ret * 0.75
+
+        return ret
+
+
+def state_from_dict(d):
+    """ Rebuilds an account state from its `to_dict` dictionary. """
+    kinds = {cls.kind: cls for cls in [CountsState, WindowState,
+                                       DecayedState, PurchaseState]}
+    return kinds[d['kind']].from_dict(d)
+
+
+def record_value(record, feature):
+    """
+    Value of a feature of a transaction given as a dictionary, NaN if it is
+    missing or null as in the parsed input files. The value of a pair of
+    features (named 'a::b') is the pair value of their values.
+    """
+    if '::' in feature:
+        a, b = feature.split('::')
+        return pair_value(record_value(record, a), record_value(record, b))
+    value = record.get(feature)
+    return np.nan if value is None else value
+
+
+def flag_record(fraud_index, record):
+    """
+    Copy of a transaction given as a dictionary with the features of the
+    fraud list (see preprocessing.FraudTransformer).
+    """
+    ret = dict(record)
+    ret['fraudlistentry'] = fraud_index.contains_email(record.get('accountid'))
+    ret['fraud-ip'] = fraud_index.contains_ip(record.get('ip'))
+    ret['fraud-discount'] = 1 - FRAUD_IP_DISCOUNT * int(ret['fraud-ip'])
+    return ret
+
+
+def account_state(engine, name, states, account):
+    """
+    State of an account for the engine of the submodel `name`, kept in
+    `states` (a dictionary of the account states of the submodels by
+    accountid) if given.
+    """
+    # Transactions without an account never share a history
+    if states is None or account != account:
+        return engine.new_state()
+
+    account_states = states.setdefault(account, {})
+    if name not in account_states:
+        account_states[name] = engine.new_state()
+    return account_states[name]
+
+
+def record_features(record, submodels):
+    """
+    Values of the features of the engines of the submodels (see
+    `score_record`) for a single transaction. Raises a TypeError or a
+    ValueError, before any account state changes, if the transaction can not
+    be scored: an account or values that can not be counted, or a `unixtime`
+    that is not a number.
+    """
+    hash(record.get('accountid'))
+    time = record.get('unixtime')
+    if time is not None:
+        float(time)
+
+    ret = []
+    for _, _, _, values in submodels:
+        values = values(record)
+        hash(values)
+        ret.append(values)
+    return ret
+
+
+def score_record(record, submodels, states=None, features=None):
+    """
+    Scores a single transaction given as a dictionary with the features of
+    the fraud list (see `flag_record`), continuing and updating its account
+    histories in `states` if given. `submodels` lists the name, the weight
+    and the engine of each submodel, and the function of the transaction to
+    the values of the features of its engine. The values can be given, as
+    computed by `record_features`.
+    """
+    if features is None:
+        features = record_features(record, submodels)
+
+    account = record.get('accountid')
+    fraud_discount = record.get('fraud-discount', 1.)
+
+    num_transactions = 1
+    if states is not None and account == account:
+        account_states = states.setdefault(account, {})
+        num_transactions = account_states.get('num_transactions', 0) + 1
+        account_states['num_transactions'] = num_transactions
+
+    ret = {'_artificial_index_': record.get('_artificial_index_'),
+           'sessionid': record.get('sessionid'),
+           'accountid': account,
+           'num_transactions': num_transactions,
+           'fraudlistentry': record.get('fraudlistentry', 0),
+           'signalstriggered': ('' if fraud_discount == 1.
+                                else 'Fraudulent IP')}
+
+    for (name, _, engine, _), values in zip(submodels, features):
+        state = account_state(engine, name, states, account)
+        ret[name] = engine.update(state, values, record.get('unixtime')) * 100.
+
+    # Compute the average score and the final band
+    ret['finalscore'], ret['finalband'] = merge_scores(
+        [ret[name] for name, _, _, _ in submodels],
+        [weight for _, weight, _, _ in submodels], fraud_discount)
+
+    return ret
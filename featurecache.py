@@ -0,0 +1,231 @@
+import pandas as pd
+import numpy as np
+import importlib
+import hashlib
+import json
+import os
+
+import profiling
+from artifact import encode_values, decode_values
+from formats import file_format
+
+
+"""
+On-disk cache of the features of an input file, so that the runs repeated on
+the same input (e.g. with other submodels enabled) skip its parse, the fraud
+features and the transformers of the submodels, and start at the scorers.
+
+The entries are keyed by the hash of the contents of the input file, the
+options it is read with, the arrays of the fraud list index and the sources
+of the modules computing the features, and each submodel entry also by the
+configuration of its transformers, so that any change of them invalidates
+the entries. An entry is an .npz archive without pickled objects: a JSON
+header with the columns of the frame and their kinds, the numeric columns as
+they are, and the text and categorical columns as integer codes into their
+distinct values (see artifact.encode_values). The fraud entry only keeps the
+columns of the input read after the submodels (BASE_COLUMNS), so that it is
+shared by the runs with any submodels enabled.
+
+The payload parse failures are only reported when the features are computed,
+not when they are loaded from the cache.
+"""
+
+
+FORMAT = 'risk-reputation-features'
+VERSION = 1
+
+# Columns of the fraud features read by the merge of the submodels, the
+# signal penalties and the score adjustments
+BASE_COLUMNS = ['_artificial_index_', 'unixtime', 'sessionid', 'accountid',
+                'eventtriggeredsignals', 'fraudlistentry', 'fraud-ip',
+                'fraud-discount']
+
+# Modules whose code computes the cached features
+FEATURE_MODULES = ['loader', 'formats', 'fraudlist', 'preprocessing',
+                   'payloads', 'utils', 'engine']
+
+_CATEGORICAL, _OBJECT = 'categorical', 'object'
+
+_BLOCK_SIZE = 1 << 20
+
+
+def _hash_files(digest, filenames):
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+                digest.update(block)
+
+
+def _input_files(filename):
+    # The files of an arrays directory, in a stable order
+    if not os.path.isdir(filename):
+        return [filename]
+    return [os.path.join(filename, name)
+            for name in sorted(os.listdir(filename))]
+
+
+def _step_config(step):
+    # The parameters of a transformer that change its output
+    config = {'class': type(step).__name__}
+    for name in ['features', 'pairs_of_interest', 'extra_features',
+                 'payload', 'fields']:
+        if hasattr(step, name):
+            config[name] = getattr(step, name)
+    if hasattr(step, 'extract'):
+        config['extract'] = step.extract.__name__
+    return config
+
+
+def encode_frame(df):
+    """ Header and arrays of the columns of a frame. """
+    columns = []
+    arrays = {}
+    for i, c in enumerate(df.columns):
+        values = df[c].values
+        if isinstance(values, pd.Categorical):
+            kind = _CATEGORICAL
+            codes, uniques = values.codes, list(values.categories)
+        elif values.dtype == object:
+            kind = _OBJECT
+            codes, uniques = pd.factorize(values)
+            uniques = list(uniques)
+        else:
+            arrays['%d' % i] = values
+            columns.append({'name': c, 'kind': values.dtype.str})
+            continue
+
+        tags, offsets, blob = encode_values(uniques)
+        arrays['%d/codes' % i] = codes
+        arrays['%d/tags' % i] = tags
+        arrays['%d/offsets' % i] = offsets
+        arrays['%d/blob' % i] = blob
+        columns.append({'name': c, 'kind': kind})
+
+    return columns, arrays
+
+
+def decode_frame(columns, archive):
+    """ Frame of the columns encoded by `encode_frame`. """
+    ret = {}
+    for i, column in enumerate(columns):
+        kind = column['kind']
+        if kind not in (_CATEGORICAL, _OBJECT):
+            ret[column['name']] = archive['%d' % i]
+            continue
+
+        codes = archive['%d/codes' % i]
+        uniques = decode_values(archive['%d/tags' % i],
+                                archive['%d/offsets' % i],
+                                archive['%d/blob' % i])
+        if kind == _CATEGORICAL:
+            ret[column['name']] = pd.Categorical.from_codes(
+                codes, categories=pd.Index(uniques, dtype=object))
+        else:
+            # The missing values (code -1) are the last one
+            values = np.empty(len(uniques) + 1, dtype=object)
+            values[:-1] = uniques
+            values[-1] = np.nan
+            ret[column['name']] = values[codes]
+
+    return pd.DataFrame(ret)
+
+
+class FeatureCache(object):
+    """
+    Directory of cached features. The entries are never evicted; the
+    directory can be removed at any time.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        os.makedirs(dirname, exist_ok=True)
+
+    def input_key(self, filename, fraud, sep=',', fmt=None):
+        """
+        Key of the features of an input file read with the given delimiter
+        and format, given its FraudTransformer.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([FORMAT, VERSION, sep,
+                                  file_format(filename, fmt)]).encode('utf-8'))
+        _hash_files(digest, _input_files(filename))
+        _hash_files(digest, [importlib.import_module(m).__file__
+                             for m in FEATURE_MODULES])
+
+        arrays = fraud.fraud_index.arrays()
+        for name in sorted(arrays):
+            values = np.ascontiguousarray(arrays[name])
+            digest.update(name.encode('utf-8') + values.dtype.str.encode())
+            digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    def _filename(self, key, name, config=None):
+        digest = hashlib.blake2b(json.dumps([key, name, config]).encode(
+            'utf-8'), digest_size=16)
+        return os.path.join(self.dirname, digest.hexdigest() + '.npz')
+
+    def _load(self, filename):
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename, allow_pickle=False) as archive:
+            header = json.loads(archive['header'].tobytes().decode('utf-8'))
+            if (header.get('format') != FORMAT or
+                    header.get('version') != VERSION):
+                return None
+            return decode_frame(header['columns'], archive)
+
+    def _save(self, filename, df):
+        columns, arrays = encode_frame(df)
+        header = {'format': FORMAT, 'version': VERSION, 'columns': columns}
+        arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'),
+                                         dtype=np.uint8)
+
+        # The entry is replaced once complete, so that a concurrent run
+        # never reads a partial one
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, filename)
+
+    @profiling.profiled
+    def transform(self, model, filename, read, sep=',', fmt=None):
+        """
+        Returns the fraud features of an input file, the output of the first
+        step of the full model (see pipeline.build_model), and a dictionary
+        with the features of each enabled submodel, the output of its
+        transformers. They are loaded from the cache if all of them are
+        cached, or else `read()` reads the input file and the missing ones
+        are computed, fitting the transformers, and saved.
+        """
+        from sklearn.pipeline import Pipeline
+
+        key = self.input_key(filename, model[0], sep, fmt)
+        entries = {}
+        for name, estimator, _ in model[-1].estimators:
+            if isinstance(estimator, Pipeline):
+                entries[name] = self._filename(
+                    key, name,
+                    [_step_config(step) for _, step in estimator.steps[:-1]])
+
+        features = {}
+        for name, entry in entries.items():
+            df = self._load(entry)
+            if df is not None:
+                features[name] = df
+        X = self._load(self._filename(key, 'fraud'))
+        profiling.count('feature_cache_hits', len(features) +
+                        (X is not None))
+
+        if X is not None and len(features) == len(entries):
+            return X, features
+
+        X = model[0].fit_transform(read())
+        self._save(self._filename(key, 'fraud'),
+                   X[[c for c in BASE_COLUMNS if c in X]])
+        for name, estimator, _ in model[-1].estimators:
+            if name in entries and name not in features:
+                # Transformed after the fit, as when scored, so that the
+                # parse failures are reported
+                features[name] = estimator[:-1].fit(X).transform(X)
+                self._save(entries[name], features[name])
+
+        return X, features
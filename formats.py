@@ -0,0 +1,305 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+
+
+"""
+Binary formats of the input and output files, besides CSV, so that the
+exports do not need to be parsed or formatted as text:
+    - Parquet and Feather files, read and written with pyarrow (an optional
+      dependency) and only the columns needed read;
+    - arrays, a dependency-free directory of column files that are memory
+      mapped as NumPy arrays. The numeric columns are stored as they are, and
+      the text columns as int32 codes (-1 if missing) into a dictionary of
+      their distinct values, itself stored as the UTF-8 bytes of the values
+      and their end offsets. A JSON header (columns.json) lists the columns,
+      their types and the number of rows.
+
+The readers return the columns as they are stored (the text columns of an
+arrays directory as Categoricals); see loader.py for their conversion to the
+types of the CSV reader.
+"""
+
+
+FORMATS = ['csv', 'parquet', 'feather', 'arrays']
+
+ARRAYS_FORMAT = 'risk-reputation-arrays'
+ARRAYS_VERSION = 1
+ARRAYS_HEADER = 'columns.json'
+
+# Type of the text columns in the header of an arrays directory
+TEXT = 'text'
+
+
+def file_format(filename, fmt=None):
+    """
+    Format of a file, `fmt` if given or else from its name: .parquet (or
+    .pq), .feather (or .arrow), a directory (arrays) or CSV.
+    """
+    if fmt is not None:
+        return fmt
+
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.parquet', '.pq'):
+        return 'parquet'
+    elif ext in ('.feather', '.arrow'):
+        return 'feather'
+    elif os.path.isdir(filename):
+        return 'arrays'
+    return 'csv'
+
+
+def _pyarrow(fmt):
+    # Imported here, pyarrow is only needed by the Parquet and Feather files
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('The %s format requires pyarrow, which is not '
+                          'installed (the arrays format does not)' % fmt)
+    return pyarrow
+
+
+def _projection(names, columns):
+    return names if columns is None else [c for c in names if c in columns]
+
+
+class ArrayTable(object):
+    """
+    Arrays directory opened for reading. The dictionaries of the text
+    columns are decoded once, when their column is first read.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(os.path.join(dirname, ARRAYS_HEADER)) as f:
+            header = json.load(f)
+        if header.get('format') != ARRAYS_FORMAT:
+            raise ValueError('%s is not an arrays directory' % dirname)
+        if header.get('version') != ARRAYS_VERSION:
+            raise ValueError('Unsupported arrays version %s' %
+                             header.get('version'))
+
+        self.rows = header['rows']
+        self.columns = [c['name'] for c in header['columns']]
+        self.types = {c['name']: c['type'] for c in header['columns']}
+        self.dictionaries = {}
+
+    def _file(self, column, suffix=''):
+        i = self.columns.index(column)
+        return os.path.join(self.dirname, '%d%s.bin' % (i, suffix))
+
+    def _map(self, filename, dtype, count):
+        # Empty files can not be mapped
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', shape=(count,))
+
+    def dictionary(self, column):
+        """ Distinct values of a text column, in the order of their codes. """
+        if column not in self.dictionaries:
+            ends = np.fromfile(self._file(column, '.ends'), dtype='<i8')
+            blob = self._map(self._file(column, '.blob'), np.uint8,
+                             int(ends[-1]) if len(ends) else 0)
+            blob = blob.tobytes()
+            starts = np.append(0, ends[:-1]).tolist()
+            self.dictionaries[column] = pd.Index(
+                [blob[start: end].decode('utf-8')
+                 for start, end in zip(starts, ends.tolist())], dtype=object)
+        return self.dictionaries[column]
+
+    def read(self, columns=None, start=0, stop=None):
+        """
+        Reads the rows [start, stop) of the given columns (of all of them if
+        None), the text columns as Categoricals of their dictionaries.
+        """
+        stop = self.rows if stop is None else min(stop, self.rows)
+        ret = {}
+        for c in _projection(self.columns, columns):
+            if self.types[c] == TEXT:
+                codes = self._map(self._file(c), '<i4', self.rows)
+                ret[c] = pd.Categorical.from_codes(
+                    np.asarray(codes[start: stop]),
+                    categories=self.dictionary(c))
+            else:
+                values = self._map(self._file(c), self.types[c], self.rows)
+                ret[c] = np.array(values[start: stop])
+        return pd.DataFrame(ret)
+
+
+def read_table(filename, fmt, columns=None):
+    """ Reads the given columns (all of them if None) of a binary file. """
+    if fmt == 'arrays':
+        return ArrayTable(filename).read(columns)
+
+    pa = _pyarrow(fmt)
+    if fmt == 'parquet':
+        names = pa.parquet.ParquetFile(filename).schema_arrow.names
+        return pa.parquet.read_table(
+            filename, columns=_projection(names, columns)).to_pandas()
+
+    # The unused columns of a mapped Feather file are not read
+    table = pa.feather.read_table(filename, memory_map=True)
+    return table.select(_projection(table.column_names,
+                                    columns)).to_pandas()
+
+
+def iter_tables(filename, fmt, chunksize, columns=None):
+    """
+    Reads the given columns (all of them if None) of a binary file in chunks
+    of `chunksize` rows.
+    """
+    if fmt == 'arrays':
+        table = ArrayTable(filename)
+        for start in range(0, table.rows, chunksize):
+            yield table.read(columns, start, start + chunksize)
+        return
+
+    pa = _pyarrow(fmt)
+    if fmt == 'parquet':
+        parquet = pa.parquet.ParquetFile(filename)
+        names = parquet.schema_arrow.names
+        for batch in parquet.iter_batches(batch_size=chunksize,
+                                          columns=_projection(names,
+                                                              columns)):
+            yield batch.to_pandas()
+        return
+
+    table = pa.feather.read_table(filename, memory_map=True)
+    table = table.select(_projection(table.column_names, columns))
+    for start in range(0, table.num_rows, chunksize):
+        yield table.slice(start, chunksize).to_pandas()
+
+
+class ArrayWriter(object):
+    """
+    Writes frames to a new arrays directory, appending each frame to the
+    column files. The dictionaries of the text columns only grow, so that
+    their files are appended to as well.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.rows = 0
+        self.header = None
+        self.files = []
+        self.codes = []
+        self.size = []
+        os.makedirs(dirname, exist_ok=True)
+
+    def _open(self, df):
+        self.header = []
+        for i, c in enumerate(df.columns):
+            values = df[c].values
+            if (isinstance(values, pd.Categorical) or
+                    values.dtype.kind not in 'biuf'):
+                kind = TEXT
+                files = [open(os.path.join(self.dirname, '%d%s.bin' %
+                                           (i, suffix)), 'wb')
+                         for suffix in ['', '.ends', '.blob']]
+            else:
+                kind = values.dtype.newbyteorder('<').str
+                files = [open(os.path.join(self.dirname, '%d.bin' % i),
+                              'wb')]
+            self.header.append({'name': c, 'type': kind})
+            self.files.append(files)
+            self.codes.append({})
+            self.size.append(0)
+
+    def _write_text(self, i, values):
+        files, codes = self.files[i], self.codes[i]
+        indices, uniques = pd.factorize(np.asarray(values, dtype=object))
+        known = np.empty(len(uniques) + 1, dtype='<i4')
+        known[-1] = -1
+
+        texts = []
+        for j, value in enumerate(uniques):
+            text = value if isinstance(value, str) else str(value)
+            code = codes.get(text)
+            if code is None:
+                code = codes[text] = len(codes)
+                texts.append(text.encode('utf-8'))
+            known[j] = code
+
+        known[indices].tofile(files[0])
+        if texts:
+            ends = self.size[i] + np.cumsum([len(t) for t in texts])
+            ends.astype('<i8').tofile(files[1])
+            files[2].write(b''.join(texts))
+            self.size[i] = int(ends[-1])
+
+    def write(self, df):
+        if self.header is None:
+            self._open(df)
+        if list(df.columns) != [c['name'] for c in self.header]:
+            raise ValueError('The columns of the frames written to %s '
+                             'differ' % self.dirname)
+
+        for i, column in enumerate(self.header):
+            if column['type'] == TEXT:
+                self._write_text(i, df[column['name']].values)
+            else:
+                np.asarray(df[column['name']].values,
+                           dtype=column['type']).tofile(self.files[i][0])
+        self.rows += len(df)
+
+        for files in self.files:
+            for f in files:
+                f.flush()
+        with open(os.path.join(self.dirname, ARRAYS_HEADER), 'w') as f:
+            json.dump({'format': ARRAYS_FORMAT, 'version': ARRAYS_VERSION,
+                       'rows': self.rows, 'columns': self.header}, f)
+
+    def close(self):
+        for files in self.files:
+            for f in files:
+                f.close()
+
+
+class TableWriter(object):
+    """
+    Writes the given columns of frames, one after the other, to an output
+    file in one of the FORMATS.
+    """
+    def __init__(self, filename, fmt, columns):
+        self.filename = filename
+        self.format = fmt
+        self.columns = columns
+        self.writer = None
+        self.schema = None
+        self.written = False
+        # Fails before the scoring if pyarrow is missing
+        if fmt in ('parquet', 'feather'):
+            _pyarrow(fmt)
+
+    def write(self, df):
+        # The missing columns (e.g. the scores of the disabled submodels) are
+        # written empty
+        df = df.reindex(columns=self.columns)
+        if self.format == 'csv':
+            df.to_csv(self.filename, sep=',', index=False, quotechar='"',
+                      mode='a' if self.written else 'w',
+                      header=not self.written)
+        elif self.format == 'arrays':
+            if self.writer is None:
+                self.writer = ArrayWriter(self.filename)
+            self.writer.write(df)
+        else:
+            pa = _pyarrow(self.format)
+            # The frames after the first one take its schema
+            table = pa.Table.from_pandas(df, schema=self.schema,
+                                         preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema
+                # A Feather file is an Arrow IPC file
+                self.writer = (
+                    pa.parquet.ParquetWriter(self.filename, self.schema)
+                    if self.format == 'parquet'
+                    else pa.ipc.new_file(self.filename, self.schema))
+            self.writer.write_table(table)
+        self.written = True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
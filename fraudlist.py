@@ -0,0 +1,296 @@
+import numpy as np
+import ipaddress
+import threading
+import json
+import os
+
+from hashing import value_hash
+
+
+"""
+Compiled index of the fraud list (the `customer_email` and `ip` columns of
+data/fraud_list.csv). The emails are stored as a sorted array of 64-bit
+hashes of their text (see hashing.value_hash), and the IPv4 addresses and
+CIDR ranges as sorted, merged integer intervals (other addresses are hashed
+like the emails). The lookups of whole columns are vectorized binary
+searches over the distinct values. The index takes 8 bytes per entry,
+instead of the Python sets of the fraud list; a hash collision (one in about
+10^13 lookups with a million emails) counts as a match.
+
+The index is saved in a single binary file next to the fraud list, and
+memory-mapped by the following runs while the fraud list is unchanged.
+`FraudList` recompiles it when the file changes, swapping the index
+atomically for the readers.
+
+pandas is only imported by the batch lookups and the compilation of the
+index, so that the fast-start runtime (see runtime.py) can look up single
+values in a compiled index without it.
+"""
+
+
+FORMAT = 'risk-fraud-index'
+VERSION = 2
+
+_MAGIC = b'RRFRAUD\x00'
+_ALIGNMENT = 64
+
+# Arrays of the index, in the order of the index files
+ARRAYS = ['emails', 'ip_starts', 'ip_ends', 'ip_other']
+
+
+def hash_text(value):
+    """ 64-bit hash of the text of a value. """
+    return value_hash(value if isinstance(value, str) else str(value))
+
+
+def hash_values(values):
+    """ Same as `hash_text` for a sequence of values. """
+    return np.fromiter((hash_text(v) for v in values), dtype=np.uint64,
+                       count=len(values))
+
+
+def _ipv4(text):
+    # Integer of a dotted-quad IPv4 address in canonical form (which matches
+    # the text of the address exactly), or -1 for other values
+    if not isinstance(text, str) or not text.isascii():
+        return -1
+    parts = text.split('.')
+    if len(parts) != 4:
+        return -1
+
+    ret = 0
+    for p in parts:
+        if not p.isdigit() or (p[0] == '0' and p != '0') or int(p) > 255:
+            return -1
+        ret = (ret << 8) | int(p)
+    return ret
+
+
+def _ip_range(text):
+    # Interval of an IPv4 address or CIDR range, None for other values
+    if '/' in text:
+        try:
+            network = ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            return None
+        if network.version != 4:
+            return None
+        return (int(network.network_address),
+                int(network.broadcast_address))
+
+    ip = _ipv4(text)
+    return (ip, ip) if ip >= 0 else None
+
+
+def _lookup(sorted_hashes, hashes):
+    if not len(sorted_hashes):
+        return np.zeros(len(hashes), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_hashes, hashes),
+                     len(sorted_hashes) - 1)
+    return sorted_hashes[pos] == hashes
+
+
+class FraudIndex(object):
+    def __init__(self, emails, ip_starts, ip_ends, ip_other):
+        self.emails = emails
+        self.ip_starts = ip_starts
+        self.ip_ends = ip_ends
+        self.ip_other = ip_other
+
+    @classmethod
+    def from_values(cls, emails, ips):
+        """ Compiles the index of the emails and IPs of a fraud list. """
+        emails = [e for e in emails if e == e and e is not None]
+        ips = [str(ip) for ip in ips if ip == ip and ip is not None]
+
+        intervals = []
+        other = []
+        for ip in ips:
+            interval = _ip_range(ip)
+            if interval is None:
+                other.append(ip)
+            else:
+                intervals.append(interval)
+
+        # Merge the overlapping and adjacent intervals
+        starts, ends = [], []
+        for start, end in sorted(intervals):
+            if starts and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+        return cls(np.unique(hash_values(emails)),
+                   np.asarray(starts, dtype=np.uint64),
+                   np.asarray(ends, dtype=np.uint64),
+                   np.unique(hash_values(other)))
+
+    @classmethod
+    def from_csv(cls, filename):
+        import pandas as pd
+
+        fraud_list = pd.read_csv(filename, dtype=str)
+        return cls.from_values(fraud_list['customer_email'].values,
+                               fraud_list['ip'].values)
+
+    def match_emails(self, values):
+        """ Whether each value of an array is a fraudulent email. """
+        import pandas as pd
+
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        matches = np.append(_lookup(self.emails, hash_values(uniques)), False)
+        return matches[codes]
+
+    def match_ips(self, values):
+        """
+        Whether each value of an array is a fraudulent IP address, or falls
+        in a fraudulent range.
+        """
+        import pandas as pd
+
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        ips = np.fromiter((_ipv4(u) for u in uniques), dtype=np.int64,
+                          count=len(uniques))
+
+        matches = np.zeros(len(uniques), dtype=bool)
+        if len(self.ip_other):
+            matches = _lookup(self.ip_other, hash_values(uniques))
+        ipv4 = ips >= 0
+        if len(self.ip_starts) and ipv4.any():
+            x = ips[ipv4].astype(np.uint64)
+            i = np.searchsorted(self.ip_starts, x, side='right') - 1
+            in_range = (i >= 0) & (x <= self.ip_ends[np.maximum(i, 0)])
+            matches[ipv4] = in_range
+
+        return np.append(matches, False)[codes]
+
+    def contains_email(self, value):
+        """ Same as `match_emails` for a single value. """
+        return self._contains(self.emails, value)
+
+    def contains_ip(self, value):
+        """ Same as `match_ips` for a single value. """
+        if value != value or value is None:
+            return False
+
+        ip = _ipv4(value)
+        if ip >= 0:
+            i = np.searchsorted(self.ip_starts, np.uint64(ip), side='right')
+            return bool(i > 0 and ip <= self.ip_ends[i - 1])
+        return self._contains(self.ip_other, value)
+
+    @staticmethod
+    def _contains(sorted_hashes, value):
+        if value != value or value is None or not len(sorted_hashes):
+            return False
+        h = np.uint64(hash_text(value))
+        i = np.searchsorted(sorted_hashes, h)
+        return bool(i < len(sorted_hashes) and sorted_hashes[i] == h)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAYS}
+
+    def save(self, filename, source=None):
+        """
+        Writes the index to a single file, replaced atomically. `source`
+        identifies the fraud list it was compiled from.
+        """
+        arrays = self.arrays()
+        header = {'format': FORMAT, 'version': VERSION, 'source': source,
+                  'arrays': {}}
+
+        # The arrays are aligned after the header, in order
+        offset = 0
+        for name in ARRAYS:
+            header['arrays'][name] = [offset, len(arrays[name])]
+            offset += -(-8 * len(arrays[name]) // _ALIGNMENT) * _ALIGNMENT
+        text = json.dumps(header).encode('utf-8')
+        start = -(-(len(_MAGIC) + 8 + len(text)) // _ALIGNMENT) * _ALIGNMENT
+
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_MAGIC + np.uint64(len(text)).tobytes() + text)
+            for name in ARRAYS:
+                f.seek(start + header['arrays'][name][0])
+                f.write(np.ascontiguousarray(arrays[name],
+                                             dtype=np.uint64).tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def read_header(cls, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError('%s is not a fraud list index' % filename)
+            length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(length).decode('utf-8'))
+
+        if header.get('version') != VERSION:
+            raise ValueError('Unsupported fraud list index %s' % filename)
+        header['start'] = -(-(len(_MAGIC) + 8 + length) // _ALIGNMENT) * \
+            _ALIGNMENT
+        return header
+
+    @classmethod
+    def load(cls, filename):
+        """ Memory-maps an index saved by `save`. """
+        header = cls.read_header(filename)
+
+        arrays = {}
+        for name in ARRAYS:
+            offset, length = header['arrays'][name]
+            arrays[name] = np.empty(0, dtype=np.uint64)
+            if length:
+                arrays[name] = np.memmap(filename, dtype=np.uint64, mode='r',
+                                         offset=header['start'] + offset,
+                                         shape=(length,))
+
+        return cls(**arrays)
+
+
+class FraudList(object):
+    """
+    A fraud list file and its compiled index, recompiled by `reload` when
+    the file changes.
+    """
+    def __init__(self, filename, index_filename=None):
+        self.filename = filename
+        self.index_filename = index_filename or filename + '.idx'
+        self.lock = threading.Lock()
+        self.source = None
+        self.index = None
+        self.reload()
+
+    def _source(self):
+        stat = os.stat(self.filename)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def reload(self):
+        """
+        Loads the index again if the fraud list changed. Returns whether it
+        was reloaded.
+        """
+        with self.lock:
+            source = self._source()
+            if source == self.source:
+                return False
+
+            index = None
+            try:
+                if FraudIndex.read_header(self.index_filename)['source'] == \
+                        source:
+                    index = FraudIndex.load(self.index_filename)
+            except (OSError, ValueError):
+                pass
+
+            if index is None:
+                index = FraudIndex.from_csv(self.filename)
+                try:
+                    index.save(self.index_filename, source)
+                except OSError:
+                    # The index is only cached when its directory is writable
+                    pass
+
+            self.index, self.source = index, source
+            return True
@@ -0,0 +1,39 @@
+import numpy as np
+import hashlib
+
+
+"""
+Stable 64-bit hashes of the values of the features, the same in every process
+and run (unlike the hashes of Python): the hash of the type tag and the text
+of a value. The module only depends on NumPy, so that the fast-start runtime
+(see runtime.py) hashes the values it looks up as the models and the model
+artifacts (see artifact.py) do.
+"""
+
+
+# Type tags of the values
+STR, BOOL, INT, FLOAT, NONE = range(5)
+
+
+def tag_text(value):
+    """ Type tag and text of a str, bool, int, float or None value. """
+    if isinstance(value, str):
+        return STR, value
+    elif isinstance(value, (bool, np.bool_)):
+        return BOOL, '1' if value else ''
+    elif isinstance(value, (int, np.integer)):
+        return INT, str(int(value))
+    elif isinstance(value, (float, np.floating)):
+        return FLOAT, repr(float(value))
+    elif value is None:
+        return NONE, ''
+    raise TypeError('Can not encode values of type %s' %
+                    type(value).__name__)
+
+
+def value_hash(value):
+    """ 64-bit hash of the type tag and the text of a value. """
+    tag, text = tag_text(value)
+    digest = hashlib.blake2b(bytes([tag]) + text.encode('utf-8'),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
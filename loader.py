@@ -0,0 +1,161 @@
+import pandas as pd
+import numpy as np
+import warnings
+
+import formats
+import profiling
+
+
+"""
+Loading of the input transactions. Only the columns read by the model are
+parsed (see pipeline.input_columns), with explicit types: the timestamps as
+int64, the low-cardinality endpoint features as categoricals and the other
+columns as text, instead of inferring the type of every column of the export.
+The binary input files (see formats.py) are converted to the same types.
+"""
+
+
+# Endpoint features with few distinct values
+CATEGORICAL_COLUMNS = ['browserlanguage', 'device_type', 'browserplatform',
+                       'browserparent', 'browsername',
+                       'device_pointing_method', 'country', 'region']
+
+
+def input_dtypes(columns, time_dtype=np.int64):
+    """ Types of the given input columns. """
+    ret = {}
+    for c in columns:
+        if c == 'unixtime':
+            ret[c] = time_dtype
+        elif c in CATEGORICAL_COLUMNS:
+            ret[c] = 'category'
+        else:
+            ret[c] = str
+    return ret
+
+
+def _read_csv(filename, sep, columns, time_dtype=np.int64, **kwargs):
+    if columns is None:
+        return pd.read_csv(filename, sep=sep, **kwargs)
+
+    # The columns missing from the input are skipped
+    columns = set(columns)
+    return pd.read_csv(filename, sep=sep, usecols=lambda c: c in columns,
+                       dtype=input_dtypes(columns, time_dtype), **kwargs)
+
+
+def _time_fallback(filename):
+    warnings.warn('%s has missing or non-integer timestamps, which are '
+                  'parsed as floats' % filename)
+
+
+def _text(values):
+    # Text values, NaN if missing
+    missing = pd.isna(values)
+    if isinstance(values, pd.Categorical) or values.dtype.kind == 'O':
+        ret = np.asarray(values, dtype=object).copy()
+    else:
+        ret = values.astype(str).astype(object)
+    ret[missing] = np.nan
+    return ret
+
+
+def _times(values, filename):
+    # Integer timestamps as int64, and the others as float64
+    if isinstance(values, pd.Categorical):
+        values = np.asarray(values, dtype=object)
+    times = np.asarray(pd.to_numeric(values))
+    if times.dtype.kind in 'biu':
+        return times.astype(np.int64)
+
+    times = times.astype(np.float64)
+    if np.isnan(times).any() or (times != np.floor(times)).any():
+        _time_fallback(filename)
+        return times
+    return times.astype(np.int64)
+
+
+def conform(df, filename):
+    """
+    Converts the columns of a frame read from a binary file to the types of
+    the CSV reader (see input_dtypes).
+    """
+    for c, dtype in input_dtypes(df.columns).items():
+        values = df[c].values
+        if c == 'unixtime':
+            df[c] = _times(values, filename)
+        elif dtype == 'category':
+            if not isinstance(values, pd.Categorical):
+                df[c] = pd.Categorical(_text(values))
+        else:
+            df[c] = _text(values)
+    return df
+
+
+def read_input(filename, sep=',', columns=None, fmt=None):
+    """
+    Reads the given columns of an input file (all of them, with inferred
+    types, if None), and indexes its transactions. The format of the file
+    is `fmt`, or else inferred from its name (see formats.file_format).
+    """
+    fmt = formats.file_format(filename, fmt)
+    if fmt != 'csv':
+        ret = conform(formats.read_table(filename, fmt, columns), filename)
+    else:
+        try:
+            ret = _read_csv(filename, sep, columns)
+        except ValueError:
+            # Timestamps that are not integers are parsed as floats instead
+            _time_fallback(filename)
+            ret = _read_csv(filename, sep, columns, time_dtype=np.float64)
+
+    ret['_artificial_index_'] = np.arange(len(ret))
+    return ret
+
+
+def _csv_chunks(filename, sep, chunksize, columns):
+    offset = 0
+    time_dtype = np.int64
+    reader = _read_csv(filename, sep, columns, chunksize=chunksize)
+    while True:
+        try:
+            chunk = next(reader, None)
+        except ValueError:
+            if time_dtype is np.float64:
+                raise
+            # Read the rest of the file with float timestamps
+            _time_fallback(filename)
+            time_dtype = np.float64
+            reader = _read_csv(filename, sep, columns, time_dtype,
+                               chunksize=chunksize,
+                               skiprows=range(1, offset + 1))
+            chunk = next(reader, None)
+        if chunk is None:
+            return
+        offset += len(chunk)
+        yield chunk
+
+
+def read_chunks(filename, sep, chunksize, columns=None, fmt=None):
+    """
+    Reads the given columns of an input file in chunks of `chunksize` rows,
+    indexing the transactions across the chunks.
+    """
+    fmt = formats.file_format(filename, fmt)
+    if fmt != 'csv':
+        chunks = (conform(chunk, filename) for chunk in
+                  formats.iter_tables(filename, fmt, chunksize, columns))
+    else:
+        chunks = _csv_chunks(filename, sep, chunksize, columns)
+
+    offset = 0
+    while True:
+        with profiling.stage('load') as info:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            chunk['_artificial_index_'] = np.arange(offset,
+                                                    offset + len(chunk))
+            info['rows_out'] = len(chunk)
+        offset += len(chunk)
+        yield chunk
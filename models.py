@@ -1,5 +1,8 @@
 from sklearn.base import BaseEstimator, RegressorMixin
-from collections import Counter
+from sklearn.pipeline import Pipeline
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import multiprocessing
 import pandas as pd
 import numpy as np
 import json
@@ -7,6 +10,85 @@ import os
 
 
 import utils
+import profiling
+from engine import EndpointEngine, ShippingEngine, PurchaseEngine, \
+    EPSILON, SHIPPING_RELEVANCE, PURCHASE_WINDOW, account_state, \
+    record_features, score_record
+
+
+"""
+Base class of the submodel scorers. A scorer scores every transaction of a
+frame given its account-grouped view (see utils.AccountGroups), which lets
+several scorers share a single sort of the transactions.
+"""
+
+class SubmodelScorer(BaseEstimator, RegressorMixin):
+    score_name = 'score'
+
+    def predict(self, X):
+        groups = utils.AccountGroups.from_frame(X)
+        order = groups.order
+        values = lambda f, default: (X[f].values[order] if f in X
+                                     else default)
+
+        ret = pd.DataFrame({
+            'sessionid': values('sessionid', None),
+            'accountid': values('accountid', None),
+            'fraudlistentry': values('fraudlistentry', 0),
+            'fraud-discount': values('fraud-discount', 1.),
+            self.score_name: self.predict_grouped(X, groups),
+            '_artificial_index_': values('_artificial_index_', None),
+            'num_transactions': groups.positions() + 1
+            })
+
+        return ret
+
+    def predict_grouped(self, X, groups, states=None):
+        """
+        Returns the scores (0-100) of the transactions of X in the
+        account-sorted order of `groups`. If given, `states` maps each
+        accountid to a dictionary with the account states of the scorers,
+        and the scoring continues (and updates) the account histories.
+        """
+        raise NotImplementedError()
+
+    def predict_online(self, engine, X, groups, states=None):
+        """
+        Scores the transactions one by one with an online engine.
+        """
+        rows = zip(*[groups.take(X[f].values) for f in engine.features])
+        accounts = groups.take(X['accountid'].values)
+        times = (groups.take(X['unixtime'].values) if 'unixtime' in X
+                 else np.full(len(groups), np.nan))
+        starts = groups.starts()
+
+        scores = np.empty(len(groups))
+        state = None
+        for tid, (values, time) in enumerate(zip(rows, times)):
+            if starts[tid]:
+                state = account_state(engine, self.score_name, states,
+                                      accounts[tid])
+            scores[tid] = engine.update(state, values, time)
+
+        return scores * 100.
+
+    def record_engine(self):
+        """
+        Returns the online engine of the scorer for all the scored features,
+        built once, to score single transactions (see
+        ModelMerger.predict_record).
+        """
+        engine = getattr(self, 'record_engine_', None)
+        if engine is None:
+            engine = self.record_engine_ = self.engine()
+        return engine
+
+    def engine(self, features=None):
+        """
+        Returns the online scoring engine of the scorer for the given columns
+        (all the scored features if None).
+        """
+        raise NotImplementedError()
 
 
 """
@@ -24,109 +106,135 @@ Thereby, a feature with no variance has 0 impact on the final model, while a
 feature with strong diversity is very important on the decision process.
 """
 
-class EndpointScorer(BaseEstimator, RegressorMixin):
-    def __init__(self, universe_prior=0.25):
+class EndpointScorer(SubmodelScorer):
+    score_name = 'endpointscore'
+
+    def __init__(self, universe_prior=0.25, n_jobs=None, memory_budget=None,
+                 window=None, half_life=None):
         self.skip_features = set(['sessionid', 'accountid', 'unixtime',
                                   '_artificial_index_'])
-        self.epsilon = 1e-10
+        self.epsilon = EPSILON
         self.universe_prior = universe_prior
+        self.n_jobs = n_jobs
+        # Bytes of the frequency tables, exact if None (see
+        # utils.frequency_tables)
+        self.memory_budget = memory_budget
+        # History policy of the account states (see engine.py)
+        self.window = window
+        self.half_life = half_life
 
+    @profiling.profiled
     def fit(self, df, y=None):
-        self.global_frequencies = {}
-        for f in df.keys():
-            if f in self.skip_features:
-                continue
-
-            acc_f = ['accountid', f]
-            values = df[acc_f].groupby(acc_f).size().reset_index().rename(
-                columns={0:'count'})[f]
-            
-            self.global_frequencies[f] = {i: float(v) / len(values)
-                                          for i, v in Counter(values).items()}
-        
-        self.ft_relevance = \
-            {f: 1 - np.mean([v for _, v in self.global_frequencies[f].items()])
-             for f in df.keys() if f not in self.skip_features}
-        rel_sum = np.sum([v for _, v in self.ft_relevance.items()])
-        self.ft_relevance = \
-            {f: v / rel_sum for f, v in self.ft_relevance.items()}
+        features = [f for f in df.keys() if f not in self.skip_features]
+        accounts, _ = pd.factorize(np.asarray(df['accountid'].values),
+                                   sort=True)
+
+        return self._fit_frequencies(self._map_features(
+            lambda f: utils.distinct_counts(accounts, df[f].values),
+            features))
+
+    def _map_features(self, function, features):
+        # Applies the function to the features in parallel, as a dictionary
+        # of its results: the sorts of the codes run without the GIL
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs or 1
+        if n_jobs > 1 and len(features) > 1:
+            with ThreadPoolExecutor(min(n_jobs, len(features))) as pool:
+                return dict(zip(features, pool.map(function, features)))
+        return {f: function(f) for f in features}
+
+    @profiling.profiled
+    def partial_fit(self, df, y=None):
+        """
+        Adds a new batch of transactions, sorted by accountid after the
+        batches before (a ValueError is raised otherwise). The frequencies
+        are built once, after all the batches, by `finalize` (or when the
+        model first scores), and the model is then the one fitted on all of
+        them together. Only the distinct values of each feature and their
+        counts are kept between the batches, along with the transactions of
+        the last account of the batch, which may continue in the next one.
+        """
+        if not hasattr(self, 'counts_'):
+            self.counts_ = {}
+            self.last_account_ = None
+            self.carried_ = None
+
+        self.last_account_ = utils.last_sorted_account(df['accountid'].values,
+                                                       self.last_account_)
+        if self.carried_ is not None:
+            df = pd.concat([self.carried_, df])
+        carried = np.asarray(df['accountid'].values == self.last_account_,
+                             dtype=bool)
+        self.carried_ = df[carried]
+        self._count_values(df[~carried])
+        self.pending_ = True
 
         return self
 
-    def predict(self, X):
-        ordered_X = X.copy().sort_values(['accountid', 'unixtime'], axis=0)
-        accounts = ordered_X['accountid'].values
-
-        tid = 0
-        ret = []
-        while tid < ordered_X.shape[0]:
-            next_tid = tid
-            current_account = accounts[next_tid]
-            while (next_tid < ordered_X.shape[0] and
-                   accounts[next_tid] == current_account):
-                # Process the next transaction
-                account_transations = ordered_X[tid: next_tid + 1]
-                transaction = account_transations.iloc[next_tid - tid]
-                score = self.predict_transactions(account_transations)
-                # Append the result
-                ret.append({'sessionid': transaction['sessionid'],
-                            'accountid': current_account,
-                            'fraudlistentry': transaction.get('fraudlistentry',
-                                                              0),
-                            'fraud-discount': transaction.get('fraud-discount',
-                                                              1.),
-                            'endpointscore': score * 100.,
-                            '_artificial_index_': 
-                                transaction['_artificial_index_'],
-                            'num_transactions': len(account_transations)
-                            })
-                next_tid += 1
-            tid = next_tid
-
-        ret = pd.DataFrame(ret)
-
-        return ret
-
-    def predict_transactions(self, transactions):
-        if transactions.shape[0] <= 1:
-            return 1.
-
-        user_frequencies = utils.feature_frequencies(transactions)
-        last_transaction = transactions.iloc[-1]
-
-        relevances = []
-        for feature in transactions.keys():
-            if (feature in self.skip_features or
-                feature not in user_frequencies or
-                feature not in self.global_frequencies):
-                continue
-
-            if feature not in user_frequencies:
-                continue
-
-            ufreq = user_frequencies.get(feature, self.epsilon)
-            max_ufreq = np.max([v
-                                for _, v in user_frequencies[feature].items()])
-            gfreq = self.global_frequencies.get(feature, self.epsilon)
-
-            value = last_transaction[feature]
-            if type(value) is float and np.isnan(value):
-                continue
-
-            ft_rel = self.ft_relevance[feature]
-            ft_match = ((ufreq[value] / max_ufreq) * 
-                        ((1 - self.universe_prior) +
-                         self.universe_prior * (1 - gfreq[value])))
+    def _count_values(self, df):
+        # Each value is counted once per account, the accounts of the batch
+        # being complete
+        accounts, _ = pd.factorize(np.asarray(df['accountid'].values),
+                                   sort=True)
+        features = [f for f in df.keys() if f not in self.skip_features]
+        for f in features:
+            self.counts_.setdefault(f, utils.DistinctCounts())
+        self._map_features(
+            lambda f: self.counts_[f].add(accounts, df[f].values), features)
+
+    def finalize(self):
+        """ Builds the frequencies of the batches of `partial_fit`. """
+        if getattr(self, 'pending_', False):
+            with profiling.stage('EndpointScorer.finalize'):
+                if self.carried_ is not None:
+                    self._count_values(self.carried_)
+                    self.carried_ = None
+                self._fit_frequencies(self._map_features(
+                    lambda f: self.counts_[f].value_counts(),
+                    list(self.counts_)))
+            self.pending_ = False
+        return self
 
-            relevances.append((ft_match, ft_rel))
+    def _fit_frequencies(self, value_counts):
+        # Frequency of each value among the distinct (account, value) pairs,
+        # given the values of each feature and their counts
+        self.global_frequencies = utils.frequency_tables(value_counts,
+                                                         self.memory_budget)
 
-        relevances = np.asarray(relevances)
-        ret = np.average(relevances[:, 0], weights=relevances[:, 1])
+        # The relevances are those of the exact frequencies
+        self.ft_relevance = \
+            {f: 1 - np.mean(utils.count_frequencies(counts))
+             for f, (_, counts) in value_counts.items()}
+        rel_sum = np.sum([v for _, v in self.ft_relevance.items()])
+        self.ft_relevance = \
+            {f: v / rel_sum for f, v in self.ft_relevance.items()}
 
-        if len(transactions) == 2:
-            ret = ret * 0.75
+        return self
 
-        return ret
+    @profiling.profiled
+    def predict_grouped(self, X, groups, states=None):
+        # Score each transaction online, keeping the running state of its
+        # account instead of rescanning the account's history
+        engine = self.engine(X.keys(), X)
+        return self.predict_online(engine, X, groups, states)
+
+    def engine(self, features=None, X=None):
+        """
+        Returns the online scoring engine of the scorer for the given columns
+        (all the scored features if None). If given, the frequencies of the
+        values of the frame X are looked up at once.
+        """
+        self.finalize()
+        if features is None:
+            features = list(self.global_frequencies)
+        features = [f for f in features
+                    if f not in self.skip_features and
+                    f in self.global_frequencies]
+        frequencies = {f: self.global_frequencies[f].lookup(
+                          None if X is None else X[f].values)
+                       for f in features}
+        return EndpointEngine(features, frequencies, self.ft_relevance,
+                              self.universe_prior, self.epsilon,
+                              self.window, self.half_life)
 
 
 """
@@ -138,77 +246,52 @@ probability of having the current value divided by the probability of the
 most probable value.
 """
 
-class ShippingScorer(BaseEstimator, RegressorMixin):
-    def __init__(self):                        
-        self.relevance = {
-            'shippingcountry': 2,
-            'shippingzipcode': 2,
-            'shippingstreet': 1,
-            'shippingstate': 2.5,
-            'shippingphonenumber': 0.5,
-            'shippingnamefirst': 0.5,
-            'shippingnamelast': 0.5,
-            'billingzipcode': 1
-            }
+class ShippingScorer(SubmodelScorer):
+    score_name = 'shippingscore'
+
+    def __init__(self, window=None, half_life=None):
+        self.relevance = dict(SHIPPING_RELEVANCE)
+        # History policy of the account states (see engine.py)
+        self.window = window
+        self.half_life = half_life
 
+    @profiling.profiled
     def fit(self, X, y=None):
         return self
 
-    def predict(self, X):
-        ordered_X = X.copy().sort_values(['accountid', 'unixtime'], axis=0)
-        accounts = ordered_X['accountid'].values
-
-        tid = 0
-        ret = []
-        while tid < ordered_X.shape[0]:
-            next_tid = tid
-            current_account = accounts[next_tid]
-            while (next_tid < ordered_X.shape[0] and
-                   accounts[next_tid] == current_account):
-                # Process the next transaction
-                account_transations = ordered_X[tid: next_tid + 1]
-                transaction = account_transations.iloc[next_tid - tid]
-                score = self.predict_transactions(account_transations)
-                # Append the result
-                ret.append({'sessionid': transaction['sessionid'],
-                            'accountid': current_account,
-                            'fraudlistentry': transaction.get('fraudlistentry',
-                                                              0),
-                            'fraud-discount': transaction.get('fraud-discount',
-                                                              1.),
-                            'shippingscore': score * 100.,
-                            '_artificial_index_': 
-                                transaction['_artificial_index_'],
-                            'num_transactions': len(account_transations)})
-                next_tid += 1
-            tid = next_tid
-
-        ret = pd.DataFrame(ret)
-        return ret
+    @profiling.profiled
+    def predict_grouped(self, X, groups, states=None):
+        # Continuing the persisted account histories, or bounding them, is
+        # done online
+        if (states is not None or self.window is not None or
+                self.half_life is not None):
+            return self.predict_online(self.engine(), X, groups, states)
 
-    def predict_transactions(self, transactions):
-        if len(transactions) <= 1:
-            return 1.
+        # Number of transactions of the account so far
+        sizes = (groups.positions() + 1).astype(float)
+        group_ids = groups.group_ids()
 
-        user_frequencies = utils.feature_frequencies(transactions)
+        probs = np.empty((len(groups), len(self.relevance)))
+        for i, f in enumerate(self.relevance):
+            codes, n_codes = utils.feature_codes(X[f].values)
+            codes = groups.take(codes)
 
-        relevances = []
-        for f, r in self.relevance.items():
-            value = transactions[f].iloc[-1]
-            prob = user_frequencies[f].get(value, 0)
-            max_prob = np.max([v for _, v in user_frequencies[f].items()])
-            prob /= max_prob
-            
-            relevances.append((prob, r))
+            # Occurrences of the current value and of the most frequent value
+            # so far in the account
+            counts = utils.running_counts(group_ids * n_codes + codes)
+            max_counts = groups.running_max(counts)
+            probs[:, i] = (counts / sizes) / (max_counts / sizes)
 
-        relevances = np.asarray(relevances)
+        weights = np.asarray(list(self.relevance.values()), dtype=float)
+        scores = np.average(probs, axis=1, weights=weights)
 
-        ret = np.average(relevances[:, 0], weights=relevances[:, 1])
+        scores[sizes == 2] *= 0.75
+        scores[sizes <= 1] = 1.
 
-        if len(transactions) == 2:
-            ret = ret * 0.75
+        return scores * 100.
 
-        return ret
+    def engine(self, features=None):
+        return ShippingEngine(self.relevance, self.window, self.half_life)
 
     
 """
@@ -217,116 +300,236 @@ cart size and the user's history and intersection between the cart.
 """
 
 
-class PurchaseScorer(BaseEstimator, RegressorMixin):
-    def __init__(self, window=10):                        
+class PurchaseScorer(SubmodelScorer):
+    score_name = 'purchasescore'
+
+    def __init__(self, window=PURCHASE_WINDOW):                        
         self.window = window
 
+    @profiling.profiled
     def fit(self, X, y=None):
         return self
 
-    def predict(self, X):
-        ordered_X = X.copy().sort_values(['accountid', 'unixtime'], axis=0)
-        accounts = ordered_X['accountid'].values
-
-        tid = 0
-        ret = []
-        while tid < ordered_X.shape[0]:
-            next_tid = tid
-            current_account = accounts[next_tid]
-            while (next_tid < ordered_X.shape[0] and
-                   accounts[next_tid] == current_account):
-                # Process the next transaction
-                account_transations = ordered_X[tid: next_tid + 1]
-                transaction = account_transations.iloc[next_tid - tid]
-                score = self.predict_transactions(account_transations)
-                # Append the result
-                ret.append({'sessionid': transaction['sessionid'],
-                            'accountid': current_account,
-                            'fraudlistentry': transaction.get('fraudlistentry',
-                                                              0),
-                            'fraud-discount': transaction.get('fraud-discount',
-                                                              1.),
-                            'purchasescore': score * 100.,
-                            '_artificial_index_': 
-                                transaction['_artificial_index_'],
-                            'num_transactions': len(account_transations)})
-                next_tid += 1
-            tid = next_tid
-
-        ret = pd.DataFrame(ret)
+    @profiling.profiled
+    def predict_grouped(self, X, groups, states=None):
+        return self.predict_online(self.engine(), X, groups, states)
 
-        return ret
+    def engine(self, features=None):
+        return PurchaseEngine(self.window)
 
-    def predict_transactions(self, transactions):
-        if len(transactions) <= 1:
-            return 1.
-        
-        ret = 0.
-
-        current = transactions.iloc[-1]
-        cat_freq = Counter(transactions['cart-categorical-amount'])
-        max_cat_freq = float(max([v for _, v in cat_freq.items()]))
-        cat_rel_freq = float(cat_freq[current['cart-categorical-amount']]) / \
-            max_cat_freq
-        
-        ret += 2. * cat_rel_freq
-
-        transactions = transactions.iloc[-self.window - 1:]
-        
-        all_types = transactions['cart-types'].iloc[: -1].values
-        all_types = set(','.join(all_types).split(','))
-        last_types = set(current['cart-types'].split(','))
-        types_intersect = float(len(all_types & last_types)) / len(last_types)
-        
-        ret += 1.5 * types_intersect
-        
-        ret = ret / 4.5
-
-        if len(transactions) == 2:
-            ret = ret * 0.75
 
-        return ret
+"""
+Concurrent execution of the submodels of a ModelMerger. The submodels run in
+forked processes, which share the input frame (and the account states) with
+the parent instead of receiving a pickled copy. The fitted submodels, or the
+scores and the updated account states of each submodel, are sent back to the
+parent.
+"""
+
+# Task of the submodel workers, inherited when they are forked
+_task = None
+
+
+def _init_submodel_worker():
+    # The metrics of the worker are sent back to the parent with the results
+    profiler = profiling.active()
+    if profiler is not None:
+        profiler.reset()
+
+
+def _worker_metrics():
+    profiler = profiling.active()
+    return profiler.snapshot() if profiler is not None else None
+
+
+def _fit_submodel(i):
+    merger, X, y, features = _task
+    name, estimator, _ = merger.estimators[i]
+    with profiling.stage(name, X.shape[0]):
+        estimator = merger._fit_estimator(estimator, X, y,
+                                          features.get(name))
+    return estimator, None, _worker_metrics()
+
+
+def _predict_submodel(i):
+    merger, X, groups, states, features = _task
+    name, estimator, _ = merger.estimators[i]
+    with profiling.stage(name, X.shape[0]):
+        scores = merger._predict_grouped(estimator, X, groups, states,
+                                         features.get(name))
+
+    # The states of the submodel for the accounts of X
+    if states is not None:
+        key = _scorer(estimator).score_name
+        states = {a: states[a][key] for a in pd.unique(X['accountid'].values)
+                  if a in states and key in states[a]}
+    return scores, states, _worker_metrics()
+
+
+def _scorer(estimator):
+    return estimator[-1] if isinstance(estimator, Pipeline) else estimator
+
+
+def _update_fitted(estimator, fitted):
+    # The fitted state is copied into the estimators of the parent, which
+    # may be referenced elsewhere
+    steps = [(estimator, fitted)]
+    if isinstance(estimator, Pipeline):
+        steps = [(s, f) for (_, s), (_, f) in zip(estimator.steps,
+                                                  fitted.steps)]
+    for step, fitted_step in steps:
+        step.__dict__.update(fitted_step.__dict__)
+
+
+def _record_values(estimator, engine, record):
+    # Values of the features of the engine of a submodel for a single
+    # transaction, transformed by the transformers of the submodel
+    if isinstance(estimator, Pipeline):
+        for _, step in estimator.steps[:-1]:
+            record = step.transform_record(record)
+    return tuple([record.get(f, np.nan) for f in engine.features])
 
 
 """
 This class implements a merger of the models' scores.
 It receives a list of names, models, and weights to be used in the weighted
-average score. It applies a disccount on the fraud transactions.
+average score. It applies a disccount on the fraud transactions. With
+`n_jobs` > 1, the submodels are fitted and scored in that many concurrent
+processes.
 """
 
 class ModelMerger(BaseEstimator, RegressorMixin):
-    def __init__(self, estimators):
+    def __init__(self, estimators, n_jobs=None):
         self.estimators = estimators
         self.names = [n for n, _, _ in estimators]
         self.weights = [w for _, _, w in estimators]
+        self.n_jobs = n_jobs
+
+    @profiling.profiled
+    def fit(self, X, y=None, features=None):
+        """
+        Fits the submodels on X. If given, `features` maps the names of
+        submodels to the output of their transformers on X (e.g. loaded from
+        a featurecache.FeatureCache), so that only their scorers are fitted.
+        """
+        features = features or {}
+        if self._concurrent():
+            results = self._map_submodels(_fit_submodel,
+                                          (self, X, y, features))
+            for (_, estimator, _), (fitted, _, _) in zip(self.estimators,
+                                                         results):
+                _update_fitted(estimator, fitted)
+            return self
+
+        estimators = []
+        for name, estimator, weight in self.estimators:
+            with profiling.stage(name, X.shape[0]):
+                estimators.append((name, self._fit_estimator(
+                    estimator, X, y, features.get(name)), weight))
+        self.estimators = estimators
+        return self
 
-    def fit(self, X, y=None):
-        self.estimators = [(name, estimator.fit(X, y), weight)
-                           for name, estimator, weight in self.estimators]
+    def _concurrent(self):
+        # Forking requires the fork start method, and the workers of a pool
+        # (e.g. the shards of parallel.py) can not fork workers of their own
+        return (self.n_jobs is not None and self.n_jobs > 1 and
+                len(self.estimators) > 1 and
+                'fork' in multiprocessing.get_all_start_methods() and
+                not multiprocessing.current_process().daemon)
+
+    def _map_submodels(self, func, task):
+        global _task
+        _task = task
+        try:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(self.n_jobs, len(self.estimators)),
+                              initializer=_init_submodel_worker) as pool:
+                results = pool.map(func, range(len(self.estimators)),
+                                   chunksize=1)
+        finally:
+            _task = None
+
+        profiler = profiling.active()
+        if profiler is not None:
+            for _, _, metrics in results:
+                profiler.merge(metrics)
+        return results
+
+    @profiling.profiled
+    def fit_transformers(self, X, y=None):
+        """
+        Fits only the feature transformers of the submodels, keeping the
+        scorers as they are (e.g. loaded from a model artifact).
+        """
+        for name, estimator, _ in self.estimators:
+            if isinstance(estimator, Pipeline):
+                with profiling.stage(name, X.shape[0]):
+                    estimator[:-1].fit(X, y)
         return self
 
-    def predict(self, X):
-        ret = None
-        for name, estimator, weight in self.estimators:
-            preds = estimator.predict(X)
-            next_ = preds[['_artificial_index_', 'sessionid', 'accountid',
-                           'num_transactions', name]]
-
-            # Aggregate the scores
-            if ret is None:
-                ret = next_.copy()
-                finalscore = next_[name].values * weight * \
-                    preds['fraud-discount'].values
-                ret['finalscore'] = finalscore
-                ret['fraudlistentry'] = preds['fraudlistentry'].values
-
-                signals = ['' if fd == 1. else 'Fraudulent IP'
-                           for fd in preds['fraud-discount']]
-                ret['signalstriggered'] = np.asarray(signals)
-            else:
-                ret[name] = next_[name]
-                ret['finalscore'] += next_[name].values * weight * \
-                    preds['fraud-discount'].values
+    @profiling.profiled
+    def predict(self, X, states=None, features=None):
+        """
+        Scores the transactions of X. If given, `states` maps each accountid
+        to the account states of the submodels (see
+        SubmodelScorer.predict_grouped), which are continued and updated,
+        and `features` the names of submodels to the output of their
+        transformers on X, which are then skipped.
+        """
+        features = features or {}
+        # Sort the transactions by account once for all the submodels
+        groups = utils.AccountGroups.from_frame(X)
+        fraud_discount = (X['fraud-discount'].values
+                          if 'fraud-discount' in X else np.ones(X.shape[0]))
+
+        num_transactions = groups.positions() + 1
+        if states is not None:
+            num_transactions = self._continue_counts(X, groups, states,
+                                                     num_transactions)
+        if len(num_transactions):
+            profiling.gauge_max('longest_account_history',
+                                int(num_transactions.max()))
+
+        ret = pd.DataFrame({
+            '_artificial_index_': X['_artificial_index_'].values,
+            'sessionid': X['sessionid'].values,
+            'accountid': X['accountid'].values,
+            'num_transactions': groups.scatter(num_transactions)
+            })
+        ret['finalscore'] = 0.
+        ret['fraudlistentry'] = (X['fraudlistentry'].values
+                                 if 'fraudlistentry' in X else 0)
+        # Kept for the sweeps of the fraud IP discount (see sweep.py)
+        ret['fraud-ip'] = X['fraud-ip'].values if 'fraud-ip' in X else False
+
+        signals = ['' if fd == 1. else 'Fraudulent IP'
+                   for fd in fraud_discount]
+        ret['signalstriggered'] = np.asarray(signals)
+
+        if self._concurrent():
+            results = self._map_submodels(_predict_submodel,
+                                          (self, X, groups, states,
+                                           features))
+            all_scores = [scores for scores, _, _ in results]
+            for (_, estimator, _), (_, submodel_states, _) in \
+                    zip(self.estimators, results):
+                if states is not None:
+                    key = _scorer(estimator).score_name
+                    for a, state in submodel_states.items():
+                        states.setdefault(a, {})[key] = state
+        else:
+            all_scores = []
+            for name, estimator, _ in self.estimators:
+                with profiling.stage(name, X.shape[0]):
+                    all_scores.append(self._predict_grouped(
+                        estimator, X, groups, states, features.get(name)))
+
+        # Merge the scores once all the submodels finished
+        for (name, _, weight), scores in zip(self.estimators, all_scores):
+            # Aggregate the scores, in the original order of the transactions
+            scores = groups.scatter(scores)
+            ret[name] = scores
+            ret['finalscore'] += scores * weight * fraud_discount
 
         # Compute the average score
         ret['finalscore'] /= np.sum(self.weights)
@@ -338,5 +541,63 @@ class ModelMerger(BaseEstimator, RegressorMixin):
 
         return ret
 
+    def predict_record(self, record, states=None, features=None):
+        """
+        Scores a single transaction given as a dictionary (with the fraud
+        features), continuing and updating its account histories in
+        `states` if given. The values of the features of the submodels can
+        be given, as computed by `record_features`.
+        """
+        return score_record(record, self._record_submodels(), states,
+                            features)
+
+    def record_features(self, record):
+        """
+        Values of the features of the submodels for a single transaction
+        (see engine.record_features), raising an error if it can not be
+        scored.
+        """
+        return record_features(record, self._record_submodels())
+
+    def _record_submodels(self):
+        submodels = []
+        for name, estimator, weight in self.estimators:
+            engine = _scorer(estimator).record_engine()
+            submodels.append((name, weight, engine,
+                              partial(_record_values, estimator, engine)))
+        return submodels
+
     def transform(self, X):
         return self.predict(X)
+
+    @staticmethod
+    def _fit_estimator(estimator, X, y=None, features=None):
+        # A submodel with its features given only fits its scorer
+        if isinstance(estimator, Pipeline) and features is not None:
+            estimator[-1].fit(features, y)
+            return estimator
+        return estimator.fit(X, y)
+
+    @staticmethod
+    def _predict_grouped(estimator, X, groups, states=None, features=None):
+        if isinstance(estimator, Pipeline):
+            X = (estimator[:-1].transform(X) if features is None
+                 else features)
+            estimator = estimator[-1]
+
+        return estimator.predict_grouped(X, groups, states)
+
+    @staticmethod
+    def _continue_counts(X, groups, states, num_transactions):
+        # Add the previous transactions of each account to its count
+        accounts = groups.take(X['accountid'].values)[groups.offsets[:-1]]
+        previous = [states[a].get('num_transactions', 0) if a in states else 0
+                    for a in accounts]
+        num_transactions = num_transactions + \
+            np.repeat(previous, np.diff(groups.offsets))
+
+        for a, n in zip(accounts, num_transactions[groups.offsets[1:] - 1]):
+            if a == a:
+                states.setdefault(a, {})['num_transactions'] = int(n)
+
+        return num_transactions
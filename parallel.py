@@ -0,0 +1,92 @@
+import multiprocessing
+import pandas as pd
+import numpy as np
+
+import profiling
+from signals import apply_signals
+
+
+"""
+Scoring of a frame in a pool of worker processes. The transactions are
+hash-partitioned by accountid, so that the whole history of an account is
+scored by the same worker, and the results are identical to a single-process
+run. Each worker receives the fitted model once, when it starts.
+"""
+
+
+def shard_ids(accounts, n_shards):
+    """ Stable shard of each accountid. """
+    hashes = pd.util.hash_array(np.asarray(accounts, dtype=object))
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+_model = None
+
+
+def _init_worker(model):
+    global _model
+    _model = model
+
+    # The metrics of the worker are sent back to the parent with the results
+    profiler = profiling.active()
+    if profiler is not None:
+        profiler.reset()
+
+
+def _score_shard(args):
+    shard, states, features = args
+    ret = _model.predict(shard, states=states, features=features)
+    ret = apply_signals(ret, shard['eventtriggeredsignals'].values)
+
+    profiler = profiling.active()
+    metrics = None
+    if profiler is not None:
+        metrics = profiler.snapshot()
+        profiler.reset()
+    return ret, states, metrics
+
+
+def predict_sharded(model, df, workers, states=None, features=None):
+    """
+    Scores df with the fitted model (including the signal penalties) in
+    `workers` processes. Returns the predictions in the order of df, and
+    updates `states` in place if given. The `features` of the submodels on
+    df, if given (see ModelMerger.predict), are partitioned along with it.
+    """
+    shards = shard_ids(df['accountid'].values, workers)
+    positions = [np.flatnonzero(shards == i) for i in range(workers)]
+    positions = [p for p in positions if len(p)] or [positions[0]]
+
+    tasks = []
+    for p in positions:
+        shard = df.iloc[p]
+        shard_states = None
+        if states is not None:
+            shard_states = {a: states[a] for a in shard['accountid'].unique()
+                            if a in states}
+        shard_features = None
+        if features is not None:
+            shard_features = {name: f.iloc[p] for name, f in features.items()}
+        tasks.append((shard, shard_states, shard_features))
+
+    # Forked workers share the model with the parent instead of unpickling it
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods
+                                          else None)
+    with context.Pool(len(tasks), initializer=_init_worker,
+                      initargs=(model,)) as pool:
+        results = pool.map(_score_shard, tasks)
+
+    if states is not None:
+        for _, shard_states, _ in results:
+            states.update(shard_states)
+
+    profiler = profiling.active()
+    if profiler is not None:
+        for _, _, metrics in results:
+            profiler.merge(metrics)
+
+    # Merge the shards back in the original order
+    ret = pd.concat([r for r, _, _ in results], ignore_index=True)
+    order = np.argsort(np.concatenate(positions), kind='stable')
+    return ret.iloc[order].reset_index(drop=True)
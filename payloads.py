@@ -0,0 +1,123 @@
+from collections import OrderedDict
+import numpy as np
+import json
+
+
+"""
+Batch extraction of the JSON payloads of the transactions (`shipping_info`
+and `cart_info`). Only the fields used by the models are kept, and they are
+written straight into one array per field. Repeat customers often send
+byte-identical payloads, so the extracted fields are memoized by payload in a
+bounded LRU cache. Payloads that can not be parsed are counted and extracted
+as empty payloads.
+"""
+
+
+SHIPPING_FIELDS = ['shippingcountry', 'shippingzipcode', 'shippingnamelast',
+                   'shippingnamefirst', 'shippingstate', 'shippingphonenumber',
+                   'shippingstreet', 'billingzipcode']
+
+PURCHASE_FIELDS = ['cart-categorical-amount', 'cart-types']
+
+
+def shipping_fields(info):
+    shipping_address = info.get('ShippingAddress', {})
+
+    ret = [shipping_address.get(v, None)
+           for v in ['shippingcountry', 'shippingzipcode', 'shippingnamelast',
+                     'shippingnamefirst', 'shippingstate',
+                     'shippingphonenumber']]
+    ret.append(shipping_address.get('shippingstreet', '') + ' ' +
+               shipping_address.get('shippingstreet2', ''))
+    ret.append(info.get('BillingAddress', {}).get('billingzipcode', None))
+
+    return tuple(ret)
+
+
+def purchase_fields(info):
+    def next_total(p):
+        try:
+            return float(p.get('productPrice', 0)) * \
+                float(p.get('productQuantity', 0))
+        except (AttributeError, TypeError, ValueError):
+            return 0.
+
+    info = info.get('CartProduct', {})
+    products = []
+    if 'all' in info:
+        products = info['all']
+
+    amount = sum([next_total(p) for p in products])
+    categorical_amount = 'xl'
+    if amount < 800.:
+        categorical_amount = 's'
+    elif amount < 1000.:
+        categorical_amount = 'm'
+    elif amount < 3000.:
+        categorical_amount = 'l'
+
+    types = [p.get('productType', None) for p in products]
+    types = ','.join([p for p in types if p is not None])
+
+    return (categorical_amount, types)
+
+
+class PayloadExtractor(object):
+    def __init__(self, fields, extract, cache_size=65536):
+        self.fields = fields
+        self.extract = extract
+        self.cache_size = cache_size
+        self.empty = extract({})
+        self.cache = OrderedDict()
+        self.parse_errors = 0
+
+    def decode(self, payload):
+        """
+        Returns the extracted fields of a payload, and whether it could not
+        be parsed. Missing payloads are extracted as empty payloads.
+        """
+        if not isinstance(payload, str):
+            return self.empty, False
+
+        try:
+            values = self.cache[payload]
+            self.cache.move_to_end(payload)
+            return values
+        except KeyError:
+            pass
+
+        try:
+            values = (self.extract(json.loads(payload)), False)
+        except (ValueError, TypeError, AttributeError):
+            values = (self.empty, True)
+
+        self.cache[payload] = values
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return values
+
+    def fields_of(self, payload):
+        """
+        Returns the extracted fields of a single payload as a dictionary,
+        counting it if it can not be parsed.
+        """
+        values, error = self.decode(payload)
+        self.parse_errors += error
+        return dict(zip(self.fields, values))
+
+    def transform(self, payloads, counts=None):
+        """
+        Extracts a batch of payloads into a dictionary with an array of
+        values per field. `counts` is the number of occurrences of each
+        payload, if they are distinct, for the count of parse errors.
+        """
+        columns = [np.empty(len(payloads), dtype=object) for _ in self.fields]
+        for i, payload in enumerate(payloads):
+            values, error = self.decode(payload)
+            self.parse_errors += error * (1 if counts is None
+                                          else int(counts[i]))
+            for column, value in zip(columns, values):
+                column[i] = value
+
+        return dict(zip(self.fields, columns))
@@ -0,0 +1,78 @@
+from sklearn.pipeline import Pipeline
+
+from preprocessing import EndpointTransformer, ShippingTransformer, \
+    PurchaseTransformer
+from models import EndpointScorer, ShippingScorer, PurchaseScorer, ModelMerger
+from engine import WEIGHTS
+
+
+"""
+The full scoring model: the fraud list features followed by the weighted
+merge of the enabled submodels.
+"""
+
+
+def build_model(fraud, endpoint_scorer=None, endpoint=True, shipping=True,
+                purchase=True, fit_threads=None, submodel_jobs=None,
+                frequency_budget=None, shipping_scorer=None, window=None,
+                half_life=None):
+    """
+    Returns the full model with the given FraudTransformer and, optionally,
+    a fitted EndpointScorer and a ShippingScorer (e.g. loaded from a model
+    artifact). `fit_threads` is the number of threads fitting the endpoint
+    model, `submodel_jobs` the number of processes running the submodels
+    concurrently, and `frequency_budget` the bytes of the frequency tables
+    of the endpoint model (exact if None). The new endpoint and shipping
+    scorers bound the account histories to the last `window` transactions,
+    or decay them with a half-life of `half_life` seconds (see engine.py).
+    """
+    models = []
+    if endpoint:
+        if endpoint_scorer is None:
+            endpoint_scorer = EndpointScorer(n_jobs=fit_threads,
+                                             memory_budget=frequency_budget,
+                                             window=window,
+                                             half_life=half_life)
+        endpoint_model = Pipeline([('features', EndpointTransformer()),
+                                   ('model', endpoint_scorer)])
+        models.append(('endpointscore', endpoint_model,
+                       WEIGHTS['endpointscore']))
+    if shipping:
+        if shipping_scorer is None:
+            shipping_scorer = ShippingScorer(window=window,
+                                             half_life=half_life)
+        shipping_model = Pipeline([('features', ShippingTransformer()),
+                                   ('model', shipping_scorer)])
+        models.append(('shippingscore', shipping_model,
+                       WEIGHTS['shippingscore']))
+    if purchase:
+        purchase_model = Pipeline([('features', PurchaseTransformer()),
+                                   ('model', PurchaseScorer())])
+        models.append(('purchasescore', purchase_model,
+                       WEIGHTS['purchasescore']))
+
+    return Pipeline([('fraud', fraud),
+                     ('models', ModelMerger(models, n_jobs=submodel_jobs))
+                     ])
+
+
+def submodel(model, name):
+    """ Returns the pipeline of a submodel of the full model, or None. """
+    for name_, estimator, _ in model.named_steps['models'].estimators:
+        if name_ == name:
+            return estimator
+    return None
+
+
+def input_columns(model):
+    """
+    Columns of the input read by the model, by the signal penalties and in
+    the output.
+    """
+    ret = set(['unixtime', 'sessionid', 'accountid', 'ip',
+               'eventtriggeredsignals'])
+    for _, estimator, _ in model.named_steps['models'].estimators:
+        if isinstance(estimator, Pipeline):
+            for _, step in estimator.steps[:-1]:
+                ret.update(step.features)
+    return ret
@@ -1,29 +1,98 @@
 from sklearn.base import BaseEstimator, TransformerMixin
 import pandas as pd
-import json
+import numpy as np
+import warnings
 
+import profiling
+import utils
+from engine import FRAUD_IP_DISCOUNT, record_value, flag_record
+from fraudlist import FraudIndex, FraudList
+from payloads import PayloadExtractor, SHIPPING_FIELDS, PURCHASE_FIELDS, \
+    shipping_fields, purchase_fields
+
+
+EXTRA_FEATURES = ['sessionid', 'accountid', 'unixtime', 'fraudlistentry',
+                  'fraud-discount', '_artificial_index_']
+
+
+"""
+The submodel transformers select the features of a submodel and encode them
+as Categoricals: integer codes backed by a dictionary of the distinct values
+of each feature, kept (and grown) by the transformer. The pairs of interest
+are encoded from the combined codes of their features, so that the text of a
+pair is only built once per distinct pair. The extra features are passed
+through as they are.
+"""
 
 class SubmodelTransformer(BaseEstimator, TransformerMixin):
     def __init__(self, features=[], pairs_of_interest=[],
-                 extra_features=['sessionid', 'accountid', 'unixtime',
-                                 'fraudlistentry', 'fraud-discount',
-                                 '_artificial_index_'
-                                 ]):
+                 extra_features=EXTRA_FEATURES):
         self.features = extra_features + features
         self.pairs_of_interest = pairs_of_interest
+        self.extra_features = extra_features
     
+    @profiling.profiled
     def fit(self, df, y=None):
         keys = df.keys()
         self.features = [f for f in self.features if f in keys]
         self.pairs_of_interest = [(a, b) for a, b in self.pairs_of_interest
                                   if a in keys and b in keys]
+        self.dictionaries_ = {}
 
         return self
 
+    def dictionary(self, feature):
+        """ The dictionary of the values of a feature. """
+        if getattr(self, 'dictionaries_', None) is None:
+            self.dictionaries_ = {}
+        if feature not in self.dictionaries_:
+            self.dictionaries_[feature] = utils.Dictionary()
+        return self.dictionaries_[feature]
+
+    @profiling.profiled
     def transform(self, df):
-        ret = df[self.features].copy()
+        columns = {}
+        codes = {}
+        for f in self.features:
+            if f in self.extra_features:
+                columns[f] = df[f].values.copy()
+            else:
+                columns[f] = self.dictionary(f).categorical(df[f].values)
+                codes[f] = columns[f].codes.astype(np.int64)
+
         for a, b in self.pairs_of_interest:
-            ret[a + '::' + b] = df[a] + '|||' + df[b]
+            for f in [a, b]:
+                if f not in codes:
+                    codes[f] = self.dictionary(f).encode(df[f].values)
+            columns[a + '::' + b] = self._encode_pair(a, b, codes[a],
+                                                      codes[b])
+
+        return pd.DataFrame(columns, index=df.index)
+
+    def _encode_pair(self, a, b, codes_a, codes_b):
+        # The pair is missing if any of its values is missing
+        valid = (codes_a >= 0) & (codes_b >= 0)
+        keys, inverse = np.unique((codes_a[valid] << 32) | codes_b[valid],
+                                  return_inverse=True)
+
+        values_a = self.dictionary(a).values.values
+        values_b = self.dictionary(b).values.values
+        texts = values_a[keys >> 32] + '|||' + values_b[keys & 0xffffffff]
+
+        dictionary = self.dictionary(a + '::' + b)
+        codes = np.full(len(codes_a), -1, dtype=np.int64)
+        codes[valid] = dictionary.encode(texts)[inverse]
+        return pd.Categorical.from_codes(codes,
+                                         categories=dictionary.values)
+
+    def transform_record(self, record):
+        """
+        Transforms a single transaction given as a dictionary. Missing and
+        null values are NaN, as in the parsed input files.
+        """
+        ret = {f: record_value(record, f) for f in self.features}
+        for a, b in self.pairs_of_interest:
+            ret[a + '::' + b] = record_value(record, a + '::' + b)
 
         return ret
 
@@ -45,116 +114,133 @@ class EndpointTransformer(SubmodelTransformer):
         super(EndpointTransformer, self).__init__(features, pairs_of_interest)
 
 
-class ShippingTransformer(SubmodelTransformer):
-    def __init__(self):
-        features = ['shipping_info']
-        super(ShippingTransformer, self).__init__(features)
+class PayloadTransformer(SubmodelTransformer):
+    """
+    Extracts the fields used by a submodel from a JSON payload column.
+    """
+    payload = None
+
+    def __init__(self, fields, extract, cache_size=65536):
+        # The payloads are passed through, and their fields encoded
+        super(PayloadTransformer, self).__init__(
+            extra_features=EXTRA_FEATURES + [self.payload])
+        self.fields = fields
+        self.extract = extract
+        self.cache_size = cache_size
 
+    @profiling.profiled
     def fit(self, X, y=None):
         return self
 
+    def extractor(self):
+        # The cache of payloads is kept between calls
+        if getattr(self, 'extractor_', None) is None:
+            self.extractor_ = PayloadExtractor(self.fields, self.extract,
+                                               self.cache_size)
+        return self.extractor_
+
+    @profiling.profiled
+    def fit_transform(self, X, y=None):
+        # The fit of a pipeline transforms its input before it is scored, so
+        # that the parse failures are only reported by the scoring pass
+        return self.fit(X, y)._transform(X, report=False)
+
+    @profiling.profiled
     def transform(self, X):
-        ret = super(ShippingTransformer, self).transform(X)
-        
-        new_info = []
-        for info in ret.shipping_info:
-            try:
-                info = json.loads(info)
-            except:
-                info = {}
-
-            shipping_address = info.get('ShippingAddress', {})
-            
-            next_ = {v: shipping_address.get(v, None)
-                     for v in ['shippingcountry', 'shippingzipcode',
-                               'shippingnamelast', 'shippingnamefirst',
-                               'shippingstate', 'shippingphonenumber',
-                               ]}
-            next_['shippingstreet'] = shipping_address.get('shippingstreet',
-                                                           '') + ' ' + \
-                shipping_address.get('shippingstreet2', '')
-
-            next_['billingzipcode'] = info.get('BillingAddress',
-                                               {}).get('billingzipcode', None)
-            new_info.append(next_)
-
-        new_info = pd.DataFrame(new_info)
-        ret = ret.join(new_info)
-        
+        return self._transform(X)
+
+    def _transform(self, X, report=True):
+        ret = super(PayloadTransformer, self).transform(X)
+
+        # Extract and encode each distinct payload once, the missing
+        # payloads being the last one
+        codes, payloads = pd.factorize(np.asarray(ret[self.payload].values,
+                                                  dtype=object))
+        payloads = np.append(np.asarray(payloads, dtype=object), np.nan)
+        codes[codes < 0] = len(payloads) - 1
+        counts = np.bincount(codes, minlength=len(payloads))
+
+        extractor = self.extractor()
+        parse_errors = extractor.parse_errors
+        new_info = extractor.transform(payloads, counts)
+        self.parse_errors_ = extractor.parse_errors - parse_errors
+        if report:
+            profiling.count('json_parse_failures', self.parse_errors_,
+                            payload=self.payload)
+        if report and self.parse_errors_:
+            warnings.warn('%d %s payloads could not be parsed' %
+                          (self.parse_errors_, self.payload))
+
+        for f in self.fields:
+            dictionary = self.dictionary(f)
+            ret[f] = pd.Categorical.from_codes(
+                dictionary.encode(new_info[f])[codes],
+                categories=dictionary.values)
+
         return ret
 
+    def transform_record(self, record):
+        ret = super(PayloadTransformer, self).transform_record(record)
 
-class PurchaseTransformer(SubmodelTransformer):
-    def __init__(self):
-        features = ['cart_info']
-        super(PurchaseTransformer, self).__init__(features)
+        ret.update(self.extractor().fields_of(ret[self.payload]))
 
-    def fit(self, X, y=None):
-        return self
+        return ret
 
-    def transform(self, X):
-        def next_total(p):
-            try:
-                return float(p.get('productPrice', 0)) * \
-                    float(p.get('productQuantity', 0))
-            except:
-                return 0.
-
-        ret = super(PurchaseTransformer, self).transform(X)
-        
-        new_info = []
-        for info in ret.cart_info.values:
-            try:
-                info = json.loads(info)
-            except:
-                info = {}
-
-            info = info.get('CartProduct', {})
-            products = []
-            if 'all' in info:
-                products = info['all']
-
-            amount = sum([next_total(p) for p in products])
-            categorical_amount = 'xl'
-            if amount < 800.:
-                categorical_amount = 's'
-            elif amount < 1000.:
-                categorical_amount = 'm'
-            elif amount < 3000.:
-                categorical_amount = 'l'
-
-
-            types = [p.get('productType', None) for p in products]
-            types = ','.join([p for p in types if p is not None])
-            
-            next_ = {'cart-categorical-amount': categorical_amount,
-                     'cart-types': types
-                     }
-            new_info.append(next_)
-
-        new_info = pd.DataFrame(new_info)
-        ret = ret.join(new_info)
 
-        return ret
+class ShippingTransformer(PayloadTransformer):
+    payload = 'shipping_info'
+
+    def __init__(self, cache_size=65536):
+        super(ShippingTransformer, self).__init__(SHIPPING_FIELDS,
+                                                  shipping_fields,
+                                                  cache_size)
+
+
+class PurchaseTransformer(PayloadTransformer):
+    payload = 'cart_info'
+
+    def __init__(self, cache_size=65536):
+        super(PurchaseTransformer, self).__init__(PURCHASE_FIELDS,
+                                                  purchase_fields,
+                                                  cache_size)
 
 
 class FraudTransformer(BaseEstimator, TransformerMixin):
     def __init__(self, fraud_filename='data/fraud_list.csv'):
-        fraud_list = pd.read_csv(fraud_filename)
-        self.fraud_email = set(fraud_list['customer_email'].values)
-        self.fraud_ip = set(fraud_list['ip'].values)
-
+        # Without a file, the fraud index is loaded from a model artifact
+        self.fraud_filename = fraud_filename
+        self.fraud_list = None
+        self.fraud_index = FraudIndex.from_values([], [])
+        if fraud_filename is not None:
+            self.fraud_list = FraudList(fraud_filename)
+            self.fraud_index = self.fraud_list.index
+
+    def reload(self):
+        """
+        Switches to the new fraud list if the file changed. Returns whether
+        it was reloaded.
+        """
+        if self.fraud_list is None or not self.fraud_list.reload():
+            return False
+        self.fraud_index = self.fraud_list.index
+        return True
+
+    @profiling.profiled
     def fit(self, X, y=None):
         return self
 
+    @profiling.profiled
     def transform(self, X):
-        fraud_accountid = [a in self.fraud_email
-                           for a in X['accountid'].values]
-        fraud_ip = [1 - 0.0 * int(a in self.fraud_ip) for a in X['ip'].values]
+        index = self.fraud_index
+        fraud_accountid = index.match_emails(X['accountid'].values)
+        fraud_ip = index.match_ips(X['ip'].values)
 
         ret = X.copy()
         ret['fraudlistentry'] = fraud_accountid
-        ret['fraud-discount'] = fraud_ip
+        ret['fraud-ip'] = fraud_ip
+        ret['fraud-discount'] = 1 - FRAUD_IP_DISCOUNT * fraud_ip.astype(int)
 
         return ret
 
+    def transform_record(self, record):
+        return flag_record(self.fraud_index, record)
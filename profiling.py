@@ -0,0 +1,252 @@
+from collections import OrderedDict
+import contextlib
+import functools
+import resource
+import time
+import json
+import sys
+import os
+
+
+"""
+Opt-in instrumentation of the scoring stages. When enabled (see `enable`),
+the stages record their wall time, CPU time, rows in and out and how much
+they raised the peak memory of the process, aggregated by stage name. The
+stages nest, and their names are the path of the enclosing stages, e.g.
+'predict/ModelMerger.predict/shippingscore/ShippingTransformer.transform'.
+Counters (e.g. JSON parse failures) and gauges (e.g. the longest account
+history) are recorded along with the stages.
+
+When disabled, the instrumented code runs as is.
+"""
+
+
+_profiler = None
+
+
+def _number(value):
+    # The NumPy scalars are converted to Python numbers, which the metrics
+    # files can be written with
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _label_value(value):
+    # Label value escaped as in the Prometheus text format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the process, in MB. """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024. ** 2 if sys.platform == 'darwin' else 1024.)
+
+
+def _rows(x):
+    try:
+        return x.shape[0]
+    except (AttributeError, IndexError):
+        return None
+
+
+class Profiler(object):
+    def __init__(self):
+        self.path = []
+        self.reset()
+
+    def reset(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+        self.started = (time.perf_counter(), time.process_time())
+
+    def record(self, name, wall, cpu, rows_in=None, rows_out=None,
+               peak_delta=0.):
+        stage = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.,
+                                              'cpu_s': 0., 'rows_in': 0,
+                                              'rows_out': 0,
+                                              'peak_memory_delta_mb': 0.})
+        stage['calls'] += 1
+        stage['wall_s'] += wall
+        stage['cpu_s'] += cpu
+        stage['rows_in'] += rows_in or 0
+        stage['rows_out'] += rows_out or 0
+        stage['peak_memory_delta_mb'] += peak_delta
+
+    def count(self, metric, n, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + _number(n)
+
+    def gauge_max(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        value = _number(value)
+        self.gauges[key] = max(self.gauges.get(key, value), value)
+
+    def snapshot(self):
+        return self.stages, self.counters, self.gauges
+
+    def merge(self, snapshot):
+        """ Adds the metrics of a snapshot, e.g. from a worker process. """
+        stages, counters, gauges = snapshot
+        for name, s in stages.items():
+            self.record(name, s['wall_s'], s['cpu_s'], s['rows_in'],
+                        s['rows_out'], s['peak_memory_delta_mb'])
+            self.stages[name]['calls'] += s['calls'] - 1
+        for (metric, labels), n in counters.items():
+            self.count(metric, n, **dict(labels))
+        for (metric, labels), value in gauges.items():
+            self.gauge_max(metric, value, **dict(labels))
+
+    def to_dict(self):
+        wall, cpu = self.started
+        def entries(metrics):
+            return [{'metric': m, 'labels': dict(l), 'value': v}
+                    for (m, l), v in metrics.items()]
+
+        return {'wall_s': time.perf_counter() - wall,
+                'cpu_s': time.process_time() - cpu,
+                'peak_memory_mb': peak_rss_mb(),
+                'stages': self.stages,
+                'counters': entries(self.counters),
+                'gauges': entries(self.gauges)}
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_textfile(self, filename, prefix='risk_'):
+        """
+        Writes the metrics in the Prometheus text format, e.g. for the
+        textfile collector of the node exporter. The file is replaced
+        atomically.
+        """
+        def labels(items):
+            return '{%s}' % ','.join('%s="%s"' % (k, _label_value(v))
+                                     for k, v in items) if items else ''
+
+        metrics = self.to_dict()
+        lines = []
+        for name, value in [('run_wall_seconds', metrics['wall_s']),
+                            ('run_cpu_seconds', metrics['cpu_s']),
+                            ('run_peak_memory_bytes',
+                             metrics['peak_memory_mb'] * 1024 ** 2)]:
+            lines += ['# TYPE %s%s gauge' % (prefix, name),
+                      '%s%s %r' % (prefix, name, float(value))]
+
+        for name, key, scale in [('stage_calls', 'calls', 1),
+                                 ('stage_wall_seconds', 'wall_s', 1),
+                                 ('stage_cpu_seconds', 'cpu_s', 1),
+                                 ('stage_rows_in', 'rows_in', 1),
+                                 ('stage_rows_out', 'rows_out', 1),
+                                 ('stage_peak_memory_delta_bytes',
+                                  'peak_memory_delta_mb', 1024 ** 2)]:
+            lines.append('# TYPE %s%s gauge' % (prefix, name))
+            for stage, s in self.stages.items():
+                lines.append('%s%s%s %r' % (prefix, name,
+                                            labels([('stage', stage)]),
+                                            float(s[key] * scale)))
+
+        # The names of the counters end with _total
+        for kind, suffix, entries in [('counter', '_total', self.counters),
+                                      ('gauge', '', self.gauges)]:
+            for metric in OrderedDict.fromkeys(m for m, _ in entries):
+                name = prefix + metric + suffix
+                lines.append('# TYPE %s %s' % (name, kind))
+                for (m, l), v in entries.items():
+                    if m == metric:
+                        lines.append('%s%s %r' % (name, labels(l), float(v)))
+
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, filename)
+
+    def summary(self):
+        lines = ['%-72s %6s %9s %9s %10s %9s' %
+                 ('stage', 'calls', 'wall (s)', 'cpu (s)', 'rows in',
+                  '+mem (MB)')]
+        for name, s in self.stages.items():
+            lines.append('%-72s %6d %9.3f %9.3f %10d %9.1f' %
+                         (name, s['calls'], s['wall_s'], s['cpu_s'],
+                          s['rows_in'], s['peak_memory_delta_mb']))
+        for (m, l), v in list(self.counters.items()) + \
+                list(self.gauges.items()):
+            lines.append('%s%s: %s' % (m, dict(l) if l else '', v))
+        return '\n'.join(lines)
+
+
+def enable():
+    """ Starts recording the metrics, and returns the profiler. """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def active():
+    """ The current profiler, or None if the profiling is disabled. """
+    return _profiler
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """
+    Records the enclosed code as a stage. The stage information is yielded,
+    and its 'rows_out' can be set.
+    """
+    profiler = _profiler
+    info = {'rows_out': None}
+    if profiler is None:
+        yield info
+        return
+
+    profiler.path.append(name)
+    path = '/'.join(profiler.path)
+    peak = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield info
+    finally:
+        profiler.path.pop()
+        profiler.record(path, time.perf_counter() - wall,
+                        time.process_time() - cpu, rows_in,
+                        info['rows_out'], peak_rss_mb() - peak)
+
+
+def profiled(func):
+    """
+    Records the calls of a function as a stage, named after the function
+    (or the class of the estimator and the method), with the rows of its
+    first argument and of its result.
+    """
+    method = '.' in func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return func(*args, **kwargs)
+
+        name = ('%s.%s' % (type(args[0]).__name__, func.__name__) if method
+                else func.__name__)
+        # Calls to the overridden method of a base class are not new stages
+        if profiler.path and profiler.path[-1] == name:
+            return func(*args, **kwargs)
+
+        data = args[1:2] if method else args[:1]
+        with stage(name, _rows(data[0]) if data else None) as info:
+            ret = func(*args, **kwargs)
+            info['rows_out'] = _rows(ret)
+        return ret
+
+    return wrapper
+
+
+def count(metric, n, **labels):
+    if _profiler is not None:
+        _profiler.count(metric, n, **labels)
+
+
+def gauge_max(metric, value, **labels):
+    if _profiler is not None:
+        _profiler.gauge_max(metric, value, **labels)
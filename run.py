@@ -1,13 +1,21 @@
-from sklearn.pipeline import Pipeline
-import pandas as pd
-import numpy as np
 import argparse
+import sys
 import os
 
 
-from preprocessing import EndpointTransformer, ShippingTransformer, \
-    PurchaseTransformer, FraudTransformer
-from models import EndpointScorer, ShippingScorer, PurchaseScorer, ModelMerger
+from preprocessing import FraudTransformer
+from pipeline import build_model, submodel, input_columns
+from artifact import save_model, load_model
+from store import AccountStore
+from signals import apply_signals
+from adjustments import adjust_scores, drop_repeated
+from parallel import predict_sharded
+from loader import read_input, read_chunks
+from formats import FORMATS, TableWriter, file_format
+from featurecache import FeatureCache
+from sweep import score_arrays, save_scores
+from utils import last_sorted_account, continue_times
+import profiling
 
 
 def get_args():
@@ -30,78 +38,310 @@ def get_args():
     parser.add_argument('--csv-delimiter', metavar="CD", nargs='?',
                         default=',',
                         help='Delimiter used for parsing the input CSV')
-    return parser.parse_args()
+    parser.add_argument('--input-format', metavar="IF", nargs='?',
+                        choices=FORMATS, default=None,
+                        help='Format of the data file (%s). Inferred from '
+                             'its name if not given: .parquet, .feather, a '
+                             'directory of arrays, or else CSV' %
+                             ', '.join(FORMATS))
+    parser.add_argument('--output-format', metavar="OF", nargs='?',
+                        choices=FORMATS, default=None,
+                        help='Format of the output file, inferred from its '
+                             'name as the input format if not given')
+    parser.add_argument('--feature-cache', metavar="FC", nargs='?',
+                        default=None,
+                        help='Directory caching the features of the input, '
+                             'so that the runs repeated on the same input '
+                             'skip its parse and the feature transformers')
+    parser.add_argument('--save-model', metavar="SM", nargs='?',
+                        default=None,
+                        help='Path where the fitted model is saved')
+    parser.add_argument('--load-model', metavar="LM", nargs='?',
+                        default=None,
+                        help='Path of a fitted model to score with, instead '
+                             'of fitting the model on the input data')
+    parser.add_argument('--state-store', metavar="SS", nargs='?',
+                        default=None,
+                        help='Path of the account state store. The input '
+                             'transactions continue the stored account '
+                             'histories, which are updated afterwards')
+    parser.add_argument('--chunksize', metavar="CS", nargs='?', type=int,
+                        default=None,
+                        help='Stream the input in chunks of this many rows, '
+                             'carrying the account histories from one chunk '
+                             'to the next. The input must be sorted by '
+                             'accountid and unixtime, so that only the '
+                             'histories of the accounts of the current '
+                             'chunk are kept (those of the finished accounts '
+                             'are written to the state store, if any). The '
+                             'first pass fitting the endpoint model keeps '
+                             'the distinct values of the input and their '
+                             'counts')
+    parser.add_argument('--workers', metavar="W", nargs='?', type=int,
+                        default=1,
+                        help='Number of processes scoring the input, which '
+                             'is partitioned by accountid')
+    parser.add_argument('--fit-threads', metavar="FT", nargs='?', type=int,
+                        default=1,
+                        help='Number of threads fitting the endpoint model, '
+                             'one feature each, also with --chunksize')
+    parser.add_argument('--submodel-jobs', metavar="SJ", nargs='?', type=int,
+                        default=1,
+                        help='Number of processes fitting and scoring the '
+                             'enabled submodels concurrently')
+    parser.add_argument('--frequency-budget', metavar="FB", nargs='?',
+                        type=float, default=None,
+                        help='Megabytes of the frequency tables of the '
+                             'endpoint model. The most frequent values of '
+                             'the tables that exceed it are kept exactly, '
+                             'and the others approximated. Exact if not '
+                             'given')
+    parser.add_argument('--history-window', metavar="HW", nargs='?',
+                        type=int, default=None,
+                        help='Score the endpoint and shipping features with '
+                             'the last HW transactions of each account only')
+    parser.add_argument('--half-life', metavar="HL", nargs='?', type=float,
+                        default=None,
+                        help='Score the endpoint and shipping features with '
+                             'account histories decayed by half every HL '
+                             'seconds')
+    parser.add_argument('--adjust-scores', action='store_true',
+                        help='Override the scores of the first two '
+                             'transactions of each account, and write the '
+                             'transactions repeated with the same unixtime '
+                             'and sessionid once')
+    parser.add_argument('--save-scores', metavar="SC", nargs='?',
+                        default=None,
+                        help='Path where the scores of the submodels, the '
+                             'fraud IP flags and the signals of the '
+                             'transactions are saved, for the sweeps of the '
+                             'weights and penalties (see sweep.py)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time, rows and memory of each '
+                             'scoring stage')
+    parser.add_argument('--metrics-out', metavar="MO", nargs='?',
+                        default=None,
+                        help='Path of a JSON file with the metrics of the '
+                             'scoring stages')
+    parser.add_argument('--metrics-textfile', metavar="MT", nargs='?',
+                        default=None,
+                        help='Path of a Prometheus textfile with the metrics '
+                             'of the scoring stages')
+    args = parser.parse_args()
+    if args.workers > 1 and args.chunksize is not None:
+        parser.error('--workers can not be used along with --chunksize')
+    if args.feature_cache is not None and args.chunksize is not None:
+        parser.error('--feature-cache can not be used along with '
+                     '--chunksize')
+    if args.history_window is not None and args.half_life is not None:
+        parser.error('--history-window can not be used along with '
+                     '--half-life')
+    if args.load_model is not None and (args.history_window is not None or
+                                        args.half_life is not None):
+        parser.error('A loaded model keeps the history policy it was '
+                     'fitted with')
+    return args
+
+
+OUTPUT_COLUMNS = ['sessionid', 'accountid', 'endpointscore', 'purchasescore',
+                  'shippingscore', 'finalscore', 'finalband', 'fraudlistentry',
+                  'signalstriggered']
+
+
+@profiling.profiled
+def write_output(ret, writer):
+    writer.write(ret)
 
 
 args = get_args()
 
+if args.profile or args.metrics_out or args.metrics_textfile:
+    profiling.enable()
+
 filename = args.data
 fraud_list = args.fraud_list
 
-# Load the input data
-df = pd.read_csv(filename, sep=args.csv_delimiter)
-df['_artificial_index_'] = np.arange(len(df))
-
-# Load the submodels
-models = []
-if args.endpoint_model != 0:
-    endpoint_model = Pipeline([('features', EndpointTransformer()),
-                               ('model', EndpointScorer())])
-    models.append(('endpointscore', endpoint_model, 0.25))
-if args.shipping_model != 0:
-    shipping_model = Pipeline([('features', ShippingTransformer()),
-                               ('model', ShippingScorer())])
-    models.append(('shippingscore', shipping_model, 0.50))
-if args.purchase_model != 0:
-    purchase_model = Pipeline([('features', PurchaseTransformer()),
-                               ('model', PurchaseScorer())])
-    models.append(('purchasescore', purchase_model, 0.25))
-
-# Merge the models and add the fraud signals
-full_model = Pipeline([('fraud', FraudTransformer()),
-                       ('models', ModelMerger(models))
-                       ])
-
-# Fit the model and compute the predictions
-full_model.fit(df)
-ret = full_model.predict(df)
-ret = ret.sort_values(['_artificial_index_'], axis=0)
-
-# Apply the signals penalties
-signals_of_interest = ['account_create_velocity', 'account_testing',
-                       'event_velocity', 'geo_anonymous', 'input_anomaly',
-                       'input_scripted', 'login_accounts', 'login_failure',
-                       'login_velocity', 'net_anomaly_ip', 'net_anomaly_ua',
-                       'shiptobill_distance']
-signals_of_interest = set(signals_of_interest)
-
-all_signals = set([])
-triggered_signals = []
-deductions = []
-for s, other in zip(df.eventtriggeredsignals.values,
-                    ret['signalstriggered'].values):
-    s = [x.replace('"', '') for x in s[1: -1].split(',')]
-    s = set(s) & signals_of_interest
-    text_s = other + ', '.join(set(s))
-    triggered_signals.append(text_s)
-
-    if 'geo_anonymous' in s:
-        deductions.append(0.6 - (0.1 if len(s) > 1 else 0.0))
-    else:
-        deductions.append(max(0.6, 1. - 0.1 * len(s)))
-ret['signalstriggered'] = triggered_signals
-
-# Correct the final score and final band
-ret['finalscore'] *= np.asarray(deductions)
-
-band = ret['finalscore'].values.copy() / 100.
-band = 1 + 4. * (1. - band)
-ret['finalband'] = band 
-
-
-# Print the output
-ret.to_csv(args.output, sep=',',
-           columns=['sessionid', 'accountid', 'endpointscore',
-                    'purchasescore', 'shippingscore', 'finalscore',
-                    'finalband', 'fraudlistentry', 'signalstriggered'],
-           index=False, quotechar='"')
+# Load the fitted model
+fitted = None
+if args.load_model is not None:
+    fitted = load_model(args.load_model)
+
+# Load the submodels, and merge them along with the fraud signals
+fraud = (fitted['fraud'] if fitted is not None
+         else FraudTransformer(fraud_filename=fraud_list))
+full_model = build_model(fraud,
+                         fitted['endpoint'] if fitted is not None else None,
+                         endpoint=args.endpoint_model != 0,
+                         shipping=args.shipping_model != 0,
+                         purchase=args.purchase_model != 0,
+                         fit_threads=args.fit_threads,
+                         submodel_jobs=args.submodel_jobs,
+                         frequency_budget=(
+                             None if args.frequency_budget is None
+                             else int(args.frequency_budget * 2 ** 20)),
+                         shipping_scorer=(fitted['shipping']
+                                          if fitted is not None else None),
+                         window=args.history_window,
+                         half_life=args.half_life)
+
+shipping_scorer = None
+shipping_model = submodel(full_model, 'shippingscore')
+if shipping_model is not None:
+    shipping_scorer = shipping_model[-1]
+
+endpoint_scorer = None
+endpoint_model = submodel(full_model, 'endpointscore')
+if endpoint_model is not None:
+    endpoint_scorer = endpoint_model[-1]
+    if fitted is not None and fitted['endpoint'] is None:
+        raise ValueError('The model %s has no endpoint model' %
+                         args.load_model)
+
+# Only the columns read by the enabled submodels are loaded
+columns = input_columns(full_model)
+
+writer = TableWriter(args.output,
+                     file_format(args.output, args.output_format),
+                     OUTPUT_COLUMNS)
+
+store = None
+if args.state_store is not None:
+    store = AccountStore(args.state_store)
+
+if args.chunksize is None:
+    # Load the input data, or its cached features
+    features = None
+    with profiling.stage('load') as info:
+        if args.feature_cache is None:
+            df = read_input(filename, args.csv_delimiter, columns,
+                            args.input_format)
+        else:
+            df, features = FeatureCache(args.feature_cache).transform(
+                full_model, filename,
+                lambda: read_input(filename, args.csv_delimiter, columns,
+                                   args.input_format),
+                args.csv_delimiter, args.input_format)
+        info['rows_out'] = len(df)
+
+    # With the features, df has the fraud features and the submodels start
+    # at their scorers
+    model = full_model if features is None else full_model[-1]
+
+    # Fit the model and compute the predictions
+    with profiling.stage('fit', len(df)):
+        if features is not None:
+            if fitted is None:
+                model.fit(df, features=features)
+        elif fitted is None:
+            full_model.fit(df)
+        else:
+            full_model[-1].fit_transformers(full_model[:-1].transform(df))
+
+    if args.save_model is not None:
+        save_model(args.save_model, fraud, endpoint_scorer, shipping_scorer)
+
+    # Continue the stored account histories
+    states = None
+    if store is not None:
+        states = store.load(df['accountid'].unique())
+
+    # Apply the signals penalties and print the output
+    with profiling.stage('predict', len(df)) as info:
+        if args.workers > 1:
+            ret = predict_sharded(model, df, args.workers, states,
+                                  features)
+        else:
+            ret = model.predict(df, states=states, features=features)
+            ret = apply_signals(ret, df.eventtriggeredsignals.values)
+        info['rows_out'] = len(ret)
+    if args.save_scores is not None:
+        save_scores(args.save_scores,
+                    [score_arrays(ret, df['eventtriggeredsignals'].values)])
+    if args.adjust_scores:
+        ret = adjust_scores(ret, df['unixtime'].values, states)
+    write_output(ret, writer)
+else:
+    # Fit the endpoint frequencies with a first pass over the input
+    if fitted is None and endpoint_model is not None:
+        for chunk in read_chunks(filename, args.csv_delimiter,
+                                 args.chunksize, columns, args.input_format):
+            with profiling.stage('fit', len(chunk)):
+                X = fraud.transform(chunk)
+                endpoint_scorer.partial_fit(
+                    endpoint_model[:-1].fit_transform(X))
+        endpoint_scorer.finalize()
+
+    if args.save_model is not None:
+        save_model(args.save_model, fraud, endpoint_scorer, shipping_scorer)
+
+    # Score the chunks, carrying the account histories between them
+    states = {}
+    pending = None
+    scores = []
+    last_account = None
+    for i, chunk in enumerate(read_chunks(filename, args.csv_delimiter,
+                                          args.chunksize, columns,
+                                          args.input_format)):
+        # Pick up the changes of the fraud list between the chunks
+        fraud.reload()
+
+        last_account = last_sorted_account(chunk['accountid'].values,
+                                           last_account)
+
+        if i == 0:
+            with profiling.stage('fit', len(chunk)):
+                full_model[-1].fit_transformers(
+                    full_model[:-1].transform(chunk))
+
+        if store is not None:
+            accounts = [a for a in chunk['accountid'].unique()
+                        if a not in states]
+            states.update(store.load(accounts))
+        continue_times(chunk['accountid'].values, chunk['unixtime'].values,
+                       states)
+
+        with profiling.stage('predict', len(chunk)) as info:
+            ret = full_model.predict(chunk, states=states)
+            ret = apply_signals(ret, chunk.eventtriggeredsignals.values)
+            info['rows_out'] = len(ret)
+        if args.save_scores is not None:
+            scores.append(score_arrays(ret,
+                                       chunk['eventtriggeredsignals'].values))
+        if not args.adjust_scores:
+            write_output(ret, writer)
+        else:
+            # The predictions of a chunk are written along with the next
+            # chunk, without the transactions repeated in it
+            if pending is not None:
+                write_output(drop_repeated(pending, chunk, states), writer)
+            pending = adjust_scores(ret, chunk['unixtime'].values, states)
+
+        # The accounts of the previous chunk that are not in this one are
+        # finished
+        current = set(chunk['accountid'].values)
+        finished = {a: s for a, s in states.items() if a not in current}
+        if store is not None:
+            store.save(finished)
+        for a in finished:
+            del states[a]
+
+    if pending is not None:
+        write_output(pending, writer)
+
+    if scores:
+        save_scores(args.save_scores, scores)
+
+writer.close()
+
+if store is not None:
+    store.save(states)
+    store.close()
+
+profiler = profiling.active()
+if profiler is not None:
+    if args.profile:
+        print(profiler.summary(), file=sys.stderr)
+    if args.metrics_out is not None:
+        profiler.write_json(args.metrics_out)
+    if args.metrics_textfile is not None:
+        profiler.write_textfile(args.metrics_textfile)
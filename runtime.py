@@ -0,0 +1,214 @@
+from functools import partial
+import argparse
+import csv
+import sys
+
+from artifact import load_tables
+from engine import EndpointEngine, ShippingEngine, PurchaseEngine, WEIGHTS, \
+    SHIPPING_RELEVANCE, record_value, flag_record, score_record
+from fraudlist import FraudList
+from payloads import PayloadExtractor, SHIPPING_FIELDS, PURCHASE_FIELDS, \
+    shipping_fields, purchase_fields
+from signals import apply_record_signals
+from store import AccountStore
+
+
+"""
+Fast-start scoring runtime for small batches. It scores the transactions of
+an input file with a fitted model artifact (see artifact.py), one at a time
+with the online engines of the scorers, and writes the same output as run.py.
+Only NumPy and the standard library are imported: pandas and scikit-learn are
+needed to fit the model (with run.py --save-model), not to score.
+
+The transactions are scored in time order within each account, as run.py
+does, and the account histories can be continued from a state store.
+"""
+
+
+OUTPUT_FIELDS = ['sessionid', 'accountid', 'endpointscore', 'purchasescore',
+                 'shippingscore', 'finalscore', 'finalband', 'fraudlistentry',
+                 'signalstriggered']
+
+# Values parsed as missing, as in pandas.read_csv
+NA_VALUES = set(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN',
+                 '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
+                 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+
+
+def _endpoint_values(engine, record):
+    # The features of EndpointTransformer.transform_record
+    return tuple([record_value(record, f) for f in engine.features])
+
+
+def _payload_values(engine, payload, extractor, record):
+    # The fields of PayloadTransformer.transform_record
+    fields = extractor.fields_of(record_value(record, payload))
+    return tuple([fields.get(f, float('nan')) for f in engine.features])
+
+
+class Runtime(object):
+    def __init__(self, model_filename, fraud_list=None, endpoint=True,
+                 shipping=True, purchase=True):
+        fitted = load_tables(model_filename)
+        if endpoint and fitted['endpoint'] is None:
+            raise ValueError('The model %s has no endpoint model' %
+                             model_filename)
+
+        self.fraud_list = None
+        self.fraud_index = fitted['fraud_index']
+        if fraud_list is not None:
+            self.fraud_list = FraudList(fraud_list)
+            self.fraud_index = self.fraud_list.index
+
+        # Name, weight, engine and feature values of each enabled submodel
+        # (see engine.score_record), and the payload extractors
+        self.submodels = []
+        self.extractors = []
+        if endpoint:
+            params = fitted['endpoint']
+            engine = EndpointEngine(list(params['global_frequencies']),
+                                    params['global_frequencies'],
+                                    params['ft_relevance'],
+                                    params['universe_prior'],
+                                    window=params['window'],
+                                    half_life=params['half_life'])
+            self.submodels.append(('endpointscore', WEIGHTS['endpointscore'],
+                                   engine, partial(_endpoint_values, engine)))
+        if shipping:
+            # The history policy of the shipping model, if it was saved
+            policy = fitted['shipping'] or {}
+            self._add_payload_submodel(
+                'shippingscore', ShippingEngine(SHIPPING_RELEVANCE, **policy),
+                'shipping_info',
+                PayloadExtractor(SHIPPING_FIELDS, shipping_fields))
+        if purchase:
+            self._add_payload_submodel(
+                'purchasescore', PurchaseEngine(), 'cart_info',
+                PayloadExtractor(PURCHASE_FIELDS, purchase_fields))
+
+    def _add_payload_submodel(self, name, engine, payload, extractor):
+        self.submodels.append((name, WEIGHTS[name], engine,
+                               partial(_payload_values, engine, payload,
+                                       extractor)))
+        self.extractors.append(extractor)
+
+    def score(self, record, states=None):
+        """
+        Scores a transaction given as a dictionary, in the input schema of
+        run.py, continuing its account histories in `states` if given.
+        """
+        ret = score_record(flag_record(self.fraud_index, record),
+                           self.submodels, states)
+
+        signals = record.get('eventtriggeredsignals')
+        return apply_record_signals(ret, '[]' if signals is None or
+                                    signals != signals else signals)
+
+
+def read_records(filename, sep=','):
+    """
+    Reads the transactions of an input file as dictionaries, with missing
+    values as NaN and the timestamps as numbers.
+    """
+    with open(filename, newline='') as f:
+        records = list(csv.DictReader(f, delimiter=sep))
+
+    for record in records:
+        for k, v in record.items():
+            if v is None or v in NA_VALUES:
+                record[k] = float('nan')
+        t = record.get('unixtime')
+        if isinstance(t, str):
+            try:
+                record['unixtime'] = int(t)
+            except ValueError:
+                record['unixtime'] = float(t)
+    return records
+
+
+def time_order(records):
+    """
+    Order of the transactions by time (the missing times last), which is
+    their order in their account's history.
+    """
+    def key(i):
+        t = records[i].get('unixtime')
+        missing = t is None or t != t
+        return (missing, 0 if missing else t, i)
+    return sorted(range(len(records)), key=key)
+
+
+def write_records(ret, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(OUTPUT_FIELDS)
+        for r in ret:
+            values = [r.get(c) for c in OUTPUT_FIELDS]
+            writer.writerow(['' if v is None or v != v else
+                             (float(v) if isinstance(v, float) else v)
+                             for v in values])
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+                        description="Fast-start fraud scoring with a fitted "
+                                    "model",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', metavar="M", required=True,
+                        help='Path of the model artifact (see run.py '
+                             '--save-model)')
+    parser.add_argument('--data', metavar="D", required=True,
+                        help='Path to the data file')
+    parser.add_argument('--fraud-list', metavar="F", nargs='?', default=None,
+                        help='Path to a fraud file, instead of the fraud '
+                             'list of the model')
+    parser.add_argument('--output', metavar="O", nargs='?',
+                        default='output.csv',
+                        help='Path to the output file')
+    parser.add_argument('--endpoint-model', metavar="E", nargs='?', type=int,
+                        default=1, help='Enables endpoint model')
+    parser.add_argument('--shipping-model', metavar="S", nargs='?', type=int,
+                        default=1, help='Enables shipping model')
+    parser.add_argument('--purchase-model', metavar="P", nargs='?', type=int,
+                        default=1, help='Enables purchase model')
+    parser.add_argument('--csv-delimiter', metavar="CD", nargs='?',
+                        default=',',
+                        help='Delimiter used for parsing the input CSV')
+    parser.add_argument('--state-store', metavar="SS", nargs='?',
+                        default=None,
+                        help='Path of a SQLite store of the account states, '
+                             'continued and updated by the run')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    runtime = Runtime(args.model, fraud_list=args.fraud_list,
+                      endpoint=args.endpoint_model != 0,
+                      shipping=args.shipping_model != 0,
+                      purchase=args.purchase_model != 0)
+    records = read_records(args.data, args.csv_delimiter)
+
+    store = None
+    states = {}
+    if args.state_store is not None:
+        store = AccountStore(args.state_store)
+        states = store.load(set(r.get('accountid') for r in records))
+
+    ret = [None] * len(records)
+    for i in time_order(records):
+        ret[i] = runtime.score(records[i], states)
+    write_records(ret, args.output)
+
+    for extractor in runtime.extractors:
+        if extractor.parse_errors:
+            print('%d payloads could not be parsed' % extractor.parse_errors,
+                  file=sys.stderr)
+
+    if store is not None:
+        store.save(states)
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import numpy as np
+
+import profiling
+
+
+"""
+Penalties of the event signals triggered by the transactions. The final score
+is discounted by 10% for each signal of interest (down to 60%), and by 40%
+(50% along with other signals) if the transaction was anonymized.
+
+The signals of a batch are encoded as bitmasks, one bit per signal of
+interest. Each distinct `eventtriggeredsignals` value is parsed only once, so
+that the penalties are computed with array operations.
+"""
+
+
+SIGNALS_OF_INTEREST = set(['account_create_velocity', 'account_testing',
+                           'event_velocity', 'geo_anonymous',
+                           'input_anomaly', 'input_scripted',
+                           'login_accounts', 'login_failure',
+                           'login_velocity', 'net_anomaly_ip',
+                           'net_anomaly_ua', 'shiptobill_distance'])
+
+# Bit of each signal of interest in the bitmasks
+SIGNAL_BITS = {s: 1 << i for i, s in enumerate(sorted(SIGNALS_OF_INTEREST))}
+
+# Multipliers of the final score: for an anonymized transaction, lowered
+# along with other signals, and otherwise lowered for each signal down to
+# a minimum
+ANONYMOUS_DEDUCTION = 0.6
+ANONYMOUS_OTHERS_DEDUCTION = 0.1
+SIGNAL_DEDUCTION = 0.1
+MIN_DEDUCTION = 0.6
+
+_POPCOUNT = np.asarray([bin(i).count('1')
+                        for i in range(1 << len(SIGNAL_BITS))])
+
+
+def triggered_signals(signals):
+    """
+    Returns the signals of interest of an `eventtriggeredsignals` value,
+    e.g. '["geo_anonymous","login_failure"]'.
+    """
+    s = [x.replace('"', '') for x in signals[1: -1].split(',')]
+    return set(s) & SIGNALS_OF_INTEREST
+
+
+def signals_deduction(s):
+    """ Multiplier of the final score for a set of triggered signals. """
+    if 'geo_anonymous' in s:
+        return ANONYMOUS_DEDUCTION - (ANONYMOUS_OTHERS_DEDUCTION
+                                      if len(s) > 1 else 0.0)
+    return max(MIN_DEDUCTION, 1. - SIGNAL_DEDUCTION * len(s))
+
+
+def signal_masks(signals):
+    """
+    Returns the bitmasks of the signals of interest of an array of
+    `eventtriggeredsignals` values (missing values have no signals).
+    """
+    # Imported here, the signals of single transactions do not need pandas
+    import pandas as pd
+
+    codes, uniques = pd.factorize(np.asarray(signals, dtype=object))
+    masks = np.asarray([sum(SIGNAL_BITS[x] for x in triggered_signals(u))
+                        for u in uniques] + [0], dtype=np.int64)
+    return masks[codes]
+
+
+def mask_signals(mask):
+    """ Names of the signals of a bitmask. """
+    return [s for s, bit in SIGNAL_BITS.items() if mask & bit]
+
+
+def signal_counts(masks):
+    """ Number of signals of each bitmask. """
+    return _POPCOUNT[masks]
+
+
+def anonymized(masks):
+    """ Whether each bitmask has the anonymized transaction signal. """
+    return (masks & SIGNAL_BITS['geo_anonymous']) != 0
+
+
+def masks_deduction(masks):
+    """ Same as `signals_deduction` for an array of bitmasks. """
+    n = signal_counts(masks).astype(float)
+    return np.where(anonymized(masks),
+                    np.where(n > 1,
+                             ANONYMOUS_DEDUCTION - ANONYMOUS_OTHERS_DEDUCTION,
+                             ANONYMOUS_DEDUCTION - 0.0),
+                    np.maximum(MIN_DEDUCTION, 1. - SIGNAL_DEDUCTION * n))
+
+
+@profiling.profiled
+def apply_signals(ret, signals):
+    """
+    Applies the penalties of the triggered signals to the final score and
+    final band of the predictions.
+    """
+    masks = signal_masks(signals)
+
+    # Only the transactions with signals change their text
+    texts = ret['signalstriggered'].values.astype(object)
+    triggered = np.flatnonzero(masks)
+    if len(triggered):
+        unique_masks, inverse = np.unique(masks[triggered],
+                                          return_inverse=True)
+        names = np.asarray([', '.join(mask_signals(m)) for m in unique_masks],
+                           dtype=object)
+        texts[triggered] = texts[triggered] + names[inverse]
+    ret['signalstriggered'] = texts
+
+    # Correct the final score and final band
+    ret['finalscore'] *= masks_deduction(masks)
+
+    band = ret['finalscore'].values.copy() / 100.
+    band = 1 + 4. * (1. - band)
+    ret['finalband'] = band
+
+    return ret
+
+
+def apply_record_signals(ret, signals):
+    """ Same as `apply_signals` for the prediction of a single transaction. """
+    s = triggered_signals(signals)
+    # In the order of `apply_signals`
+    ret['signalstriggered'] += ', '.join(sorted(s))
+    ret['finalscore'] *= signals_deduction(s)
+    ret['finalband'] = 1 + 4. * (1. - ret['finalscore'] / 100.)
+
+    return ret
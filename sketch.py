@@ -0,0 +1,84 @@
+import numpy as np
+
+
+"""
+Count-min sketch of the counts of the values of a feature, keyed by 64-bit
+value hashes (see hashing.value_hash). Each of the `depth` rows of the
+sketch maps a hash to one of its `width` counters, and the count of a value
+is estimated as the minimum of its counters. The estimate never falls below
+the true count, and exceeds it by at most e / width times the total count of
+the sketch with probability 1 - exp(-depth).
+
+The module only depends on NumPy, so that the sketches of a model artifact
+can be used by the fast-start runtime (see runtime.py).
+"""
+
+
+_MASK = 0xffffffffffffffff
+
+
+def _row_seed(row):
+    # Distinct odd multipliers for the rows
+    return (0x9e3779b97f4a7c15 * (2 * row + 1)) & _MASK
+
+
+def _mix(h, seed):
+    # The splitmix64 finalizer of the seeded hash, on Python integers
+    h = ((h ^ seed) * 0xbf58476d1ce4e5b9) & _MASK
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & _MASK
+    return h ^ (h >> 31)
+
+
+def _mix_array(hashes, seed):
+    # Same as `_mix`, on an array of uint64 hashes
+    h = (hashes ^ np.uint64(seed)) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+class CountMinSketch(object):
+    def __init__(self, width=1, depth=4, counts=None):
+        if counts is None:
+            counts = np.zeros((depth, width), dtype=np.int64)
+        self.counts = counts
+        self.depth, self.width = counts.shape
+        self.seeds = [_row_seed(r) for r in range(self.depth)]
+
+    @classmethod
+    def for_budget(cls, nbytes, depth=4):
+        """ The widest sketch of the given depth within `nbytes` bytes. """
+        return cls(max(1, nbytes // (8 * depth)), depth)
+
+    @property
+    def total(self):
+        """ Total count of the values. """
+        return int(self.counts[0].sum())
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes
+
+    def _columns(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        return [(_mix_array(hashes, seed) % np.uint64(self.width))
+                .astype(np.int64) for seed in self.seeds]
+
+    def add(self, hashes, counts):
+        """ Adds the counts of the values with the given hashes. """
+        counts = np.asarray(counts, dtype=np.float64)
+        for row, columns in zip(self.counts, self._columns(hashes)):
+            row += np.bincount(columns, weights=counts,
+                               minlength=self.width).astype(np.int64)
+
+    def estimate(self, hashes):
+        """ Estimated counts of the values with the given hashes. """
+        ret = None
+        for row, columns in zip(self.counts, self._columns(hashes)):
+            ret = row[columns] if ret is None else np.minimum(ret,
+                                                              row[columns])
+        return ret
+
+    def estimate_one(self, h):
+        """ Estimated count of the value with hash `h`, as an int. """
+        return min(int(row[_mix(h, seed) % self.width])
+                   for row, seed in zip(self.counts, self.seeds))
@@ -0,0 +1,95 @@
+import threading
+import sqlite3
+import json
+
+from engine import state_from_dict
+
+
+"""
+Persistent store of the account states (see engine.py), so that a run only
+needs to score its new transactions: the history of each account is read
+from the store, continued with the new transactions, and written back.
+The store is a SQLite database with one JSON document per account.
+"""
+
+
+VERSION = 1
+
+
+def plain_states(account_states):
+    """
+    States of an account as plain dictionaries, as they are written to the
+    store (the states already plain are kept).
+    """
+    return {name: (s.to_dict() if hasattr(s, 'to_dict') else s)
+            for name, s in account_states.items()}
+
+
+class AccountStore(object):
+    def __init__(self, filename):
+        self.filename = filename
+        # The accesses of the threads sharing the store are serialized (see
+        # daemon.py)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS meta '
+                '(key TEXT PRIMARY KEY, value TEXT)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS accounts '
+                '(accountid TEXT PRIMARY KEY, state TEXT NOT NULL)')
+            self.connection.execute(
+                'INSERT OR IGNORE INTO meta VALUES (?, ?)',
+                ('version', str(VERSION)))
+
+        version = self.connection.execute(
+            'SELECT value FROM meta WHERE key = ?', ('version',)).fetchone()
+        if int(version[0]) != VERSION:
+            raise ValueError('Unsupported account store version %s' %
+                             version[0])
+
+    def load(self, accounts, batch_size=500):
+        """
+        Returns the stored states of the given accounts, as a dictionary
+        from accountid to the states of the scorers. Unknown accounts are
+        left out.
+        """
+        keys = {}
+        for a in accounts:
+            if a == a:
+                keys[str(a)] = a
+        keys_ = list(keys)
+
+        rows = []
+        with self.lock:
+            for i in range(0, len(keys_), batch_size):
+                batch = keys_[i: i + batch_size]
+                rows += self.connection.execute(
+                    'SELECT accountid, state FROM accounts WHERE accountid '
+                    'IN (%s)' % ','.join(['?'] * len(batch)),
+                    batch).fetchall()
+
+        ret = {}
+        for key, state in rows:
+            state = json.loads(state)
+            ret[keys[key]] = {
+                name: (state_from_dict(s) if isinstance(s, dict) else s)
+                for name, s in state.items()}
+
+        return ret
+
+    def save(self, states):
+        """
+        Writes the states of the given accounts (or their `plain_states`) in
+        a single commit.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO accounts VALUES (?, ?)',
+                ((str(a), json.dumps(plain_states(s)))
+                 for a, s in states.items() if a == a))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
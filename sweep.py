@@ -0,0 +1,301 @@
+import pandas as pd
+import numpy as np
+import itertools
+import argparse
+import json
+
+from engine import WEIGHTS, FRAUD_IP_DISCOUNT
+from signals import SIGNAL_BITS, ANONYMOUS_DEDUCTION, \
+    ANONYMOUS_OTHERS_DEDUCTION, SIGNAL_DEDUCTION, MIN_DEDUCTION, \
+    signal_masks, signal_counts, anonymized
+
+
+"""
+Sweeps of the weights of the submodels and of the penalties of the final
+score, without re-running the pipeline. A run of run.py with --save-scores
+saves, for every transaction, the scores of the enabled submodels, whether
+its IP is in the fraud list and the bitmask of its signals (see signals.py).
+The final scores of many configurations of the parameters are then computed
+from them at once, as arrays of configurations by transactions, in the same
+order of operations as ModelMerger and apply_signals, so that the default
+configuration gives the final scores of run.py to within float rounding
+(about 1e-14). The adjustments of --adjust-scores are not part of the
+sweeps. The endpoint model counts the values of `fraud-discount` among its
+features, so the sweeps of the fraud IP discount keep the endpoint scores of
+the run that saved them, while the sweeps of the other parameters give the
+final scores of the runs with them to within float rounding.
+
+The penalties of the signals only depend on whether a transaction was
+anonymized and on its number of signals, so each configuration is reduced to
+a table of their multipliers, indexed by the class of every transaction.
+"""
+
+
+FORMAT = 'risk-reputation-scores'
+VERSION = 1
+
+SCORES = ['endpointscore', 'shippingscore', 'purchasescore']
+
+# Parameters of a configuration, besides the weights of the submodels
+PENALTIES = {'fraud_ip_discount': FRAUD_IP_DISCOUNT,
+             'anonymous_deduction': ANONYMOUS_DEDUCTION,
+             'anonymous_others_deduction': ANONYMOUS_OTHERS_DEDUCTION,
+             'signal_deduction': SIGNAL_DEDUCTION,
+             'min_deduction': MIN_DEDUCTION}
+
+# Lower edges of the bins of the final scores, the last bin including 100
+SCORE_BINS = np.linspace(0., 100., 21)
+
+BANDS = [1, 2, 3, 4, 5]
+
+# Number of signal counts of the penalty classes
+_COUNTS = len(SIGNAL_BITS) + 1
+
+# Cells of the arrays of configurations by transactions computed at once
+_MAX_CELLS = 1 << 22
+
+
+def default_parameters():
+    """ Parameters of the configuration of run.py. """
+    ret = dict(WEIGHTS)
+    ret.update(PENALTIES)
+    return ret
+
+
+def grid(**values):
+    """
+    Configurations of every combination of the given values of the
+    parameters, as a frame with one row per configuration. The parameters
+    not given keep their default.
+    """
+    ret = pd.DataFrame(list(itertools.product(*values.values())),
+                       columns=list(values))
+    for name, value in default_parameters().items():
+        if name not in ret:
+            ret[name] = value
+    return ret
+
+
+def score_arrays(ret, signals):
+    """
+    Arrays of the predictions of ModelMerger (before the signal penalties)
+    and of the `eventtriggeredsignals` values of their transactions needed
+    by the sweeps.
+    """
+    arrays = {name: ret[name].values.astype(np.float64)
+              for name in SCORES if name in ret}
+    arrays['fraud-ip'] = ret['fraud-ip'].values.astype(bool)
+    arrays['masks'] = signal_masks(signals).astype(np.uint16)
+    return arrays
+
+
+def save_scores(filename, parts):
+    """ Saves the score arrays of parts of the input (see score_arrays). """
+    names = [n for n in SCORES if n in parts[0]] + ['fraud-ip', 'masks']
+    arrays = {n: np.concatenate([p[n] for p in parts]) for n in names}
+
+    header = {'format': FORMAT, 'version': VERSION,
+              'scores': [n for n in SCORES if n in arrays]}
+    arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'),
+                                     dtype=np.uint8)
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+class ScoreSweep(object):
+    """
+    Final scores of the configurations of the parameters, given the scores
+    of the submodels (a dictionary of arrays), the IP flags and the signal
+    bitmasks of the transactions.
+    """
+    def __init__(self, scores, fraud_ip, masks):
+        self.scores = scores
+        self.names = [n for n in SCORES if n in scores]
+        self.fraud_ip = np.asarray(fraud_ip).astype(int)
+        masks = np.asarray(masks, dtype=np.int64)
+        self.classes = anonymized(masks) * _COUNTS + signal_counts(masks)
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads the scores saved by `save_scores`. """
+        with np.load(filename, allow_pickle=False) as archive:
+            header = json.loads(archive['header'].tobytes().decode('utf-8'))
+            if header.get('format') != FORMAT:
+                raise ValueError('%s is not a scores file' % filename)
+            if header.get('version') != VERSION:
+                raise ValueError('Unsupported scores version %s' %
+                                 header.get('version'))
+            return cls({n: archive[n] for n in header['scores']},
+                       archive['fraud-ip'], archive['masks'])
+
+    def __len__(self):
+        return len(self.classes)
+
+    def _parameters(self, configs):
+        # Arrays of the parameters of the configurations, as columns
+        defaults = default_parameters()
+        names = list(configs)
+        n = len(configs[names[0]]) if names else 1
+        return {name: np.asarray(configs[name] if name in configs
+                                 else np.full(n, value),
+                                 dtype=np.float64)[:, None]
+                for name, value in defaults.items()}
+
+    def _deductions(self, p):
+        # Multipliers of the penalty classes of the configurations, as in
+        # signals.masks_deduction
+        n = np.arange(_COUNTS, dtype=np.float64)[None, :]
+        anonymous = p['anonymous_deduction'] - np.where(
+            n > 1, p['anonymous_others_deduction'], 0.0)
+        others = np.maximum(p['min_deduction'],
+                            1. - p['signal_deduction'] * n)
+        return np.concatenate([others, anonymous], axis=1)
+
+    def _weighted_scores(self, p, rows, fraud_discount=None):
+        # Weighted sums of the scores of the submodels of the transactions
+        # `rows`, as in ModelMerger.predict
+        ret = None
+        for name in self.names:
+            term = self.scores[name][None, rows] * p[name]
+            if fraud_discount is not None:
+                term *= fraud_discount
+            if ret is None:
+                ret = term
+            else:
+                ret += term
+        return ret
+
+    def _final_scores(self, p, deductions, start, stop):
+        # Final scores of the configurations for the transactions
+        # [start, stop), as in ModelMerger.predict and apply_signals
+        finalscore = self._weighted_scores(p, slice(start, stop))
+
+        # Only the transactions from the IPs of the fraud list are
+        # discounted, the others being multiplied by exactly 1
+        flagged = np.flatnonzero(self.fraud_ip[start: stop])
+        if len(flagged):
+            fraud_discount = 1 - p['fraud_ip_discount'] * \
+                self.fraud_ip[None, start + flagged]
+            finalscore[:, flagged] = self._weighted_scores(
+                p, start + flagged, fraud_discount)
+
+        weights = np.concatenate([p[name] for name in self.names], axis=1)
+        finalscore /= np.sum(weights, axis=1)[:, None]
+        finalscore *= np.take(deductions, self.classes[start: stop], axis=1)
+        return finalscore
+
+    def predict(self, config=None):
+        """
+        Final scores and final bands of the transactions for a
+        configuration (a dictionary of parameters, the default ones if
+        missing).
+        """
+        p = self._parameters({k: [v] for k, v in (config or {}).items()})
+        finalscore = self._final_scores(p, self._deductions(p), 0,
+                                        len(self))[0]
+        return finalscore, 1 + 4. * (1. - finalscore / 100.)
+
+    def sweep(self, configs, bins=SCORE_BINS):
+        """
+        Summaries of the final scores of the configurations, given as
+        columns of parameters (e.g. a frame of `grid`, the parameters not
+        given keeping their default). Returns a frame with, for each
+        configuration, its parameters, the mean final score and final band,
+        the number of transactions of each band (the final band rounded)
+        and of each bin of final scores (by lower edge).
+        """
+        p = self._parameters(configs)
+        deductions = self._deductions(p)
+        bins = np.asarray(bins, dtype=np.float64)
+        k = len(deductions)
+        n_bins = len(bins) - 1
+        n_bands = len(BANDS)
+        # The counts of the bins and bands of each configuration
+        offsets = np.arange(k)[:, None] * (n_bins * n_bands)
+
+        total = np.zeros(k)
+        counts = np.zeros(k * n_bins * n_bands, dtype=np.int64)
+
+        step = max(1, _MAX_CELLS // k)
+        for start in range(0, len(self), step):
+            stop = min(start + step, len(self))
+            finalscore = self._final_scores(p, deductions, start, stop)
+            total += finalscore.sum(axis=1)
+
+            band = 1 + 4. * (1. - finalscore / 100.)
+            np.rint(band, out=band)
+            np.clip(band, BANDS[0], BANDS[-1], out=band)
+            cells = band.astype(np.int64)
+            cells += offsets - BANDS[0]
+            cells += _bin_indices(finalscore, bins) * n_bands
+            counts += np.bincount(cells.ravel(), minlength=len(counts))
+
+        counts = counts.reshape(k, n_bins, n_bands)
+        band_counts = counts.sum(axis=1)
+        histogram = counts.sum(axis=2)
+
+        ret = pd.DataFrame({name: values[:, 0]
+                            for name, values in p.items()})
+        mean = total / max(len(self), 1)
+        ret['mean_finalscore'] = mean
+        ret['mean_finalband'] = 1 + 4. * (1. - mean / 100.)
+        for i, band in enumerate(BANDS):
+            ret['band_%d' % band] = band_counts[:, i]
+        for i in range(n_bins):
+            ret['score_%g' % bins[i]] = histogram[:, i]
+        return ret
+
+
+def _bin_indices(values, bins):
+    # Bins of the values, those out of the bins in the first or last one
+    n_bins = len(bins) - 1
+    width = (bins[-1] - bins[0]) / n_bins
+    if not np.allclose(np.diff(bins), width):
+        return np.clip(np.searchsorted(bins, values, side='right') - 1, 0,
+                       n_bins - 1)
+
+    # The bins of equal widths are found arithmetically, and moved to their
+    # neighbor when the rounding missed an edge
+    ret = (values - bins[0]) / width
+    np.clip(ret, 0, n_bins - 1, out=ret)
+    ret = ret.astype(np.int64)
+    ret -= values < bins[ret]
+    ret += (values >= bins[ret + 1]) & (ret < n_bins - 1)
+    np.clip(ret, 0, n_bins - 1, out=ret)
+    return ret
+
+
+def _values(text):
+    name, values = text.split('=', 1)
+    return name, [float(v) for v in values.split(',')]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+                        description="Sweeps of the weights and penalties",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--scores', metavar="S", nargs='?', required=True,
+                        help='Path of the scores saved by run.py '
+                             '--save-scores')
+    parser.add_argument('--grid', metavar="G", nargs='*', default=[],
+                        help='Values of the parameters to combine, e.g. '
+                             'endpointscore=0.2,0.25 min_deduction=0.5,0.6. '
+                             'The parameters are %s' %
+                             ', '.join(default_parameters()))
+    parser.add_argument('--output', metavar="O", nargs='?',
+                        default="sweep.csv",
+                        help='Path of the CSV file with the summary of each '
+                             'configuration')
+    args = parser.parse_args()
+    for text in args.grid:
+        if '=' not in text or text.split('=')[0] not in default_parameters():
+            parser.error('Invalid parameter values %s' % text)
+    return args
+
+
+if __name__ == '__main__':
+    args = get_args()
+
+    sweep = ScoreSweep.load(args.scores)
+    configs = grid(**dict(_values(text) for text in args.grid))
+    sweep.sweep(configs).to_csv(args.output, index=False)
@@ -0,0 +1,197 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+
+from signals import SIGNALS_OF_INTEREST
+
+
+"""
+Generator of synthetic transactions in the input schema of run.py, for
+benchmarks and load tests. The number of transactions per account follows a
+Zipf distribution, and each account mostly reuses its own devices, network
+and shipping address, with occasional changes. The JSON payloads, the
+triggered signals and the shipping addresses are drawn from pools of
+pre-rendered values, so that large inputs are generated with array
+operations only.
+"""
+
+
+COLUMNS = ['unixtime', 'sessionid', 'accountid', 'browserlanguage',
+           'useragent', 'deviceid', 'device_type', 'browserplatform',
+           'browserparent', 'browsername', 'device_pointing_method', 'city',
+           'country', 'region', 'ip', 'shipping_info', 'cart_info',
+           'eventtriggeredsignals']
+
+PRODUCT_TYPES = ['type%d' % i for i in range(40)]
+
+OTHER_SIGNALS = ['device_new', 'email_new', 'ip_new', 'payment_new']
+
+
+def _power_law(rng, n, skew, size):
+    # Indices in [0, n) with probabilities proportional to 1 / (i + 1)^skew
+    p = 1. / np.arange(1, n + 1) ** skew
+    return rng.choice(n, size=size, p=p / p.sum())
+
+
+def _vocabulary(prefix, n):
+    return np.asarray(['%s%d' % (prefix, i) for i in range(n)], dtype=object)
+
+
+def _ip_vocabulary(rng, n):
+    ips = rng.integers(1, 2 ** 32 - 1, size=n, dtype=np.uint64)
+    return np.asarray(['%d.%d.%d.%d' % (i >> 24, (i >> 16) & 255,
+                                        (i >> 8) & 255, i & 255)
+                       for i in ips.tolist()], dtype=object)
+
+
+def _addresses(rng, n):
+    def address(i):
+        shipping = {'shippingcountry': 'C%d' % (i % 30),
+                    'shippingzipcode': '%05d' % (i % 99991),
+                    'shippingnamelast': 'Last%d' % (i % 5003),
+                    'shippingnamefirst': 'First%d' % (i % 997),
+                    'shippingstate': 'S%d' % (i % 60),
+                    'shippingphonenumber': '555%07d' % i,
+                    'shippingstreet': '%d Main St' % i}
+        if i % 7 == 0:
+            shipping['shippingstreet2'] = 'Apt %d' % (i % 100)
+        return json.dumps({'ShippingAddress': shipping,
+                           'BillingAddress': {
+                               'billingzipcode': '%05d' % (i % 99991)}})
+
+    return np.asarray([address(i) for i in rng.permutation(n).tolist()],
+                      dtype=object)
+
+
+def _carts(rng, n):
+    def cart():
+        products = [{'productPrice': '%.2f' % rng.lognormal(4., 1.2),
+                     'productQuantity': int(rng.integers(1, 4)),
+                     'productType': PRODUCT_TYPES[_power_law(rng, 40, 1.,
+                                                             None)]}
+                    for _ in range(int(rng.integers(0, 6)))]
+        return json.dumps({'CartProduct': {'all': products}})
+
+    return np.asarray([cart() for _ in range(n)], dtype=object)
+
+
+def _signals(rng, n):
+    names = sorted(SIGNALS_OF_INTEREST) + OTHER_SIGNALS
+    ret = ['[]']
+    for _ in range(n - 1):
+        k = int(rng.integers(1, 4))
+        chosen = rng.choice(len(names), size=k, replace=False)
+        ret.append('[%s]' % ','.join('"%s"' % names[i] for i in chosen))
+    return np.asarray(ret, dtype=object)
+
+
+def generate(n_rows, n_accounts=None, skew=1.1, drift=0.1, missing=0.02,
+             malformed=0.01, fraud_fraction=0.01, seed=0,
+             start_time=1500000000):
+    """
+    Generates `n_rows` transactions, in time order, of `n_accounts` accounts
+    (a fifth of the transactions if None). Returns the transactions and a
+    matching fraud list, as DataFrames.
+
+    skew: exponent of the Zipf distribution of the transactions per account.
+    drift: probability of a transaction not using the usual value of its
+        account for a feature.
+    missing: probability of a missing endpoint feature or payload.
+    malformed: probability of a payload that is not valid JSON.
+    fraud_fraction: fraction of the accounts in the fraud list.
+    """
+    rng = np.random.default_rng(seed)
+    if n_accounts is None:
+        n_accounts = max(1, n_rows // 5)
+
+    accounts = _power_law(rng, n_accounts, skew, n_rows)
+    account_names = np.asarray(['user%d@example.com' % i
+                                for i in range(n_accounts)], dtype=object)
+    ips = _ip_vocabulary(rng, 2 * n_accounts)
+
+    df = pd.DataFrame({
+        'unixtime': start_time + np.sort(rng.integers(0, 30 * 86400,
+                                                      size=n_rows)),
+        'sessionid': _vocabulary('session', n_rows),
+        'accountid': account_names[accounts]
+        })
+
+    def usual_values(values, skew_):
+        # Mostly the usual value of the account, otherwise a popular one
+        usual = _power_law(rng, len(values), skew_, n_accounts)[accounts]
+        other = _power_law(rng, len(values), skew_, n_rows)
+        ret = values[np.where(rng.random(n_rows) < drift, other, usual)]
+        ret[rng.random(n_rows) < missing] = np.nan
+        return ret
+
+    endpoint = [('browserlanguage', _vocabulary('lang', 20), 1.5),
+                ('useragent', _vocabulary('Mozilla/5.0 agent', 500), 1.2),
+                ('deviceid', _vocabulary('device', n_accounts), 0.5),
+                ('device_type', _vocabulary('type', 3), 1.),
+                ('browserplatform', _vocabulary('platform', 6), 1.),
+                ('browserparent', _vocabulary('parent', 8), 1.),
+                ('browsername', _vocabulary('browser', 12), 1.),
+                ('device_pointing_method', _vocabulary('pointer', 3), 1.),
+                ('city', _vocabulary('city', 1000), 1.1),
+                ('country', _vocabulary('country', 50), 1.5),
+                ('region', _vocabulary('region', 300), 1.2),
+                ('ip', ips, 0.5)]
+    for f, values, skew_ in endpoint:
+        df[f] = usual_values(values, skew_)
+
+    payloads = [('shipping_info', _addresses(rng, n_accounts), 0.5),
+                ('cart_info', _carts(rng, 2000), 1.)]
+    for f, values, skew_ in payloads:
+        df[f] = usual_values(values, skew_)
+        df.loc[rng.random(n_rows) < malformed, f] = '{"truncated'
+
+    signals = _signals(rng, 500)
+    df['eventtriggeredsignals'] = signals[np.where(
+        rng.random(n_rows) < 0.7, 0, _power_law(rng, len(signals), 1.,
+                                                n_rows))]
+
+    n_fraud = max(1, int(fraud_fraction * n_accounts))
+    fraud_list = pd.DataFrame({
+        'customer_email': account_names[rng.choice(n_accounts, n_fraud,
+                                                   replace=False)],
+        'ip': ips[rng.choice(len(ips), n_fraud, replace=False)]
+        })
+
+    return df[COLUMNS], fraud_list
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+                        description="Synthetic transactions generator",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', metavar="R", type=int, required=True,
+                        help='Number of transactions')
+    parser.add_argument('--accounts', metavar="A", nargs='?', type=int,
+                        default=None,
+                        help='Number of accounts (a fifth of the '
+                             'transactions by default)')
+    parser.add_argument('--skew', metavar="SK", nargs='?', type=float,
+                        default=1.1,
+                        help='Exponent of the Zipf distribution of the '
+                             'transactions per account')
+    parser.add_argument('--seed', metavar="SE", nargs='?', type=int,
+                        default=0, help='Random seed')
+    parser.add_argument('--output', metavar="O", nargs='?',
+                        default="transactions.csv",
+                        help='Path of the transactions file')
+    parser.add_argument('--fraud-list', metavar="F", nargs='?',
+                        default="fraud_list.csv",
+                        help='Path of the fraud list file')
+    parser.add_argument('--csv-delimiter', metavar="CD", nargs='?',
+                        default=',',
+                        help='Delimiter of the transactions file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    df, fraud_list = generate(args.rows, args.accounts, skew=args.skew,
+                              seed=args.seed)
+    df.to_csv(args.output, sep=args.csv_delimiter, index=False)
+    fraud_list.to_csv(args.fraud_list, index=False)
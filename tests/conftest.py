@@ -0,0 +1,34 @@
+import subprocess
+import sys
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import generate  # noqa: E402
+
+
+"""
+Fixtures of the tests: a small synthetic input (see synthetic.py) and its
+fraud list, and runs of the command line scripts on them.
+"""
+
+
+@pytest.fixture
+def data(tmp_path):
+    """ Paths of a synthetic input file and of its fraud list. """
+    df, fraud_list = generate(2000, seed=0)
+    transactions = tmp_path / 'transactions.csv'
+    fraud = tmp_path / 'fraud_list.csv'
+    df.to_csv(transactions, index=False)
+    fraud_list.to_csv(fraud, index=False)
+    return str(transactions), str(fraud)
+
+
+def run_script(script, *args):
+    """ Runs one of the scripts of the package, failing on errors. """
+    return subprocess.run([sys.executable, os.path.join(ROOT, script)] +
+                          [str(a) for a in args], check=True,
+                          capture_output=True, text=True)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from adjustments import adjust_scores, drop_repeated, \
+    SECOND_TRANSACTION_DISCOUNT
+
+
+def _predictions(rows):
+    # Predictions of (accountid, unixtime, sessionid, num_transactions) rows
+    ret = pd.DataFrame(rows, columns=['accountid', 'unixtime', 'sessionid',
+                                      'num_transactions'])
+    ret['finalscore'] = 50.
+    ret['finalband'] = 3.
+    return ret
+
+
+ROWS = [('a', 10, 's1', 1), ('b', 10, 's2', 1), ('a', 10, 's1', 2),
+        ('a', 20, 's3', 3), ('a', 30, 's4', 4), ('b', 20, 's5', 2)]
+
+EXPECTED = pd.DataFrame({
+    'accountid': ['b', 'a', 'a', 'a', 'b'],
+    'finalscore': [100., 100., 50. * SECOND_TRANSACTION_DISCOUNT, 50., 50. *
+                   SECOND_TRANSACTION_DISCOUNT]})
+
+
+def _adjust(rows, states=None):
+    ret = _predictions(rows)
+    return adjust_scores(ret, ret['unixtime'].values, states)
+
+
+def test_repeated_transactions_are_not_ranked():
+    ret = _adjust(ROWS)
+    pd.testing.assert_frame_equal(ret[['accountid', 'finalscore']], EXPECTED)
+
+
+def test_repeated_transactions_across_chunks():
+    states = {}
+    first = _adjust(ROWS[:2], states)
+    later = _predictions(ROWS[2:])
+    first = drop_repeated(first, later, states)
+    ret = pd.concat([first, _adjust(ROWS[2:], states)], ignore_index=True)
+    pd.testing.assert_frame_equal(ret[['accountid', 'finalscore']], EXPECTED)
+    assert states == {'a': {'repeated_transactions': 1}}
+
+    # The accounts continued from the states keep their repetitions
+    ret = _adjust([('c', 10, 's6', 3)],
+                  {'c': {'repeated_transactions': 1}})
+    assert np.all(ret['finalscore'] == 50. * SECOND_TRANSACTION_DISCOUNT)
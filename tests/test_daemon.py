@@ -0,0 +1,83 @@
+import threading
+import json
+
+import pytest
+
+from conftest import run_script
+from daemon import ScoringService
+from runtime import read_records, time_order
+
+
+@pytest.fixture
+def model(data, tmp_path):
+    """ Path of a model fitted on the synthetic input, and its records. """
+    transactions, fraud = data
+    run_script('run.py', '--data', transactions, '--fraud-list', fraud,
+               '--output', tmp_path / 'output.csv',
+               '--save-model', tmp_path / 'model.npz')
+
+    records = read_records(transactions)
+    records = [{k: (None if v != v else v) for k, v in records[i].items()}
+               for i in time_order(records)]
+    return str(tmp_path / 'model.npz'), records
+
+
+@pytest.mark.parametrize('field, value', [
+    ('browserlanguage', ['en-US']),
+    ('eventtriggeredsignals', ['geo_anonymous'])])
+def test_rejected_batch_keeps_the_states(model, field, value):
+    filename, records = model
+    batch = records[:20]
+    invalid = dict(records[20], accountid=batch[0]['accountid'])
+    invalid[field] = value
+
+    service = ScoringService(filename)
+    with pytest.raises(TypeError):
+        service.score(batch + [invalid])
+    assert service.states == {}
+
+    # The batch sent again is scored as if it was the first time
+    assert service.score(batch) == ScoringService(filename).score(batch)
+
+
+def test_flushed_states_continue(model, tmp_path):
+    filename, records = model
+    store = str(tmp_path / 'states.db')
+
+    service = ScoringService(filename, state_store=store)
+    first = service.score(records[:300])
+    service.flush()
+    service.close()
+
+    service = ScoringService(filename, state_store=store)
+    second = service.score(records[300:])
+    service.close()
+
+    expected = ScoringService(filename).score(records)
+    assert json.dumps(first + second) == json.dumps(expected)
+
+
+def test_scoring_during_flush(model, tmp_path):
+    filename, records = model
+    service = ScoringService(filename, state_store=str(tmp_path / 's.db'))
+    service.score(records[:10])
+
+    # The store write of the flush waits until the scoring is done
+    writing, scored = threading.Event(), threading.Event()
+    save = service.store.save
+    waits = []
+
+    def slow_save(states):
+        writing.set()
+        waits.append(scored.wait(10))
+        save(states)
+
+    service.store.save = slow_save
+    flush = threading.Thread(target=service.flush)
+    flush.start()
+    assert writing.wait(10)
+    service.score([dict(records[10], accountid=records[0]['accountid'])])
+    scored.set()
+    flush.join()
+    assert waits == [True]
+    service.close()
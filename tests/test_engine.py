@@ -0,0 +1,142 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from synthetic import generate
+from pipeline import build_model, submodel
+from preprocessing import FraudTransformer
+from engine import EPSILON, SHIPPING_RELEVANCE, PURCHASE_WINDOW
+
+
+"""
+Reference test of the online engines: the score of each transaction is
+recomputed from the whole prefix of its account's history, as the scorers
+originally did, and compared with the scores of the model.
+"""
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _histories(X):
+    # Prefix of the history of the account of each transaction, as row
+    # positions in time order, the transactions without an account alone
+    times = X['unixtime'].values
+    order = sorted(range(len(X)),
+                   key=lambda i: (_missing(times[i]),
+                                  0 if _missing(times[i]) else times[i], i))
+    histories, ret = {}, [None] * len(X)
+    for i in order:
+        account = X['accountid'].values[i]
+        history = [] if _missing(account) else \
+            histories.setdefault(account, [])
+        history.append(i)
+        ret[i] = list(history)
+    return ret
+
+
+def _rows(X, features):
+    # Values of the features of each transaction, the missing ones as None
+    columns = [X[f].astype(object).values for f in features]
+    return [tuple([None if _missing(v) else v for v in row])
+            for row in zip(*columns)]
+
+
+def _frequencies(prefix, i, window):
+    # Relative frequency of the value of the last transaction, among the
+    # last `window` transactions of the prefix
+    counted = [row[i] for row in prefix[-window:]] if window else \
+        [row[i] for row in prefix]
+    counts = Counter(counted)
+    size = len(counted)
+    return (float(counts[counted[-1]]) / size) / \
+        (float(max(counts.values())) / size)
+
+
+def _endpoint_score(prefix, scorer, features, window):
+    if len(prefix) <= 1:
+        return 100.
+
+    matches, weights = [], []
+    for i, f in enumerate(features):
+        value = prefix[-1][i]
+        if value is None:
+            continue
+        gfreq = scorer.global_frequencies[f].get(value, EPSILON)
+        matches.append(_frequencies(prefix, i, window) *
+                       ((1 - scorer.universe_prior) +
+                        scorer.universe_prior * (1 - gfreq)))
+        weights.append(scorer.ft_relevance[f])
+
+    ret = np.average(np.asarray(matches), weights=np.asarray(weights))
+    return (ret * 0.75 if len(prefix) == 2 else ret) * 100.
+
+
+def _shipping_score(prefix, window):
+    if len(prefix) <= 1:
+        return 100.
+
+    probs = [_frequencies(prefix, i, window)
+             for i in range(len(SHIPPING_RELEVANCE))]
+    ret = np.average(probs, weights=list(SHIPPING_RELEVANCE.values()))
+    return (ret * 0.75 if len(prefix) == 2 else ret) * 100.
+
+
+def _purchase_score(prefix):
+    if len(prefix) <= 1:
+        return 100.
+
+    amounts = Counter([amount for amount, _ in prefix])
+    amount, types = prefix[-1]
+    ret = 0.
+    ret += 2. * (float(amounts[amount]) / float(max(amounts.values())))
+
+    last = set(types.split(','))
+    previous = set()
+    for _, t in prefix[-1 - PURCHASE_WINDOW: -1]:
+        previous.update(t.split(','))
+    ret += 1.5 * (float(len(last & previous)) / len(last))
+    ret = ret / 4.5
+
+    if min(len(prefix), PURCHASE_WINDOW + 1) == 2:
+        ret = ret * 0.75
+    return ret * 100.
+
+
+@pytest.mark.parametrize('window', [None, 3])
+def test_scores_match_prefix_recompute(window):
+    df, _ = generate(1500, n_accounts=60, seed=3)
+    df['_artificial_index_'] = np.arange(len(df))
+    model = build_model(FraudTransformer(fraud_filename=None),
+                        window=window)
+    model.fit(df)
+    ret = model.predict(df)
+
+    X = model[0].transform(df)
+    histories = _histories(X)
+    scores = {}
+
+    endpoint = submodel(model, 'endpointscore')
+    features = endpoint[-1].engine().features
+    rows = _rows(endpoint[:-1].transform(X), features)
+    scores['endpointscore'] = [
+        _endpoint_score([rows[j] for j in h], endpoint[-1], features, window)
+        for h in histories]
+
+    shipping = submodel(model, 'shippingscore')
+    rows = _rows(shipping[:-1].transform(X), list(SHIPPING_RELEVANCE))
+    scores['shippingscore'] = [_shipping_score([rows[j] for j in h], window)
+                               for h in histories]
+
+    purchase = submodel(model, 'purchasescore')
+    rows = _rows(purchase[:-1].transform(X),
+                 ['cart-categorical-amount', 'cart-types'])
+    scores['purchasescore'] = [_purchase_score([rows[j] for j in h])
+                               for h in histories]
+
+    # The accounts have long enough histories to fill the windows
+    assert max(len(h) for h in histories) > 2 * PURCHASE_WINDOW
+    for name, expected in scores.items():
+        assert ret[name].tolist() == expected, name
@@ -0,0 +1,110 @@
+import ipaddress
+
+import numpy as np
+
+from fraudlist import FraudIndex, hash_text, hash_values, _ipv4
+
+
+MALFORMED = ['', '1.2.3', '1.2.3.4.5', '256.1.1.1', '1.2.3.256', ' 1.2.3.4',
+             '1.2.3.4 ', '01.2.3.4', '1.2.3.04', '00.0.0.0', 'a.b.c.d',
+             '1..2.3', '.1.2.3', '1.2.3.', '1234.1.1.1', '1.2.3.4/24',
+             '１.2.3.4', '١.2.3.4', '1.2.3.4\x00', '999.999.999.999',
+             '255.255.255.025', '100.100.100.099', '255.255.255.2555']
+IPV6 = ['::1', '2001:db8::1', '2001:db8::2', '::ffff:1.2.3.4', '2001:db8::/32']
+EDGES = ['0.0.0.0', '0.0.0.1', '255.255.255.254', '255.255.255.255',
+         '9.255.255.255', '10.0.0.0', '10.255.255.255', '11.0.0.0',
+         '192.168.0.255', '192.168.1.0', '192.168.1.255', '192.168.2.0']
+
+
+def _random_ips(n, seed=0):
+    # Dotted strings of 3 to 5 octets, some out of range or zero-padded
+    rng = np.random.default_rng(seed)
+    ret = []
+    for _ in range(n):
+        octets = [str(v) for v in rng.integers(0, 300, rng.integers(3, 6))]
+        if rng.random() < 0.2:
+            octets[rng.integers(len(octets))] = '0' + octets[0]
+        ret.append('.'.join(octets))
+    return ret
+
+
+def _reference_ipv4(value):
+    # Integer of an address whose text is its canonical form, else -1
+    if not isinstance(value, str):
+        return -1
+    try:
+        address = ipaddress.IPv4Address(value)
+    except ValueError:
+        return -1
+    return int(address) if str(address) == value else -1
+
+
+def test_saved_index_matches(tmp_path):
+    emails = ['user@x.com', 'ünïcödé@x.com', '名前@例え.jp', 'x' * 1000, '5']
+    ips = ['1.2.3.4', '10.0.0.0/8', 'a.b.c.d', '2001:db8::1']
+    index = FraudIndex.from_values(emails, ips)
+    index.save(str(tmp_path / 'fraud.idx'))
+    loaded = FraudIndex.load(str(tmp_path / 'fraud.idx'))
+
+    values = emails + ips + MALFORMED + IPV6 + EDGES + [5, 1.5, None]
+    for i in [index, loaded]:
+        # The values are hashed by their text
+        assert i.match_emails(values).tolist() == \
+            [v is not None and str(v) in emails for v in values]
+        assert i.match_ips(values).tolist() == \
+            index.match_ips(values).tolist()
+    assert [hash_text(v) for v in values] == hash_values(values).tolist()
+
+
+def test_ipv4_matches_ipaddress():
+    values = MALFORMED + IPV6 + EDGES + _random_ips(5000) + \
+        [None, np.nan, 1234]
+    assert [_ipv4(v) for v in values] == [_reference_ipv4(v) for v in values]
+
+
+def test_ip_membership_matches_ipaddress():
+    entries = ['1.2.3.4', '0.0.0.0', '255.255.255.255', '10.0.0.0/8',
+               '192.168.1.7/24', 'a.b.c.d', '01.2.3.4', '2001:db8::1',
+               '2001:db8::/32']
+    index = FraudIndex.from_values([], entries + [None, np.nan])
+
+    # The IPv4 addresses match by value, the other entries by their text
+    networks, other = [], set()
+    for e in entries:
+        try:
+            network = ipaddress.ip_network(e, strict=False)
+        except ValueError:
+            network = None
+        if (network is not None and network.version == 4 and
+                ('/' in e or _reference_ipv4(e) >= 0)):
+            networks.append(network)
+        else:
+            other.add(e)
+
+    def expected(value):
+        if not isinstance(value, str):
+            return False
+        if _reference_ipv4(value) >= 0:
+            address = ipaddress.IPv4Address(value)
+            return any(address in n for n in networks)
+        return value in other
+
+    values = entries + MALFORMED + IPV6 + EDGES + _random_ips(2000, 1) + \
+        [None, np.nan]
+    matches = [expected(v) for v in values]
+
+    assert index.match_ips(values).tolist() == matches
+    assert [index.contains_ip(v) for v in values] == matches
+    assert sum(matches) > len(entries)
+
+
+def test_email_membership_matches_set():
+    entries = ['user@x.com', 'ünïcödé@x.com', '']
+    index = FraudIndex.from_values(entries + [None, np.nan], [])
+
+    values = entries + ['User@x.com', 'user@x.com ', 'user@x.co', None,
+                        np.nan]
+    matches = [v in entries for v in values]
+
+    assert index.match_emails(values).tolist() == matches
+    assert [index.contains_email(v) for v in values] == matches
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from synthetic import generate
+from pipeline import build_model, submodel
+from preprocessing import FraudTransformer
+from engine import pairwise_sum, weighted_mean
+
+
+def _endpoint_features(rows=3000):
+    df, _ = generate(rows, seed=1)
+    df['_artificial_index_'] = np.arange(len(df))
+    model = build_model(FraudTransformer(fraud_filename=None))
+    endpoint = submodel(model, 'endpointscore')
+    X = endpoint[:-1].fit_transform(model[0].transform(df))
+    return X, endpoint[-1]
+
+
+@pytest.mark.parametrize('n_jobs', [None, 4])
+def test_partial_fit_matches_fit(n_jobs):
+    X, scorer = _endpoint_features()
+    full = scorer.fit(X)
+    full = (dict(full.global_frequencies), dict(full.ft_relevance))
+
+    # The batches are sorted by account, the accounts spanning batches
+    X = X.sort_values(['accountid', 'unixtime'], kind='stable')
+    scorer.n_jobs = n_jobs
+    for start in range(0, len(X), 700):
+        scorer.partial_fit(X.iloc[start: start + 700])
+    scorer.finalize()
+
+    assert scorer.ft_relevance == full[1]
+    for f, table in full[0].items():
+        assert list(table.items()) == \
+            list(scorer.global_frequencies[f].items())
+
+
+def test_partial_fit_rejects_unsorted_batches():
+    X, scorer = _endpoint_features(1000)
+    X = X.sort_values(['accountid', 'unixtime'], kind='stable')
+    scorer.partial_fit(X.iloc[500:])
+    with pytest.raises(ValueError):
+        scorer.partial_fit(X.iloc[:500])
+
+
+def test_approximate_tables_break_ties_by_value():
+    from utils import ApproximateFrequencyTable
+
+    values = np.asarray(['v%d' % i for i in range(50)], dtype=object)
+    counts = np.repeat([3, 2, 1], [10, 20, 20])
+    order = np.random.default_rng(0).permutation(len(values))
+
+    a = ApproximateFrequencyTable.from_counts(values, counts, 2048)
+    b = ApproximateFrequencyTable.from_counts(values[order], counts[order],
+                                              2048)
+    assert 0 < len(a) < len(values)
+    assert sorted(a.items()) == sorted(b.items())
+
+
+def test_table_lookups_of_extended_categories():
+    from utils import Dictionary, FrequencyTable, ApproximateFrequencyTable
+
+    values = np.asarray(['v%d' % i for i in range(200)], dtype=object)
+    counts = np.arange(1, 201)
+    dictionary = Dictionary()
+    first = dictionary.categorical(values[:50])
+    later = dictionary.categorical(np.append(values[150:], 'unknown'))
+
+    for table in [FrequencyTable.from_counts(values, counts),
+                  ApproximateFrequencyTable.from_counts(values, counts,
+                                                        2048)]:
+        for categorical in [first, later, later]:
+            lookup = table.lookup(categorical)
+            assert lookup == {v: table.get(v)
+                              for v in categorical.categories
+                              if table.get(v) is not None}
+        assert 'v0' in lookup and 'v199' in lookup
+
+
+def test_older_artifacts_are_rejected(tmp_path):
+    import json
+    from artifact import save_model, load_model, load_tables
+
+    filename = str(tmp_path / 'model.npz')
+    save_model(filename, FraudTransformer(fraud_filename=None))
+    with np.load(filename) as archive:
+        arrays = dict(archive)
+    header = json.loads(arrays['header'].tobytes().decode('utf-8'))
+    header['version'] = 4
+    arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'),
+                                     dtype=np.uint8)
+    np.savez(filename, **arrays)
+
+    for load in [load_model, load_tables]:
+        with pytest.raises(ValueError, match='version 4'):
+            load(filename)
+
+
+def test_weighted_mean_matches_numpy():
+    rng = np.random.default_rng(0)
+    for n in list(range(1, 40)) + [127, 128, 129, 300]:
+        values = rng.random(n) * rng.choice([1e-3, 1., 1e3], n)
+        weights = rng.random(n)
+        assert pairwise_sum(values.tolist()) == np.sum(values)
+        assert weighted_mean(values.tolist(), weights.tolist()) == \
+            np.average(values, weights=weights)
@@ -0,0 +1,159 @@
+import subprocess
+import json
+
+import pandas as pd
+import numpy as np
+import pytest
+
+from conftest import run_script
+
+
+def _parse_failures(transactions, payload):
+    # Number of present payloads that are not valid JSON
+    ret = 0
+    for value in pd.read_csv(transactions, dtype=str)[payload].dropna():
+        try:
+            json.loads(value)
+        except ValueError:
+            ret += 1
+    return ret
+
+
+def test_metrics_out(data, tmp_path):
+    transactions, fraud = data
+    metrics = tmp_path / 'metrics.json'
+    run_script('run.py', '--data', transactions, '--fraud-list', fraud,
+               '--output', tmp_path / 'output.csv', '--metrics-out', metrics)
+
+    with open(metrics) as f:
+        counters = json.load(f)['counters']
+    failures = {c['labels']['payload']: c['value'] for c in counters
+                if c['metric'] == 'json_parse_failures'}
+
+    # Each payload is counted once, although it is transformed by both the
+    # fit and the scoring
+    assert failures == {p: _parse_failures(transactions, p)
+                        for p in ['shipping_info', 'cart_info']}
+    assert failures['shipping_info'] > 0
+
+
+def test_feature_cache_with_disabled_submodel(data, tmp_path):
+    transactions, fraud = data
+    args = ['--data', transactions, '--fraud-list', fraud]
+    cache = ['--feature-cache', tmp_path / 'cache']
+    run_script('run.py', *args, *cache, '--output', tmp_path / 'full.csv')
+
+    # The features of the other submodels are loaded from the cache
+    run_script('run.py', *args, *cache, '--endpoint-model', '0',
+               '--output', tmp_path / 'cached.csv')
+    run_script('run.py', *args, '--endpoint-model', '0',
+               '--output', tmp_path / 'computed.csv')
+
+    cached = pd.read_csv(tmp_path / 'cached.csv')
+    assert list(cached.columns) == list(
+        pd.read_csv(tmp_path / 'full.csv').columns)
+    assert cached['endpointscore'].isnull().all()
+    pd.testing.assert_frame_equal(cached,
+                                  pd.read_csv(tmp_path / 'computed.csv'))
+
+
+def test_metrics_textfile(tmp_path):
+    from profiling import Profiler
+
+    profiler = Profiler()
+    profiler.count('json_parse_failures', 2, payload='a"b\\c\nd')
+    profiler.gauge_max('longest_history', 5)
+    filename = str(tmp_path / 'metrics.prom')
+    profiler.write_textfile(filename)
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert '# TYPE risk_json_parse_failures_total counter' in lines
+    assert 'risk_json_parse_failures_total{payload="a\\"b\\\\c\\nd"} 2.0' \
+        in lines
+    assert 'risk_longest_history 5.0' in lines
+
+
+def test_sweep_reproduces_run(data, tmp_path):
+    from sweep import ScoreSweep
+
+    transactions, fraud = data
+    args = ['--data', transactions, '--fraud-list', fraud]
+    run_script('run.py', *args, '--output', tmp_path / 'output.csv',
+               '--save-scores', tmp_path / 'scores.npz')
+
+    sweep = ScoreSweep.load(str(tmp_path / 'scores.npz'))
+    output = pd.read_csv(tmp_path / 'output.csv')
+    finalscore, finalband = sweep.predict()
+    np.testing.assert_allclose(finalscore, output['finalscore'], rtol=1e-12)
+    np.testing.assert_allclose(finalband, output['finalband'], rtol=1e-12)
+
+
+@pytest.mark.parametrize('options', [[], ['--adjust-scores'],
+                                     ['--half-life', '86400']])
+def test_chunks_match_full_run(data, tmp_path, options):
+    transactions, fraud = data
+    df = pd.read_csv(transactions, dtype=str, keep_default_na=False)
+    df['time'] = pd.to_numeric(df['unixtime'], errors='coerce')
+    df = df.sort_values(['accountid', 'time'], kind='stable')
+    df.drop(columns='time').to_csv(tmp_path / 'sorted.csv', index=False)
+
+    args = ['--data', tmp_path / 'sorted.csv', '--fraud-list', fraud]
+    run_script('run.py', *args, *options, '--output', tmp_path / 'full.csv')
+    run_script('run.py', *args, *options, '--chunksize', 300,
+               '--output', tmp_path / 'chunks.csv')
+
+    with open(tmp_path / 'full.csv') as full, \
+            open(tmp_path / 'chunks.csv') as chunks:
+        assert full.read() == chunks.read()
+
+
+def test_chunks_of_unsorted_input(data, tmp_path):
+    transactions, fraud = data
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_script('run.py', '--data', transactions, '--fraud-list', fraud,
+                   '--chunksize', 300, '--output', tmp_path / 'output.csv')
+    assert 'must be sorted by accountid' in error.value.stderr
+
+
+@pytest.mark.parametrize('option', ['--workers', '--submodel-jobs'])
+def test_processes_match_single_process(data, tmp_path, option):
+    transactions, fraud = data
+    args = ['--data', transactions, '--fraud-list', fraud]
+    run_script('run.py', *args, '--output', tmp_path / 'single.csv')
+    run_script('run.py', *args, option, 3, '--output', tmp_path / 'many.csv')
+
+    with open(tmp_path / 'single.csv') as single, \
+            open(tmp_path / 'many.csv') as many:
+        assert single.read() == many.read()
+
+
+def test_store_resume_matches_uninterrupted_run(data, tmp_path):
+    transactions, fraud = data
+    model = tmp_path / 'model.npz'
+    run_script('run.py', '--data', transactions, '--fraud-list', fraud,
+               '--output', tmp_path / 'fit.csv', '--save-model', model)
+
+    # The input is split in time, the transactions without a time last
+    df = pd.read_csv(transactions, dtype=str, keep_default_na=False)
+    time = pd.to_numeric(df['unixtime'], errors='coerce')
+    first = (time <= time.median()).values
+    df[first].to_csv(tmp_path / 'first.csv', index=False)
+    df[~first].to_csv(tmp_path / 'second.csv', index=False)
+
+    args = ['--load-model', model, '--fraud-list', fraud]
+    store = ['--state-store', tmp_path / 'states.db']
+    run_script('run.py', *args, '--data', transactions,
+               '--output', tmp_path / 'full.csv')
+    for part in ['first', 'second']:
+        run_script('run.py', *args, *store, '--data',
+                   tmp_path / ('%s.csv' % part),
+                   '--output', tmp_path / ('%s-out.csv' % part))
+
+    full = pd.read_csv(tmp_path / 'full.csv', dtype=str,
+                       keep_default_na=False)
+    for part, rows in [('first', first), ('second', ~first)]:
+        resumed = pd.read_csv(tmp_path / ('%s-out.csv' % part), dtype=str,
+                              keep_default_na=False)
+        pd.testing.assert_frame_equal(
+            resumed, full[rows].reset_index(drop=True))
@@ -1,10 +1,483 @@
-from collections import Counter
+import pandas as pd
+import numpy as np
 
-def feature_frequencies(df):
-    def next_freq(f):
-        size = df.shape[0]
-        return dict([(k, float(v) / size)
-                     for k, v in Counter(df[f].values).items()])
+from hashing import value_hash
+from sketch import CountMinSketch
 
-    keys_ = df.keys()
-    return {f: next_freq(f) for f in keys_}
+
+def running_counts(keys):
+    """
+    Number of occurrences of each key up to (and including) its position.
+    """
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    index = np.arange(len(keys))
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    run_starts = np.maximum.accumulate(np.where(starts, index, 0))
+
+    ret = np.empty(len(keys), dtype=np.int64)
+    ret[order] = index - run_starts + 1
+    return ret
+
+
+class Dictionary(object):
+    """
+    Growing dictionary of the distinct values of a feature. Each value gets
+    an integer code, in order of first appearance (or of the categories of a
+    Categorical), and keeps it as the dictionary grows. Missing values are
+    encoded as -1.
+    """
+    def __init__(self):
+        self.values = pd.Index([], dtype=object)
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, values):
+        if isinstance(values, pd.Categorical):
+            # Translate the codes of the categories
+            known = self.encode(np.asarray(values.categories, dtype=object))
+            return np.append(known, -1)[values.codes]
+
+        # Look up the distinct values only
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        known = self.values.get_indexer(uniques)
+
+        new = known < 0
+        if new.any():
+            known[new] = np.arange(len(self.values),
+                                   len(self.values) + new.sum())
+            self.values = self.values.append(
+                pd.Index(uniques[new], dtype=object))
+
+        return np.append(known, -1)[codes]
+
+    def categorical(self, values):
+        """ Encodes the values as a Categorical backed by the dictionary. """
+        return pd.Categorical.from_codes(self.encode(values),
+                                         categories=self.values)
+
+
+class FrequencyTable(object):
+    """
+    Array-backed table of the frequency of each value: an index with the
+    distinct values and an array of frequencies aligned with it.
+    """
+    def __init__(self, values, frequencies):
+        self.values = pd.Index(values, dtype=object)
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self._dict = None
+        self._looked_up = None
+
+    @classmethod
+    def from_counts(cls, values, counts):
+        """ Frequencies of the values among the total of their counts. """
+        return cls(values, count_frequencies(counts))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, value):
+        return self.as_dict()[value]
+
+    def get(self, value, default=None):
+        return self.as_dict().get(value, default)
+
+    def items(self):
+        return zip(self.values, self.frequencies.tolist())
+
+    def lookup(self, values=None):
+        """
+        Mapping with the frequencies of the given values (a Categorical or an
+        array), for the scoring engines; the table itself if None. Only the
+        distinct values are looked up, and the mapping of the categories of
+        the last Categorical is kept, so that the next ones extending them
+        (e.g. of the next chunks, see Dictionary) only look up their new
+        categories.
+        """
+        if values is None:
+            return self
+        if not isinstance(values, pd.Categorical):
+            return self._mapping(pd.unique(np.asarray(values, dtype=object)))
+
+        categories = values.categories
+        if self._looked_up is not None:
+            known, ret = self._looked_up
+            if categories is known:
+                return ret
+            if (len(categories) > len(known) and
+                    categories[:len(known)].equals(known)):
+                ret.update(self._mapping(categories[len(known):]))
+                self._looked_up = (categories, ret)
+                return ret
+
+        ret = self._mapping(categories)
+        self._looked_up = (categories, ret)
+        return ret
+
+    def _mapping(self, values):
+        # Dictionary of the frequencies of the distinct values found
+        values = np.asarray(values, dtype=object)
+        frequencies = self._frequencies(values)
+        found = ~np.isnan(frequencies)
+        return dict(zip(values[found].tolist(),
+                        frequencies[found].tolist()))
+
+    def _frequencies(self, values):
+        # Frequencies of the distinct values, NaN if not found
+        positions = self.values.get_indexer(values)
+        return np.where(positions >= 0, self.frequencies[positions], np.nan)
+
+    def as_dict(self):
+        """
+        The table as a dictionary, built once, for the lookups of single
+        values.
+        """
+        if self._dict is None:
+            self._dict = dict(zip(self.values, self.frequencies.tolist()))
+        return self._dict
+
+    def __getstate__(self):
+        # The lookup dictionaries are rebuilt when needed
+        state = self.__dict__.copy()
+        state['_dict'] = None
+        state['_looked_up'] = None
+        return state
+
+
+def count_frequencies(counts):
+    """ Frequencies of the values among the total of their counts. """
+    counts = np.asarray(counts, dtype=np.int64)
+    return counts / float(counts.sum())
+
+
+# Bytes of a value of a frequency table in a model artifact, besides its
+# text: the type tag, the offset, the hash and the two frequencies
+VALUE_BYTES = 33
+
+
+def _value_nbytes(values):
+    return np.fromiter((len(str(v)) + VALUE_BYTES for v in values),
+                       dtype=np.int64, count=len(values))
+
+
+def _value_ranks(values):
+    # Ranks of the distinct values in sorted order, of their texts if the
+    # values can not be compared
+    try:
+        return pd.factorize(values, sort=True)[0]
+    except TypeError:
+        return pd.factorize(np.asarray([str(v) for v in values],
+                                       dtype=object), sort=True)[0]
+
+
+class ApproximateFrequencyTable(FrequencyTable):
+    """
+    Frequency table with the exact frequencies of the most frequent values
+    of a feature (the heavy hitters), and the counts of the other values in
+    a count-min sketch (see sketch.py). The frequencies of the other values
+    are overestimated by at most e / width of the total count of the sketch
+    (see `tail_error`), with probability 1 - exp(-depth).
+    """
+    def __init__(self, values, frequencies, sketch, total):
+        super(ApproximateFrequencyTable, self).__init__(values, frequencies)
+        self.sketch = sketch
+        self.total = total
+
+    @classmethod
+    def from_counts(cls, values, counts, nbytes, depth=4):
+        """
+        Approximates the frequencies of the values in about `nbytes` bytes:
+        the most frequent values that fit in half of them are kept exactly,
+        and the others are counted in a sketch of the remaining bytes.
+        """
+        values = np.asarray(values, dtype=object)
+        counts = np.asarray(counts, dtype=np.int64)
+        total = int(counts.sum())
+
+        # The ties are broken by value, so that the same counts keep the
+        # same values in any order
+        by_count = np.lexsort((_value_ranks(values), -counts))
+        fits = np.cumsum(_value_nbytes(values[by_count])) <= nbytes // 2
+        heavy = np.zeros(len(values), dtype=bool)
+        heavy[by_count[fits]] = True
+
+        sketch = CountMinSketch.for_budget(
+            nbytes - int(_value_nbytes(values[heavy]).sum()), depth)
+        sketch.add(np.fromiter((value_hash(v) for v in values[~heavy]),
+                               dtype=np.uint64, count=int((~heavy).sum())),
+                   counts[~heavy])
+
+        return cls(values[heavy], counts[heavy] / float(total), sketch,
+                   total)
+
+    @property
+    def tail_error(self):
+        """ Bound of the overestimate of the frequencies of the sketch. """
+        return np.e / self.sketch.width * self.sketch.total / self.total
+
+    def __getitem__(self, value):
+        ret = self.get(value)
+        if ret is None:
+            raise KeyError(value)
+        return ret
+
+    def get(self, value, default=None):
+        ret = self.as_dict().get(value)
+        if ret is not None:
+            return ret
+
+        try:
+            count = self.sketch.estimate_one(value_hash(value))
+        except TypeError:
+            return default
+        return count / self.total if count else default
+
+    def _frequencies(self, values):
+        # The values that are not heavy hitters are estimated at once
+        ret = super(ApproximateFrequencyTable, self)._frequencies(values)
+        tail = []
+        hashes = []
+        for i in np.flatnonzero(np.isnan(ret)).tolist():
+            value = values[i]
+            if value is None or value != value:
+                continue
+            try:
+                hashes.append(value_hash(value))
+            except TypeError:
+                continue
+            tail.append(i)
+
+        counts = self.sketch.estimate(np.array(hashes, dtype=np.uint64))
+        for i, count in zip(tail, counts.tolist()):
+            if count:
+                ret[i] = count / self.total
+        return ret
+
+
+def frequency_tables(value_counts, nbytes=None):
+    """
+    Frequency tables of the features, given the values of each feature and
+    their counts. With a budget of `nbytes` bytes, it is shared among the
+    tables, the smaller ones first: the tables that fit in their share are
+    exact, and the others are approximated (see ApproximateFrequencyTable).
+    """
+    if nbytes is None:
+        return {f: FrequencyTable.from_counts(values, counts)
+                for f, (values, counts) in value_counts.items()}
+
+    sizes = {f: int(_value_nbytes(values).sum())
+             for f, (values, _) in value_counts.items()}
+    ret = {}
+    remaining = nbytes
+    for i, f in enumerate(sorted(value_counts, key=lambda f: sizes[f])):
+        share = remaining // (len(value_counts) - i)
+        values, counts = value_counts[f]
+        if sizes[f] <= share:
+            ret[f] = FrequencyTable.from_counts(values, counts)
+            remaining -= sizes[f]
+        else:
+            ret[f] = ApproximateFrequencyTable.from_counts(values, counts,
+                                                           share)
+            remaining -= share
+
+    return {f: ret[f] for f in value_counts}
+
+def feature_codes(values):
+    """
+    Dense integer codes of a feature (a Categorical or an array of values),
+    with all the missing values sharing the last code. Returns the codes and
+    the number of codes.
+    """
+    if isinstance(values, pd.Categorical):
+        codes = values.codes.astype(np.int64)
+        codes[codes < 0] = len(values.categories)
+        return codes, len(values.categories) + 1
+
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes, len(uniques)
+
+
+def _sort_codes(values):
+    # Dense codes that sort like the values, with the missing values last
+    codes, uniques = pd.factorize(values, sort=True)
+    codes[codes < 0] = len(uniques)
+    return codes, len(uniques)
+
+
+def _sorted_values(values):
+    # Codes that sort like the values (a Categorical or an array of values),
+    # -1 for the missing values, and the sorted distinct values
+    if isinstance(values, pd.Categorical):
+        ranks, uniques = pd.factorize(
+            np.asarray(values.categories, dtype=object), sort=True)
+        codes = values.codes.astype(np.int64)
+        return np.where(codes >= 0, ranks[codes], -1), uniques
+
+    codes, uniques = pd.factorize(np.asarray(values), sort=True)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def distinct_counts(accounts, values):
+    """
+    Number of distinct accounts with each value of a feature, given the
+    sorted codes of the accounts (-1 for the missing accounts). Returns the
+    values and their counts, ordered by the first appearance of each value
+    among the (account, value) pairs sorted by account and value.
+    """
+    codes, uniques = _sorted_values(values)
+    return _distinct_pair_counts(accounts, codes, uniques)
+
+
+def _distinct_pair_counts(accounts, codes, uniques):
+    # Same as `distinct_counts`, given the codes that sort like the values
+    # (-1 if missing) and the sorted distinct values
+    valid = (accounts >= 0) & (codes >= 0)
+    if not valid.any():
+        return uniques[:0], np.zeros(0, dtype=np.int64)
+
+    pairs = np.sort(accounts[valid].astype(np.int64) * len(uniques) +
+                    codes[valid])
+    pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])]
+    codes = pairs % len(uniques)
+    present, first = np.unique(codes, return_index=True)
+    order = present[np.argsort(first)]
+
+    return uniques[order], np.bincount(codes, minlength=len(uniques))[order]
+
+
+def last_sorted_account(accounts, previous=None):
+    """
+    Checks that the accounts of a batch of transactions (the missing ones
+    aside) are sorted, after the last account `previous` of the batches
+    before. Returns the last account of the batches so far.
+    """
+    accounts = np.asarray(accounts, dtype=object)
+    accounts = accounts[pd.notnull(accounts)]
+    if previous is not None:
+        accounts = np.append(np.asarray([previous], dtype=object), accounts)
+    if (accounts[1:] < accounts[:-1]).any():
+        raise ValueError('The transactions must be sorted by accountid')
+    return accounts[-1] if len(accounts) else previous
+
+
+def continue_times(accounts, times, states):
+    """
+    Checks that the transactions of each account of a batch come after those
+    of its states (a ValueError is raised otherwise), and keeps the last time
+    of each account in its states (as `last_unixtime`). The missing times
+    are not checked.
+    """
+    accounts = np.asarray(accounts, dtype=object)
+    times = np.asarray(times, dtype=np.float64)
+    valid = pd.notnull(accounts) & ~np.isnan(times)
+    spans = pd.Series(times[valid]).groupby(accounts[valid],
+                                            sort=False).agg(['min', 'max'])
+
+    for account, first in zip(spans.index, spans['min'].values):
+        if account in states and \
+                first < states[account].get('last_unixtime', first):
+            raise ValueError('The transactions of the account %s must be in '
+                             'time order' % account)
+    for account, last in zip(spans.index, spans['max'].values):
+        states.setdefault(account, {})['last_unixtime'] = float(last)
+
+
+class DistinctCounts(object):
+    """
+    Number of distinct accounts with each value of a feature across batches
+    of transactions sorted by account, with all the transactions of an
+    account in a single batch. Only the distinct values and their counts are
+    kept, which are the same as `distinct_counts` of all the batches
+    together: the accounts of each batch come after those of the batches
+    before, so the values first appearing in a batch come after the others.
+    """
+    def __init__(self):
+        self.values = Dictionary()
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, accounts, values):
+        """ Adds a batch, given the sorted codes of its accounts. """
+        uniques, counts = distinct_counts(accounts, values)
+        codes = self.values.encode(uniques)
+        self.counts = np.append(self.counts, np.zeros(
+            len(self.values) - len(self.counts), dtype=np.int64))
+        self.counts[codes] += counts
+
+    def value_counts(self):
+        """ The values and their counts, as `distinct_counts`. """
+        return np.asarray(self.values.values, dtype=object), self.counts
+
+
+class AccountGroups(object):
+    """
+    Account-grouped view of a frame: the order that sorts the transactions by
+    account and time (the same stable order as sorting by
+    ['accountid', 'unixtime']), and the offsets of each account in the sorted
+    order. The transactions of the i-th account are
+    order[offsets[i]: offsets[i + 1]].
+    """
+    def __init__(self, accounts, times):
+        account_codes, missing = _sort_codes(np.asarray(accounts))
+        time_codes, _ = _sort_codes(np.asarray(times))
+        self.order = np.lexsort((time_codes, account_codes))
+
+        # Transactions without an account never share a history
+        sorted_codes = account_codes[self.order]
+        starts = np.ones(len(sorted_codes), dtype=bool)
+        starts[1:] = ((sorted_codes[1:] != sorted_codes[:-1]) |
+                      (sorted_codes[1:] == missing))
+        self.offsets = np.append(np.flatnonzero(starts), len(sorted_codes))
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(df['accountid'].values, df['unixtime'].values)
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def num_accounts(self):
+        return len(self.offsets) - 1
+
+    def take(self, values):
+        """ Returns the values in the account-sorted order. """
+        return np.asarray(values)[self.order]
+
+    def scatter(self, values):
+        """ Returns the account-sorted values in the original order. """
+        ret = np.empty_like(values)
+        ret[self.order] = values
+        return ret
+
+    def starts(self):
+        """ Boolean mask of the first sorted transaction of each account. """
+        ret = np.zeros(len(self.order), dtype=bool)
+        ret[self.offsets[:-1]] = True
+        return ret
+
+    def group_ids(self):
+        """ Account number of each sorted transaction. """
+        return np.repeat(np.arange(self.num_accounts), np.diff(self.offsets))
+
+    def running_max(self, values):
+        """
+        Maximum of the non-negative sorted values so far in each account.
+        """
+        values = np.asarray(values)
+        # Shift each account above the previous ones, so that a single
+        # cumulative maximum never crosses an account boundary
+        shift = (values.max() + 1 if len(values) else 0) * self.group_ids()
+        return np.maximum.accumulate(values + shift) - shift
+
+    def positions(self):
+        """ Position of each sorted transaction in its account's history. """
+        sizes = np.diff(self.offsets)
+        return (np.arange(len(self.order)) -
+                np.repeat(self.offsets[:-1], sizes))